@@ -0,0 +1,207 @@
+#!/usr/bin/python
+"""JSON Codec Benchmark of Kphue.
+
+Times decoding and encoding of a realistic full datastore (100 lights
+by default) with each JSON backend installed (see
+kphue.use_json_backend).  No Bridge is needed.
+"""
+import logging
+import sys
+import timeit
+
+from argparse import ArgumentParser
+
+import kphue
+
+DEFAULT_LIGHTS = 100
+DEFAULT_RUNS = 50
+
+LOG_LEVELS = ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG')
+DEFAULT_LOG_LEVEL = LOG_LEVELS[3]
+LOGGER = logging.getLogger()
+
+
+def parse_args():
+    """Parse user arguments and return as parser object.
+
+    Returns:
+        Parser object with arguments as attributes.
+    """
+    parser = ArgumentParser(description='Benchmark Kphue JSON backends.')
+    parser.add_argument('-l', '--lights', default=DEFAULT_LIGHTS, type=int,
+            help='Number of lights in the datastore.')
+    parser.add_argument('-r', '--runs', default=DEFAULT_RUNS, type=int,
+            help='Runs per measurement.')
+    parser.add_argument('-L', '--loglevel', choices=LOG_LEVELS,
+            default=DEFAULT_LOG_LEVEL, help='Set the logging level.')
+    args = parser.parse_args()
+    return args
+
+
+def make_datastore(light_count):
+    """Returns a datastore like GET /api/<user> on a large install.
+
+    Args:
+        light_count: Number of lights.
+
+    Returns:
+        Dictionary.
+    """
+    light_ids = [str(index) for index in range(1, light_count + 1)]
+    lights = {}
+    for light_id in light_ids:
+        lights[light_id] = {
+                'state': {
+                    'on': True, 'bri': 144, 'hue': 13088, 'sat': 212,
+                    'effect': 'none', 'xy': [0.5128, 0.4147], 'ct': 467,
+                    'alert': 'none', 'colormode': 'xy',
+                    'mode': 'homeautomation', 'reachable': True,
+                    },
+                'swupdate': {'state': 'noupdates',
+                             'lastinstall': '2020-01-01T10:00:00'},
+                'type': 'Extended color light',
+                'name': 'Hue color lamp %s' % light_id,
+                'modelid': 'LCT015',
+                'manufacturername': 'Signify Netherlands B.V.',
+                'productname': 'Hue color lamp',
+                'capabilities': {
+                    'certified': True,
+                    'control': {
+                        'mindimlevel': 1000, 'maxlumen': 806,
+                        'colorgamuttype': 'C',
+                        'colorgamut': [[0.6915, 0.3083], [0.17, 0.7],
+                                       [0.1532, 0.0475]],
+                        'ct': {'min': 153, 'max': 500},
+                        },
+                    'streaming': {'renderer': True, 'proxy': True},
+                    },
+                'config': {'archetype': 'sultanbulb', 'function': 'mixed',
+                           'direction': 'omnidirectional'},
+                'uniqueid': '00:17:88:01:03:%02x:%02x:%02x-0b' % (
+                        int(light_id) // 256, int(light_id) % 256, 11),
+                'swversion': '1.50.2_r30933',
+                }
+    groups = {}
+    for index in range(1, light_count // 5 + 1):
+        members = light_ids[(index - 1) * 5:index * 5]
+        groups[str(index)] = {
+                'name': 'Room %d' % index, 'lights': members,
+                'sensors': [], 'type': 'Room', 'class': 'Living room',
+                'state': {'all_on': True, 'any_on': True}, 'recycle': False,
+                'action': {
+                    'on': True, 'bri': 144, 'hue': 13088, 'sat': 212,
+                    'effect': 'none', 'xy': [0.5128, 0.4147], 'ct': 467,
+                    'alert': 'none', 'colormode': 'xy',
+                    },
+                }
+    scenes = {}
+    for index in range(light_count // 2):
+        group_id = str(index % len(groups) + 1)
+        scenes['scene%08d-on-0' % index] = {
+                'name': 'Scene %d' % index, 'type': 'GroupScene',
+                'group': group_id, 'lights': groups[group_id]['lights'],
+                'owner': 'kphue', 'recycle': False, 'locked': False,
+                'appdata': {'version': 1, 'data': 'abcde_r01_d01'},
+                'picture': '', 'lastupdated': '2020-01-01T10:00:00',
+                'version': 2,
+                }
+    sensors = {}
+    rules = {}
+    for index in range(1, light_count // 3 + 1):
+        sensors[str(index)] = {
+                'state': {'buttonevent': 34,
+                          'lastupdated': '2020-01-01T10:00:00'},
+                'swupdate': {'state': 'notupdatable', 'lastinstall': None},
+                'config': {'on': True}, 'name': 'Tap %d' % index,
+                'type': 'ZGPSwitch', 'modelid': 'ZGPSWITCH',
+                'manufacturername': 'Philips',
+                'productname': 'Hue tap switch',
+                'diversityid': 'd8cde5d5-0eef-4b95-b0f0-71ddd2952af4',
+                'uniqueid': '00:00:00:00:00:%02x:%02x:%02x-f2' % (
+                        index // 256, index % 256, 1),
+                'capabilities': {'certified': True, 'primary': True,
+                                 'inputs': []},
+                }
+        for button in (34, 16, 17, 18):
+            rules[str(len(rules) + 1)] = {
+                    'name': 'Tap %d.%d' % (index, button),
+                    'owner': 'kphue', 'created': '2020-01-01T10:00:00',
+                    'lasttriggered': 'none', 'timestriggered': 0,
+                    'status': 'enabled', 'recycle': False,
+                    'conditions': [
+                        {'address': '/sensors/%d/state/buttonevent' % index,
+                         'operator': 'eq', 'value': str(button)},
+                        {'address': '/sensors/%d/state/lastupdated' % index,
+                         'operator': 'dx'},
+                        ],
+                    'actions': [
+                        {'address': '/groups/0/action', 'method': 'PUT',
+                         'body': {'scene': 'scene%08d-on-0' % index}},
+                        ],
+                    }
+    config = {
+            'name': 'Philips hue', 'zigbeechannel': 15,
+            'bridgeid': '001788FFFE000001', 'mac': '00:17:88:00:00:01',
+            'apiversion': '1.30.0', 'swversion': '1930072020',
+            'localtime': '2020-01-01T10:00:00', 'timezone': 'UTC',
+            'whitelist': dict(('user%02d' % index, {
+                'last use date': '2020-01-01T10:00:00',
+                'create date': '2019-01-01T10:00:00',
+                'name': 'app#device %d' % index})
+                for index in range(30)),
+            }
+    return {'lights': lights, 'groups': groups, 'scenes': scenes,
+            'sensors': sensors, 'rules': rules, 'schedules': {},
+            'resourcelinks': {}, 'config': config}
+
+
+def measure(function, runs):
+    """Returns the best time of a function, in milliseconds.
+
+    Args:
+        function: Function without arguments.
+        runs: Number of runs.
+
+    Returns:
+        Milliseconds of the fastest run.
+    """
+    return min(timeit.repeat(function, number=1, repeat=runs)) * 1000
+
+
+def main():
+    """Main script.
+    """
+    datastore = make_datastore(ARGS.lights)
+    body = kphue.json_dumps(datastore)
+    LOGGER.info('Datastore: %d lights, %d bytes', ARGS.lights, len(body))
+    backends = ['json']
+    if kphue.orjson is not None:
+        backends.insert(0, 'orjson')
+    if kphue.ujson is not None:
+        backends.insert(-1, 'ujson')
+
+    print('%-8s %12s %12s %12s %12s' % ('backend', 'loads(str)',
+            'loads(bytes)', 'dumps', 'versions'))
+    for backend in backends:
+        kphue.use_json_backend(backend)
+        states = list(datastore['lights'].values())
+        results = (
+                # The old path: bytes decoded to str, then parsed.
+                measure(lambda: kphue.json_loads(body.decode('utf-8')),
+                        ARGS.runs),
+                measure(lambda: kphue.json_loads(body), ARGS.runs),
+                measure(lambda: kphue.json_dumps(datastore), ARGS.runs),
+                measure(lambda: [kphue.state_version(state)
+                                 for state in states], ARGS.runs),
+                )
+        print('%-8s %9.2f ms %9.2f ms %9.2f ms %9.2f ms'
+                % ((backend,) + results))
+    kphue.use_json_backend()
+    return 0
+
+
+if __name__ == '__main__':
+    ARGS = parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                        level=getattr(logging, ARGS.loglevel))
+    sys.exit(main())
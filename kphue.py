@@ -14,22 +14,157 @@ __version__ = '0.1.3'
 __copyright__ = 'Copyright (c) 2014, Kevin Park (penniesfromkevin@yahoo)'
 
 import collections
+import contextlib
+import copy
+import functools
+import hashlib
 import json
 import logging
 import os
 import platform
+import random
+import re
 import socket
+import struct
 import sys
+import tempfile
+import threading
 import time
 
 PY3K = sys.version_info[0] > 2
 if PY3K:
     import http.client as httplib
+    import queue
+    from collections.abc import Iterable
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    basestring = str
 else:
     import httplib
+    import Queue as queue
+    from collections import Iterable
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+try:
+    import ssl
+except ImportError:
+    ssl = None
+
+# Optional DTLS support, for entertainment streaming (python-mbedtls).
+try:
+    from mbedtls import tls as mbedtls_tls
+    from mbedtls.exceptions import TLSError as MbedTLSError
+except ImportError:
+    mbedtls_tls = None
+    MbedTLSError = None
+# Errors that end a DTLS session (none without python-mbedtls).
+_STREAM_TLS_ERRORS = (MbedTLSError,) if MbedTLSError else ()
+
+# Optional faster JSON libraries (see use_json_backend).
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 COMPLETION_DELAY = 1 # seconds
 CONFIG_FILE = '.kphue'
+# Last known Bridge state, kept next to CONFIG_FILE for warm starts.
+CACHE_FILE = '.kphue_cache'
+# Circuit breaker: consecutive failures before failing fast, and how long
+# to wait before probing for recovery.
+BREAKER_THRESHOLD = 3
+BREAKER_RECOVERY = 30 # seconds
+PROBE_TIMEOUT = 2 # seconds
+# Retries of idempotent requests, with jittered exponential backoff.
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.25 # seconds
+RETRY_MAX_DELAY = 4 # seconds
+# Threads used for requests made in parallel (e.g. across Bridges);
+# how many requests each Bridge has in flight is set by its dispatch
+# queue.
+PARALLEL_WORKERS = 16
+# Commands per second the Bridge handles well, for Lights and Groups.
+LIGHT_RATE = 10
+GROUP_RATE = 1
+# How late (seconds) an animation frame may be before it is merged into
+# the next frame for the same target.
+ANIMATION_MAX_LAG = 0.2
+# Seconds between sensor polls of a Cycler.
+CYCLER_INTERVAL = 0.5
+# Seconds between polls of a Reconciler.
+RECONCILE_INTERVAL = 5
+# Values a Bridge may report other than sent (fitted to the gamut or
+# range of a Light); a Reconciler accepts them instead of resending.
+SETTLE_KEYS = ('xy', 'ct')
+# Most schedules a Bridge can hold, and the description that marks the
+# ones kphue manages with sync_schedules.
+SCHEDULE_LIMIT = 100
+SCHEDULE_PREFIX = 'kphue'
+# Commands per second for other resources (rules, schedules, ...).
+RESOURCE_RATE = 5
+# Rule attributes that can be changed.
+RULE_FIELDS = ('name', 'status', 'conditions', 'actions')
+# Most actions a single Rule can hold.
+RULE_ACTION_LIMIT = 8
+# Name prefix of the rules and sensors made by Cycler.compile.
+CYCLE_PREFIX = 'kphue cycle'
+# Local Bridge discovery; results are cached in the config file under
+# DISCOVERY_KEY, keyed by Bridge ID.
+DISCOVERY_KEY = '_discovery'
+DISCOVERY_TIMEOUT = 3 # seconds
+REDISCOVERY_INTERVAL = 60 # seconds
+SSDP_ADDRESS = ('239.255.255.250', 1900)
+MDNS_ADDRESS = ('224.0.0.251', 5353)
+MDNS_SERVICE = '_hue._tcp.local'
+# Pinned Bridge certificate fingerprints (SHA-256), kept in the config
+# file under PINS_KEY, keyed by Bridge ID.
+PINS_KEY = '_pins'
+# Idle keep-alive connections kept per Bridge.
+KEEPALIVE_CONNECTIONS = 4
+# Requests in flight at once per Bridge; others wait in the dispatch
+# queue, served by priority class, most urgent first.
+DISPATCH_SLOTS = 4
+PRIORITIES = ('interactive', 'normal', 'background')
+# Adaptive (AIMD) in-flight limit: grows by one per AIMD_GROWTH_ROUNDS
+# rounds of requests answered in time, and is cut by AIMD_BACKOFF on
+# timeouts, connection errors, 503 responses or when latency exceeds
+# AIMD_LATENCY_FACTOR times the baseline.  Slow growth keeps the time
+# spent probing above what the Bridge handles short.
+DISPATCH_MIN_SLOTS = 1
+DISPATCH_MAX_SLOTS = 16
+AIMD_GROWTH_ROUNDS = 4
+AIMD_BACKOFF = 0.75
+AIMD_LATENCY_FACTOR = 2
+# CLIP v2 event stream: how long to wait for data (the Bridge sends
+# keep-alive comments) before reconnecting.
+EVENTSTREAM_TIMEOUT = 120 # seconds
+# Entertainment streaming: UDP (DTLS) port, and frames per second.
+STREAM_PORT = 2100
+STREAM_RATE = 25
+STREAM_CIPHER = 'TLS-PSK-WITH-AES-128-GCM-SHA256'
+# Local caching proxy (see HueProxy): port, and seconds between polls of
+# the full Bridge state.
+PROXY_PORT = 8089
+PROXY_INTERVAL = 1 # seconds
+# v1 buttonevent codes of the Hue tap switch, by v2 button control_id.
+TAP_BUTTONS = (34, 16, 17, 18)
+# v1 buttonevent code offsets (added to control_id * 1000) of v2 events.
+BUTTON_EVENTS = {
+        'initial_press': 0,
+        'repeat': 1,
+        'long_press': 1,
+        'short_release': 2,
+        'long_release': 3,
+        }
 LOGGER = logging.getLogger('kphue')
 
 KELVIN_MIN = 2000
@@ -58,1149 +193,6159 @@ class KphueTimeout(Exception):
     pass
 
 
-class Bridge(object):
-    """Hue Bridge interface.
+class KphueUnavailable(KphueException):
+    """Raised instead of waiting on a Bridge or Light known to be down.
     """
-    def __init__(self, ip=None, user=None, config_file=None):
-        """Initialize the Bridge selected.
+    pass
 
-        Args:
-            ip: IP address of the Bridge.
-            user: User name to use to connect to Bridge.
-            config_file: Path to file containing IP and user information.
-        """
-        home_dir = os.getenv(USER_HOME)
-        if config_file:
-            self.config_file = config_file
-        elif home_dir and os.access(home_dir, os.W_OK):
-            self.config_file = os.path.join(home_dir, CONFIG_FILE)
-        elif ('iPod' in platform.machine() or 'iPhone' in platform.machine()
-                or 'iPad' in platform.machine()):
-            self.config_file = os.path.join(home_dir, 'Documents', CONFIG_FILE)
-        else:
-            self.config_file = os.path.join(os.getcwd(), CONFIG_FILE)
 
-        self.ip = ip
-        self.user = user
-        self.name = None
+class KphueBadResponse(KphueException):
+    """Raised when the Bridge answers with something that is not JSON.
+    """
+    pass
 
-        self._state = None
-        self.apiversion = None
-        self.swversion = None
 
-        self.localtime = None
-        self.timezone = None
-        self.zigbeechannel = None
-        self.whitelist = None
+class KphueBusy(KphueException):
+    """Raised when the Bridge answers 503: too busy to handle a request.
+    """
+    pass
 
-        self.groups = []
-        self.lights = []
-        self.rules = []
-        self.scenes = []
-        self.schedules = []
-        self.sensors = []
 
-        self.all_lights = None
+class KphueCertificateError(KphueException):
+    """Raised when a Bridge certificate does not match the pinned one.
+    """
+    pass
 
-        self.connect()
-        self.refresh()
+
+class CircuitBreaker(object):
+    """Fail-fast guard for a Bridge or Light that keeps failing.
+
+    While closed, requests pass through.  After threshold consecutive
+    failures the breaker opens and refuses requests; once recovery
+    seconds have passed, a single trial request is let through
+    (half-open), and its outcome closes or re-opens the breaker; other
+    requests are refused while it is in flight (for up to recovery
+    seconds, in case its outcome is never recorded).  If a
+    probe function is given, it is also run in a background thread
+    while the breaker is open, so recovery is noticed without waiting
+    for the next real request.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, threshold=BREAKER_THRESHOLD,
+                 recovery=BREAKER_RECOVERY, probe=None):
+        """Initialize the breaker.
+
+        Args:
+            name: Name used in log messages.
+            threshold: Consecutive failures before opening.
+            recovery: Seconds to stay open before allowing a trial.
+            probe: Optional function that raises on failure; run in the
+                background while open.
+        """
+        self.name = name
+        self.threshold = threshold
+        self.recovery = recovery
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        # When the half-open trial request was let through
+        self._trial_at = None
+        self._probe = probe
+        self._probe_thread = None
+        self._lock = threading.Lock()
 
     def __repr__(self):
-        """Like default repr function, but add object name.
+        """Like default repr function, but add name and state.
 
         Returns:
             Object string representation.
         """
-        return '<{0}.{1} object "{2}" ({3}) at {4}>'.format(
+        return '<{0}.{1} "{2}" {3} at {4}>'.format(
                 self.__class__.__module__, self.__class__.__name__,
-                self.name, self.ip, hex(id(self)))
+                self.name, self.state, hex(id(self)))
 
-    def connect(self):
-        """Connect to the Hue bridge.
-        """
-        if self.ip and self.user:
-            LOGGER.info('Already connected to %s as %s', self.ip, self.user)
-            return
-        LOGGER.info('Connecting bridge...')
-        try:
-            with open(self.config_file, 'r') as file_handle:
-                config = json.loads(file_handle.read())
-            self.ip = config.keys()[0]
-            LOGGER.info('Using ip %s', self.ip)
-            self.user = config[self.ip]['username']
-            LOGGER.info('Using username %s', self.user)
-        except IOError:
-            LOGGER.warning('Could not read %s; try registering',
-                    self.config_file)
-        except KeyError:
-            LOGGER.warning('Malformed file %s; try registering',
-                    self.config_file)
-        if not self.ip or not self.user:
-            self.register()
+    def allow(self):
+        """Returns whether a request may be attempted now.
 
-    def refresh(self):
-        """Refresh certain attribute values from actual Bridge device.
+        Returns:
+            Boolean; False while the breaker is open.
         """
-        responses = self.api_request('GET', 'config/')
-        self._state = responses
-        for attr in self._state:
-            if hasattr(self, attr):
-                setattr(self, attr, hue_decode(self._state[attr]))
+        with self._lock:
+            if not self._available():
+                return False
+            if self.state == self.OPEN:
+                LOGGER.info('%s: Trying again after %s s', self.name,
+                        self.recovery)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                self._trial_at = time.time()
+            return True
+
+    def available(self):
+        """Returns whether allow() would let a request through.
+
+        Unlike allow(), this does not use up the half-open trial.
 
-        self.refresh_lights()
-        self.refresh_groups()
-        self.refresh_rules()
-        self.refresh_scenes()
-        self.refresh_schedules()
-        self.refresh_sensors()
+        Returns:
+            Boolean; False while the breaker is open, or half-open with
+            the trial request in flight.
+        """
+        with self._lock:
+            return self._available()
 
-        if self.all_lights:
-            self.all_lights.refresh()
-        else:
-            self.all_lights = Group(self, 0)
+    def _available(self):
+        """Returns whether a request may be attempted now; lock held.
+        """
+        now = time.time()
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.recovery
+        if self.state == self.HALF_OPEN and self._trial_at is not None:
+            return now - self._trial_at >= self.recovery
+        return True
+
+    def record_success(self):
+        """Close the breaker after a successful request.
+        """
+        with self._lock:
+            if self.state != self.CLOSED:
+                LOGGER.info('%s: Recovered', self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._trial_at = None
+
+    def record_failure(self):
+        """Count a failed request, opening the breaker if needed.
+        """
+        with self._lock:
+            self.failures += 1
+            if (self.state == self.HALF_OPEN
+                    or self.failures >= self.threshold):
+                self._open()
+
+    def trip(self):
+        """Open the breaker immediately (e.g. light reported unreachable).
+        """
+        with self._lock:
+            self.failures = max(self.failures, self.threshold)
+            self._open()
 
-    def register(self):
-        """Register computer with Hue bridge hardware.
+    def _open(self):
+        """Open the breaker and start the background probe; lock held.
         """
-        LOGGER.debug('Registering')
-        registration_request = {'devicetype': 'kphue'}
-        data = json.dumps(registration_request)
-        responses = self.request('POST', '/api', data)
-        LOGGER.debug('Responses: %s', responses)
-        for response in responses:
-            if 'success' in response:
-                LOGGER.info('Writing config file %s', self.config_file)
-                config_contents = {self.ip: response['success']}
-                with open(self.config_file, 'w') as file_handle:
-                    file_handle.write(json.dumps(config_contents))
-                self.connect()
+        if self.state != self.OPEN:
+            LOGGER.warning('%s: Unavailable; failing fast for %s s',
+                    self.name, self.recovery)
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self._trial_at = None
+        if self._probe and not (self._probe_thread
+                                and self._probe_thread.is_alive()):
+            self._probe_thread = threading.Thread(target=self._run_probe,
+                    name='kphue-probe-%s' % self.name)
+            self._probe_thread.daemon = True
+            self._probe_thread.start()
+
+    def _run_probe(self):
+        """Probe in the background until the breaker closes.
+        """
+        while self.state != self.CLOSED:
+            time.sleep(self.recovery)
+            if self.state == self.CLOSED:
                 break
-            elif 'error' in response:
-                raise KphueException(response)
+            try:
+                self._probe()
+            except (KphueException, KphueTimeout, socket.error):
+                LOGGER.debug('%s: Probe failed', self.name)
+                with self._lock:
+                    self.opened_at = time.time()
+            else:
+                self.record_success()
 
-    def request(self, mode, address='', data=None, timeout=10):
-        """Utility function for HTTP GET/PUT requests for the API.
+
+class RetryPolicy(object):
+    """Which failed requests to retry, and how long to wait in between.
+
+    Only idempotent requests are retried: GET, DELETE and PUT, except a
+    PUT with relative (*_inc) values.  POST requests create resources,
+    so they are never retried; a retry after a lost response would
+    create a duplicate.  Delays grow exponentially from base_delay up
+    to max_delay, with "full jitter" (a random delay up to that bound)
+    so that many clients do not retry in lockstep.
+    """
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        """Initialize the policy.
+
+        Args:
+            attempts: Total attempts per request, including the first.
+            base_delay: Backoff bound before the first retry, in seconds.
+            max_delay: Largest backoff bound, in seconds.
+        """
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_idempotent(self, mode, data=None):
+        """Returns whether a request can safely be sent more than once.
 
         Args:
             mode: One of: ('GET', 'DELETE', 'PUT', 'POST')
-            address: Connection address.
-            data: Optional data required for PUT and POST requests.
-            timeout: Timeout for making connections.
+            data: JSON bytes (or string) sent with the request.
 
         Returns:
-            Response object.
+            Boolean.
         """
-        LOGGER.debug('request: %s %s %s', mode, address, data)
-        try:
-            connection = httplib.HTTPConnection(self.ip, timeout=timeout)
-            if mode in ('GET', 'DELETE'):
-                connection.request(mode, address)
-            elif mode in ('PUT', 'POST'):
-                connection.request(mode, address, data)
-        except socket.timeout:
-            raise KphueTimeout('request: %s %s %s timed out.'
-                    % (mode, address, data))
-        except socket.error:
-            raise KphueException('request: %s %s %s socket.error.'
-                    ' Wrong bridge IP?' % (mode, address, data))
-        response = connection.getresponse()
-        connection.close()
-        result_str = response.read()
-        if PY3K:
-            result_str = str(result_str, encoding='utf-8')
-        LOGGER.debug('response: %s', result_str)
-        result = json.loads(result_str)
-        return result
+        if mode in ('GET', 'DELETE'):
+            return True
+        if mode == 'PUT':
+            if isinstance(data, bytes):
+                return b'_inc"' not in data
+            return not (data and '_inc"' in data)
+        return False
 
-    def api_request(self, mode, address='', data=None, timeout=10):
-        """Request with api and user prepended.
+    def delay(self, retry):
+        """Returns how long to wait before a retry.
 
         Args:
-            mode: One of: ('GET', 'DELETE', 'PUT', 'POST')
-            address: Connection address.
-            data: Optional data required for PUT and POST requests.
-            timeout: Timeout for making connections.
+            retry: Number of the retry, starting at 0.
 
         Returns:
-            Response object.
+            Delay in seconds.
         """
-        api_address = '/api/%s/%s' % (self.user, address)
-        response = self.request(mode, api_address, data, timeout)
-        return response
+        bound = min(self.max_delay, self.base_delay * 2 ** retry)
+        return random.uniform(0, bound)
 
-    # Groups ###########################################################
-    def create_group(self, name, *args):
-        """Create a new light Group.
+
+class Transport(object):
+    """HTTP or HTTPS connections to one Bridge, kept alive for reuse.
+
+    Idle connections are pooled, so most requests skip the TCP (and TLS)
+    handshake.  With HTTPS, new connections resume the last TLS session,
+    and the Bridge certificate is checked against a pinned fingerprint
+    instead of a certificate authority.
+    """
+    def __init__(self, host=None, https=False, check_pin=None):
+        """Initialize the transport.
 
         Args:
-            name: Name of new Group.
-            args: Light IDs or names to be part of the Group.
-                This can also include lists of IDs and names.
+            host: Bridge IP, optionally with ':port'.
+            https: Whether to use HTTPS.
+            check_pin: For HTTPS, function taking the SHA-256 hex
+                fingerprint of the Bridge certificate, raising
+                KphueCertificateError if it is not the pinned one.
+        """
+        self.host = host
+        self.https = https
+        self.check_pin = check_pin
+        self.session = None
+        # Which requests may be sent again after an idle connection failed
+        self.retry_policy = RetryPolicy()
+        # Handshakes made, and how many of them resumed a TLS session
+        self.connections = 0
+        self.resumed = 0
+        self._idle = []
+        self._lock = threading.Lock()
+        self._context = None
+        if https:
+            if ssl is None:
+                raise KphueException('HTTPS needs the ssl module')
+            # Bridge certificates are self-signed (or signed by the
+            # vendor); they are checked against the pin instead.
+            self._context = ssl.create_default_context()
+            self._context.check_hostname = False
+            self._context.verify_mode = ssl.CERT_NONE
+
+    def __repr__(self):
+        """Like default repr function, but add host and scheme.
 
         Returns:
-            Integer ID of new Group created, or None on error.
+            Object string representation.
         """
-        lights = self.get_lights(args)
-        address = 'groups'
-        data = {
-                'name': name,
-                'lights': [str(light.index) for light in lights],
-                }
-        response = self.api_request('POST', address, json.dumps(data))[0]
-        if 'success' in response:
-            id_string = response['success']['id']
-            new_id = int(id_string.split('/')[-1])
-        else:
-            LOGGER.error('Creating Group %s: %s', name,
-                    response['error']['description'])
-            new_id = None
-        wait()
-        self.refresh_groups()
-        return new_id
+        return '<{0}.{1} {2}://{3} at {4}>'.format(
+                self.__class__.__module__, self.__class__.__name__,
+                'https' if self.https else 'http', self.host, hex(id(self)))
 
-    def delete_group(self, name_or_id):
-        """Delete a light Group.
+    def request(self, mode, address, data=None, timeout=10, headers=None):
+        """Send one request, reusing an idle connection if there is one.
+
+        If an idle connection fails, an idempotent request (see
+        RetryPolicy.is_idempotent) is sent again once on a new
+        connection.  Other requests are not: the Bridge may have acted
+        on them before the connection failed.
 
         Args:
-            name_or_id: Name (string) or ID (integer) of Group to
-                delete.
+            mode: One of: ('GET', 'DELETE', 'PUT', 'POST')
+            address: Connection address.
+            data: Optional data required for PUT and POST requests.
+            timeout: Timeout in seconds.
+            headers: Optional dictionary of extra HTTP headers.
 
         Returns:
-            Boolean: True on success, False on errors.
+            Response body bytes.
+
+        Raises:
+            socket.error or httplib.HTTPException as raised by httplib,
+            KphueBusy and KphueCertificateError.
         """
-        return_status = True
-        group = self.get_group(name_or_id)
-        if not group:
-            LOGGER.warning('No group returned for deletion')
-            return_status = False
-        else:
-            LOGGER.info('%s: Delete', group._identifier)
-            address = 'groups/%d' % group.index
-            responses = self.api_request('DELETE', address)
-            for response in responses:
-                if not 'success' in response:
-                    LOGGER.error('Group %s: Delete error: %s', name_or_id,
-                                 response['error']['description'])
-                    return_status = False
-        self.refresh_groups()
-        return return_status
+        connection = None
+        with self._lock:
+            if self._idle:
+                connection = self._idle.pop()
+        if connection is not None:
+            try:
+                return self._exchange(connection, mode, address, data,
+                        timeout, headers)
+            except socket.timeout:
+                raise
+            except (socket.error, httplib.HTTPException) as error:
+                if not self.retry_policy.is_idempotent(mode, data):
+                    raise
+                LOGGER.debug('%s: Idle connection closed (%s)', self.host,
+                        error)
+        return self._exchange(self._new_connection(timeout), mode, address,
+                data, timeout, headers)
+
+    def close(self):
+        """Close all idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for connection in idle:
+            connection.close()
 
-    def get_group(self, *args):
-        """Returns a Group object specified by name or ID.
+    def _new_connection(self, timeout):
+        """Returns a new (not yet connected) connection object.
 
         Args:
-            *args: Name (string) or ID (integer) to select.
+            timeout: Timeout in seconds.
+        """
+        if self.https:
+            return _PinnedHTTPSConnection(self, timeout)
+        return _CountedHTTPConnection(self, timeout)
+
+    def _exchange(self, connection, mode, address, data, timeout,
+                  headers=None):
+        """Send a request on a connection, and read the whole response.
+
+        Args:
+            connection: HTTP(S) connection object.
+            mode: HTTP method.
+            address: Connection address.
+            data: Optional request body.
+            timeout: Timeout in seconds.
+            headers: Optional dictionary of extra HTTP headers.
 
         Returns:
-            Single Group matching the requested name or ID, or None.
+            Response body bytes.
         """
-        objects = self.get_groups(*args)
-        if objects:
-            the_one = objects[0]
+        try:
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            if mode in ('GET', 'DELETE'):
+                connection.request(mode, address, headers=headers or {})
+            else:
+                connection.request(mode, address, data, headers or {})
+            response = connection.getresponse()
+            body = response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
         else:
-            the_one = None
-        return the_one
+            self._release(connection)
+        if response.status == 503:
+            raise KphueBusy('%s %s: Bridge busy (503).' % (mode, address))
+        return body
 
-    def get_groups(self, *args):
-        """Returns a list of Group objects specified by name or ID.
+    def _release(self, connection):
+        """Keep a connection for reuse, and its TLS session for resumption.
 
         Args:
-            *args: List of names (string) or IDs (integer) to select.
+            connection: HTTP(S) connection object, idle.
+        """
+        session = getattr(connection.sock, 'session', None)
+        if session is not None:
+            self.session = session
+        with self._lock:
+            if len(self._idle) < KEEPALIVE_CONNECTIONS:
+                self._idle.append(connection)
+                return
+        connection.close()
 
-        Returns:
-            List of Groups matching the requested names and IDs.
+
+class _CountedHTTPConnection(httplib.HTTPConnection):
+    """HTTP connection that counts its connects on the Transport.
+    """
+    def __init__(self, transport, timeout):
+        """Initialize a connection to the host of a Transport.
+
+        Args:
+            transport: Transport object owning the connection.
+            timeout: Socket timeout in seconds.
         """
-        self.refresh_groups()
-        objects = _get_from_pool(self.groups, *args)
-        return objects
+        httplib.HTTPConnection.__init__(self, transport.host,
+                timeout=timeout)
+        self._transport = transport
 
-    def refresh_groups(self):
-        """Refreshes the list of Group objects.
+    def connect(self):
+        """Connect, and count it.
         """
-        responses = self.api_request('GET', 'groups/')
-        for id_string in responses:
-            res_id = int(id_string)
-            for group in self.groups:
-                if group.index == res_id:
-                    group.refresh()
-                    res_id = None
-                    break
-            if res_id:
-                self.groups.append(Group(self, res_id))
+        httplib.HTTPConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._transport.connections += 1
 
-    # Lights ###########################################################
-    def get_light(self, *args):
-        """Returns a Light object specified by name or ID.
+
+if ssl is not None:
+    class _PinnedHTTPSConnection(httplib.HTTPSConnection):
+        """HTTPS connection that resumes TLS sessions and checks the pin.
+        """
+        def __init__(self, transport, timeout):
+            """Initialize a TLS connection to the host of a Transport.
+
+            Args:
+                transport: Transport object owning the connection, with
+                    its TLS context, session and pin.
+                timeout: Socket timeout in seconds.
+            """
+            httplib.HTTPSConnection.__init__(self, transport.host,
+                    timeout=timeout, context=transport._context)
+            self._transport = transport
+
+        def connect(self):
+            """Connect, resuming the last TLS session, and check the pin.
+            """
+            transport = self._transport
+            sock = socket.create_connection((self.host, self.port),
+                    self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            options = {}
+            if transport.session is not None:
+                options['session'] = transport.session
+            try:
+                self.sock = transport._context.wrap_socket(sock, **options)
+            except ValueError:
+                # The session can't be used (e.g. it expired); start anew.
+                transport.session = None
+                self.sock = transport._context.wrap_socket(sock)
+            transport.connections += 1
+            if getattr(self.sock, 'session_reused', False):
+                transport.resumed += 1
+            if transport.check_pin:
+                certificate = self.sock.getpeercert(binary_form=True)
+                try:
+                    transport.check_pin(
+                            hashlib.sha256(certificate).hexdigest())
+                except KphueCertificateError:
+                    self.sock.close()
+                    self.sock = None
+                    raise
+
+
+class RateLimiter(object):
+    """Token bucket limiting how many commands are sent per second.
+    """
+    def __init__(self, rate, burst=None):
+        """Initialize the limiter.
 
         Args:
-            *args: Name (string) or ID (integer) to select.
+            rate: Commands per second.
+            burst: Commands that may be sent at once after a pause;
+                defaults to rate (one second's worth).
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self._tokens = self.capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """Add the tokens earned since the last update; lock held.
+        """
+        now = time.time()
+        self._tokens = min(self.capacity,
+                self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self):
+        """Returns how long until a command may be sent.
 
         Returns:
-            Single Light matching the requested name or ID, or None.
+            Seconds; 0 if a command may be sent now.
         """
-        objects = self.get_lights(*args)
-        if objects:
-            the_one = objects[0]
-        else:
-            the_one = None
-        return the_one
+        with self._lock:
+            self._refill()
+            return max(0, (1 - self._tokens) / self.rate)
 
-    def get_lights(self, *args):
-        """Returns a list of Light objects specified by name or ID.
+    def acquire(self):
+        """Wait until a command may be sent, and count it.
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+class _ContextValue(object):
+    """Value local to the current context (contextvars), or thread.
+    """
+    def __init__(self, name, default=None):
+        """Initialize the value.
 
         Args:
-            *args: List of names (string) or IDs (integer) to select.
+            name: Name of the context variable.
+            default: Value until one is set.
+        """
+        self._default = default
+        if contextvars is not None:
+            self._var = contextvars.ContextVar(name, default=default)
+        else:
+            self._var = threading.local()
 
-        Returns:
-            List of Lights matching the requested names and IDs.
+    def get(self):
+        """Returns the value in this context.
         """
-        self.refresh_lights()
-        objects = _get_from_pool(self.lights, *args)
-        return objects
+        if contextvars is not None:
+            return self._var.get()
+        return getattr(self._var, 'value', self._default)
 
-    def refresh_lights(self):
-        """Refreshes the list of Light objects.
+    def set(self, value):
+        """Set the value in this context; returns a token for reset().
         """
-        responses = self.api_request('GET', 'lights/')
-        for id_string in responses:
-            res_id = int(id_string)
-            for light in self.lights:
-                if light.index == res_id:
-                    light.refresh()
-                    res_id = None
-                    break
-            if res_id:
-                self.lights.append(Light(self, res_id))
+        if contextvars is not None:
+            return self._var.set(value)
+        token = self.get()
+        self._var.value = value
+        return token
+
+    def reset(self, token):
+        """Undo set().
+        """
+        if contextvars is not None:
+            self._var.reset(token)
+        else:
+            self._var.value = token
 
-    # Rules ############################################################
-    def create_rule(self, name, *args):
-        """Create a new Rule.
+
+class AdaptiveLimit(object):
+    """AIMD limit of the requests a Bridge may have in flight.
+
+    The limit grows additively (by one per AIMD_GROWTH_ROUNDS rounds of
+    requests) while requests are answered in time and the limit is
+    actually reached, and is cut multiplicatively on timeouts,
+    connection errors, 503 responses or latency spikes.  Latency is a
+    spike when the smoothed round trip time exceeds AIMD_LATENCY_FACTOR
+    times the baseline, the lowest one seen (slowly drifting up, so it
+    follows a Bridge whose normal latency changes).  Like TCP, requests
+    sent before a cut don't cause another one: they were sent under the
+    old limit.
+    """
+    def __init__(self, initial=DISPATCH_SLOTS, minimum=DISPATCH_MIN_SLOTS,
+                 maximum=DISPATCH_MAX_SLOTS):
+        """Initialize the limit.
 
         Args:
-            name: Name of new Rule.
-            args: data.
+            initial: Starting limit.
+            minimum: Lowest limit.
+            maximum: Highest limit.
+        """
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.baseline = None
+        self.rtt = None
+        self.errors = 0
+        self.decreases = 0
+        self._decreased_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def slots(self):
+        """Requests currently allowed in flight.
 
         Returns:
-            Integer ID of new Rule created, or None on error.
+            Integer.
         """
-        address = 'rules'
-        data = {
-                }
-        response = self.api_request('POST', address, json.dumps(data))[0]
-        if 'success' in response:
-            id_string = response['success']['id']
-            new_id = int(id_string)
-        else:
-            LOGGER.error('Creating Rule %s: %s', name,
-                    response['error']['description'])
-            new_id = None
-        self.refresh_rules()
-        return new_id
+        return int(self.limit)
 
-    def delete_rule(self, name_or_id):
-        """Delete a Rule.
+    def record(self, rtt, succeeded=True, saturated=True):
+        """Adjust the limit for a finished request.
 
         Args:
-            name_or_id: Name (string) or ID (integer) of Rule to
-                delete.
-
-        Returns:
-            Boolean: True on success, False on errors.
+            rtt: Seconds the request took.
+            succeeded: False for timeouts, connection errors and 503.
+            saturated: Whether the limit was reached; it only grows
+                when it is what holds requests back.
         """
-        rule = self.get_rule(name_or_id)
-        LOGGER.info('b.%s: Delete', rule._identifier)
-        address = 'rules/%d' % rule.index
-        response = self.api_request('DELETE', address)
-        return_status = 'success' in response
-        if not return_status:
-            LOGGER.error('b.%s: Delete error: %s', rule._identifier,
-                    response['error']['description'])
-        self.refresh_rules()
-        return return_status
+        now = time.time()
+        with self._lock:
+            # Sent before the last cut, under the old limit.
+            stale = now - rtt < self._decreased_at
+            if not succeeded:
+                self.errors += 1
+                if not stale:
+                    self._decrease(now)
+                return
+            if self.baseline is None or rtt < self.baseline:
+                self.baseline = rtt
+            else:
+                self.baseline += (rtt - self.baseline) * 0.01
+            if stale:
+                return
+            if self.rtt is None:
+                self.rtt = rtt
+            else:
+                self.rtt += (rtt - self.rtt) * 0.5
+            if self.rtt > self.baseline * AIMD_LATENCY_FACTOR:
+                self._decrease(now)
+            elif saturated:
+                self.limit = min(self.maximum, self.limit
+                        + 1 / (self.limit * AIMD_GROWTH_ROUNDS))
 
-    def get_rule(self, *args):
-        """Returns a Rule object specified by name or ID.
+    def _decrease(self, now):
+        """Cut the limit; lock held.
 
         Args:
-            *args: Name (string) or ID (integer) to select.
-
-        Returns:
-            Single Rule matching the requested name or ID, or None.
+            now: Time of the cut.
         """
-        objects = self.get_rules(*args)
-        if objects:
-            the_one = objects[0]
-        else:
-            the_one = None
-        return the_one
-
-    def get_rules(self, *args):
-        """Returns a list of Rule objects specified by name or ID.
-
-        Args:
-            *args: List of names (string) or IDs (integer) to select.
+        self._decreased_at = now
+        # Measure afresh under the new limit.
+        self.rtt = None
+        self.limit = max(self.minimum, self.limit * AIMD_BACKOFF)
+        self.decreases += 1
+        LOGGER.debug('In-flight limit cut to %d', self.slots)
 
-        Returns:
-            List of Rules matching the requested names and IDs.
-        """
-        self.refresh_rules()
-        objects = _get_from_pool(self.rules, *args)
-        return objects
 
-    def get_rules_for_sensor(self, name_or_id):
-        """Get rules for a particular sensor.
+class _QueuedRequest(object):
+    """A request waiting in a DispatchQueue.
+    """
+    def __init__(self, rank, order, key):
+        """Initialize the request.
 
         Args:
-            name_or_id: Name or ID for sensor.
-
-        Returns:
-            List of Rules related to the given sensor.
+            rank: Index of its priority class in PRIORITIES.
+            order: Arrival number, for FIFO order within a class.
+            key: Key of a read, or None.
         """
-        sensor = self.get_sensors(name_or_id)
-        sensors = []
-        for rule in self.rules:
-            conditions = [condition for condition in rule.conditions]
-            for condition in conditions:
-                rule_sensor = int(condition['address'].split('/')[2])
-                if rule_sensor == sensor.index:
-                    sensors.append(rule)
-                    break
-        return sensors
+        self.rank = rank
+        self.order = order
+        self.key = key
+        self.granted = threading.Event()
+        self.done = threading.Event()
+        self.outcome = (False, KphueException('Request abandoned.'))
+
+
+class DispatchQueue(object):
+    """Lets a limited number of requests run, most urgent first.
+
+    Callers wait for one of the slots; when one frees up, it goes to
+    the waiting request of the most urgent class (see PRIORITIES), in
+    order of arrival.  A GET for an address already waiting in the
+    queue is not queued again: its caller shares the result of the
+    queued one, which is moved up to the more urgent class of the two.
+
+    The number of slots follows an AdaptiveLimit fed by record(), so a
+    Bridge is kept near the load it handles well.  Queueing delay is
+    reported per class; merged calls count the time until the shared
+    result arrives.
+    """
+    def __init__(self, slots=DISPATCH_SLOTS, adaptive=True):
+        """Initialize the queue.
 
-    def refresh_rules(self):
-        """Refreshes the list of Rule objects.
+        Args:
+            slots: Requests allowed in flight at once (at first, if
+                adaptive).
+            adaptive: Whether to adapt the slots to the Bridge.
         """
-        responses = self.api_request('GET', 'rules/')
-        if 'error' not in responses:
-            for id_string in responses:
-                res_id = int(id_string)
-                for rule in self.rules:
-                    if rule.index == res_id:
-                        rule.refresh()
-                        res_id = None
-                        break
-                if res_id:
-                    self.rules.append(Rule(self, res_id))
-
-    # Scenes ###########################################################
-    def get_scene(self, *args):
-        """Returns a Scene object specified by name or ID.
+        if adaptive:
+            self.limit = AdaptiveLimit(slots)
+        else:
+            self.limit = AdaptiveLimit(slots, slots, slots)
+        # class: [requests, merged, seconds waited, most seconds waited]
+        self.stats = collections.OrderedDict(
+                (level, [0, 0, 0, 0]) for level in PRIORITIES)
+        self._active = 0
+        self._waiting = []
+        self._queued_gets = {}
+        self._count = 0
+        self._held = threading.local()
+        self._lock = threading.Lock()
+
+    def call(self, function, level=None, key=None, deadline=None):
+        """Call a function once a slot is free.
 
         Args:
-            *args: Name (string) or ID (integer) to select.
+            function: Function without arguments making the request.
+            level: Priority class; default is the one set with
+                priority(), or 'normal'.
+            key: For reads, a key identifying the request; queued calls
+                with the same key are merged.
+            deadline: Optional bound on the time to wait for a slot (or
+                the result of a merged call), in seconds.  A request
+                given up leaves the queue; calls merged with it get the
+                same KphueTimeout.
 
         Returns:
-            Single Scene matching the requested name or ID, or None.
+            Result of the function; merged calls get a copy.
+
+        Raises:
+            KphueTimeout if the deadline passed while waiting.
         """
-        objects = self.get_scenes(*args)
-        if objects:
-            the_one = objects[0]
+        if getattr(self._held, 'slot', False):
+            # Nested request of a request already holding a slot.
+            return function()
+        level = level or _PRIORITY.get() or 'normal'
+        rank = PRIORITIES.index(level)
+        start = time.time()
+        with self._lock:
+            stats = self.stats[level]
+            stats[0] += 1
+            queued = self._queued_gets.get(key) if key else None
+            if queued is not None:
+                stats[1] += 1
+                queued.rank = min(queued.rank, rank)
+            else:
+                self._count += 1
+                entry = _QueuedRequest(rank, self._count, key)
+                if self._active < self.slots and not self._waiting:
+                    self._active += 1
+                    entry.granted.set()
+                else:
+                    self._waiting.append(entry)
+                    if key:
+                        self._queued_gets[key] = entry
+        if queued is not None:
+            if not queued.done.wait(deadline):
+                self._waited(stats, start)
+                raise KphueTimeout('Request waited longer than its deadline'
+                        ' of %s s.' % deadline)
+            self._waited(stats, start)
+            succeeded, outcome = queued.outcome
+            if not succeeded:
+                raise outcome
+            return copy.deepcopy(outcome)
+        if not entry.granted.wait(deadline):
+            with self._lock:
+                abandoned = not entry.granted.is_set()
+                if abandoned:
+                    self._waiting.remove(entry)
+                    if self._queued_gets.get(key) is entry:
+                        del self._queued_gets[key]
+            if abandoned:
+                self._waited(stats, start)
+                entry.outcome = (False, KphueTimeout('Request waited longer'
+                        ' than its deadline of %s s.' % deadline))
+                entry.done.set()
+                raise entry.outcome[1]
+        self._waited(stats, start)
+        self._held.slot = True
+        try:
+            result = function()
+        except Exception as error:
+            entry.outcome = (False, error)
+            raise
         else:
-            the_one = None
-        return the_one
+            entry.outcome = (True, result)
+            return result
+        finally:
+            self._held.slot = False
+            entry.done.set()
+            self._release()
+
+    def _waited(self, stats, start):
+        """Count the time a request waited; lock not held.
+        """
+        waited = time.time() - start
+        with self._lock:
+            stats[2] += waited
+            stats[3] = max(stats[3], waited)
+
+    @property
+    def slots(self):
+        """Requests currently allowed in flight.
+        """
+        return self.limit.slots
 
-    def get_scenes(self, *args):
-        """Returns a list of Scene objects specified by name or ID.
+    def record(self, rtt, succeeded=True):
+        """Adjust the slots for a finished request (see AdaptiveLimit).
 
         Args:
-            *args: List of names (string) or IDs (integer) to select.
-
-        Returns:
-            List of Scenes matching the requested names and IDs.
+            rtt: Seconds the request took.
+            succeeded: False for timeouts, connection errors and 503.
         """
-        self.refresh_scenes()
-        objects = _get_from_pool(self.scenes, *args)
-        return objects
+        with self._lock:
+            saturated = self._active >= self.slots or bool(self._waiting)
+        self.limit.record(rtt, succeeded, saturated)
 
-    def refresh_scenes(self):
-        """Refreshes the list of Scene objects.
+    def _release(self):
+        """Give free slots to the most urgent waiting requests.
+        """
+        with self._lock:
+            self._active -= 1
+            while self._waiting and self._active < self.slots:
+                entry = min(self._waiting,
+                        key=lambda entry: (entry.rank, entry.order))
+                self._waiting.remove(entry)
+                if entry.key is not None:
+                    self._queued_gets.pop(entry.key, None)
+                self._active += 1
+                entry.granted.set()
+
+    def report(self):
+        """Returns a table of requests and queueing delay per class.
 
-        Scenes seem to be different from other resources in some way.
+        Returns:
+            Multi-line string.
         """
-        responses = self.api_request('GET', 'scenes/')
-        LOGGER.debug('======================================')
-        for id_string in responses:
-            res_id = int(id_string.split('-')[-1])
-            # TODO: format of ID is not as API doc suggests
-            LOGGER.debug('scene id_string: %s --> %s', id_string, res_id)
-            for scene in self.scenes:
-                if scene.index == id_string:
-                    scene.refresh()
-                    id_string = None
-                    break
-            if id_string:
-                self.scenes.append(Scene(self, id_string))
+        limit = self.limit
+        lines = ['slots %d (%d cut, %d errors), rtt %s ms, baseline %s ms'
+                % (self.slots, limit.decreases, limit.errors,
+                   _milliseconds(limit.rtt), _milliseconds(limit.baseline))]
+        lines.append('%-12s %8s %8s %10s %10s' % ('class', 'requests',
+                'merged', 'avg ms', 'max ms'))
+        for level, (count, merged, waited, longest) in self.stats.items():
+            lines.append('%-12s %8d %8d %10.2f %10.2f' % (level, count,
+                    merged, waited * 1000 / max(1, count), longest * 1000))
+        return '\n'.join(lines)
+
+
+class RequestTracer(object):
+    """Counts Bridge requests per public kphue method.
+
+    While a tracer is active (as a context manager), every request made
+    in its context (the thread, or asyncio task, and the parallel_map
+    workers it starts) is attributed to the outermost public method of
+    a @traced class that led to it, e.g. 'Bridge.get_light', with its
+    bytes and latency.  Requests made outside any traced method are
+    listed as '(direct)'.  Requests of other threads are not counted.
+    """
+    def __init__(self):
+        """Initialize an empty tracer.
+        """
+        # method: [requests, bytes sent, bytes received, seconds]
+        self.stats = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._token = None
 
-    # Schedules ########################################################
-    def create_schedule(self, name, *args):
-        """Create a new Schedule.
+    def __enter__(self):
+        """Start tracing in this context.
+        """
+        self._token = _TRACERS.set(_TRACERS.get() + (self,))
+        return self
 
-        Args:
-            name: Name of new Schedule.
-            args: data
+    def __exit__(self, *exc_info):
+        """Stop tracing.
+        """
+        _TRACERS.reset(self._token)
+        self._token = None
 
-        Returns:
-            Integer ID of new Schedule created, or None on error.
+    @property
+    def requests(self):
+        """Total number of requests traced.
         """
-        # TODO
-        address = 'schedules'
-        data = {
-                }
-        response = self.api_request('POST', address, json.dumps(data))[0]
-        if 'success' in response:
-            new_id = int(response['success']['id'])
-        else:
-            LOGGER.error('Creating Schedule %s: %s', name,
-                    response['error']['description'])
-            new_id = None
-        self.refresh_schedules()
-        return new_id
+        return sum(stats[0] for stats in self.stats.values())
 
-    def get_schedule(self, *args):
-        """Returns a Schedule object specified by name or ID.
+    def record(self, method, sent, received, elapsed):
+        """Count one request.
 
         Args:
-            *args: Name (string) or ID (integer) to select.
+            method: Name of the public method, or None.
+            sent: Bytes sent.
+            received: Bytes received.
+            elapsed: Seconds taken.
+        """
+        with self._lock:
+            stats = self.stats.setdefault(method or '(direct)', [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += sent
+            stats[2] += received
+            stats[3] += elapsed
+
+    def report(self):
+        """Returns a table of requests, bytes and latency per method.
 
         Returns:
-            Single Schedule matching the requested name or ID, or None.
+            Multi-line string, busiest methods first.
         """
-        objects = self.get_schedules(*args)
-        if objects:
-            the_one = objects[0]
-        else:
-            the_one = None
-        return the_one
+        lines = ['%-32s %8s %10s %10s %10s %8s' % ('method', 'requests',
+                'sent', 'received', 'total ms', 'avg ms')]
+        for method, stats in sorted(self.stats.items(),
+                                    key=lambda item: -item[1][0]):
+            count, sent, received, elapsed = stats
+            lines.append('%-32s %8d %10d %10d %10.1f %8.2f' % (method,
+                    count, sent, received, elapsed * 1000,
+                    elapsed * 1000 / count))
+        return '\n'.join(lines)
 
-    def get_schedules(self, *args):
-        """Returns a list of Schedule objects specified by name or ID.
 
-        Args:
-            *args: List of names (string) or IDs (integer) to select.
+_TRACERS = _ContextValue('kphue_tracers', ())
+_TRACED_CALL = _ContextValue('kphue_traced_call')
+_PRIORITY = _ContextValue('kphue_priority')
 
-        Returns:
-            List of Schedules matching the requested names and IDs.
-        """
-        self.refresh_schedules()
-        objects = _get_from_pool(self.schedules, *args)
-        return objects
 
-    def delete_schedule(self, name_or_id):
-        """Delete a Schedule.
+def traced_call():
+    """Returns the public method being traced in this context, or None.
+    """
+    return _TRACED_CALL.get()
 
-        Args:
-            name_or_id: Name (string) or ID (integer) of Schedule to
-                delete.
 
-        Returns:
-            Boolean: True on success, False on errors.
-        """
-        schedule = self.get_schedule(name_or_id)
-        LOGGER.info('b.%s: Delete', schedule._identifier)
-        address = 'schedule/%d' % schedule.index
-        response = self.api_request('DELETE', address)
-        return_status = 'success' in response
-        if not return_status:
-            LOGGER.error('b.%s: Delete error: %s', schedule._identifier,
-                    response['error']['description'])
-        self.refresh_schedules()
-        return return_status
+@contextlib.contextmanager
+def priority(level):
+    """Send the requests made in this block with a priority class.
 
-    def refresh_schedules(self):
-        """Refreshes the list of Schedule objects.
-        """
-        responses = self.api_request('GET', 'schedules/')
-        for id_string in responses:
-            res_id = int(id_string)
-            for schedule in self.schedules:
-                if schedule.index == res_id:
-                    schedule.refresh()
-                    res_id = None
-                    break
-            if res_id:
-                self.schedules.append(Schedule(self, res_id))
+    Usage:
+        with kphue.priority('interactive'):
+            my_light.set('on', True)
 
-    # Sensors ##########################################################
-    def delete_sensor(self, name_or_id):
-        """Delete a Sensor.
+    Args:
+        level: One of PRIORITIES; None keeps the current class.
+    """
+    if level is None:
+        yield
+        return
+    if level not in PRIORITIES:
+        raise ValueError('Unknown priority: %s' % level)
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+@contextlib.contextmanager
+def traced_scope(name):
+    """Attribute requests in this block to a method, unless already set.
 
-        Args:
-            name_or_id: Name (string) or ID (integer) of Sensor to
-                delete.
+    Args:
+        name: Method name, e.g. 'Bridge.refresh'.
+    """
+    if name is None or traced_call() is not None:
+        yield
+        return
+    token = _TRACED_CALL.set(name)
+    try:
+        yield
+    finally:
+        _TRACED_CALL.reset(token)
 
-        Returns:
-            Boolean: True on success, False on errors.
+
+def _trace_call(function, attr):
+    """Returns method wrapped to attribute its requests to itself.
+
+    The name uses the class of the instance, so inherited methods are
+    reported as e.g. 'Group.set' rather than 'Luminous.set'.
+    """
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        """Set the traced method, if tracing and not set yet.
         """
-        sensor = self.get_sensor(name_or_id)
-        LOGGER.info('b.%s: Delete', sensor._identifier)
-        address = 'sensor/%d' % sensor.index
-        response = self.api_request('DELETE', address)
-        return_status = 'success' in response
-        if not return_status:
-            LOGGER.error('b.%s: Delete error: %s', sensor._identifier,
-                    response['error']['description'])
-        self.refresh_sensors()
-        return return_status
+        if not _TRACERS.get() or traced_call() is not None:
+            return function(self, *args, **kwargs)
+        token = _TRACED_CALL.set('%s.%s' % (self.__class__.__name__, attr))
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            _TRACED_CALL.reset(token)
+    return wrapper
 
-    def get_sensors(self, *args):
-        """Returns a Sensor object specified by name or ID.
 
-        Args:
-            *args: Name (string) or ID (integer) to select.
+def traced(cls):
+    """Class decorator: attribute requests to the public methods of cls.
 
-        Returns:
-            Single Sensor matching the requested name or ID, or None.
-        """
-        objects = self.get_sensors(*args)
-        if objects:
-            the_one = objects[0]
-        else:
-            the_one = None
-        return the_one
+    Public methods and property getters are wrapped; the cost while no
+    RequestTracer is active is a single check per call.
 
-    def get_sensors(self, *args):
-        """Returns a list of Sensor objects specified by name or ID.
+    Args:
+        cls: Class to decorate.
 
-        Args:
-            *args: List of names (string) or IDs (integer) to select.
+    Returns:
+        The class.
+    """
+    for attr, value in list(cls.__dict__.items()):
+        if attr.startswith('_'):
+            continue
+        if isinstance(value, property) and value.fget is not None:
+            setattr(cls, attr, property(_trace_call(value.fget, attr),
+                    value.fset, value.fdel, value.__doc__))
+        elif isinstance(value, (staticmethod, classmethod, type)):
+            continue
+        elif callable(value):
+            setattr(cls, attr, _trace_call(value, attr))
+    return cls
+
+
+class Field(object):
+    """One attribute of a resource, mapped from its API state.
+
+    Each resource class lists its Fields in _schema; the list is
+    compiled once per class (see compile_schema).
+    """
+    def __init__(self, attr, path=None, kind=None, settable=False):
+        """Define a Field.
 
-        Returns:
-            List of Sensors matching the requested names and IDs.
+        Args:
+            attr: Attribute name.
+            path: Key, or (key, subkey), of the value in the API state;
+                the attribute name if not given.
+            kind: Optional name of the value type in FIELD_TYPES (e.g.
+                'int'), used to convert it; values are used as is if
+                not given.
+            settable: Whether set() sends the attribute when it changes.
         """
-        self.refresh_sensors()
-        objects = _get_from_pool(self.sensors, *args)
-        return objects
+        self.attr = attr
+        if path is None:
+            path = attr
+        if isinstance(path, basestring):
+            path = (path,)
+        self.path = tuple(path)
+        self.kind = kind
+        self.settable = settable
 
-    def refresh_sensors(self):
-        """Refreshes the list of Sensor objects.
-        """
-        responses = self.api_request('GET', 'sensors/')
-        for id_string in responses:
-            res_id = int(id_string)
-            for sensor in self.sensors:
-                if sensor.index == res_id:
-                    sensor.refresh()
-                    res_id = None
-                    break
-            if res_id:
-                self.sensors.append(Sensor(self, res_id))
 
+def _luminous_fields(attr_key):
+    """Returns the Fields of the light state of a Light or Group.
 
-class HueResource(object):
-    """Generic Hue resource object wrapper.
+    Args:
+        attr_key: Key of the light state; 'state' or 'action'.
+
+    Returns:
+        Tuple of Fields.
     """
-    def __init__(self, parent_bridge, res_id, res_type):
-        """
+    return (
+            Field('on', (attr_key, 'on'), settable=True),
+            Field('effect', (attr_key, 'effect'), 'none', True),
+            Field('bri', (attr_key, 'bri'), 'int', True),
+            Field('hue', (attr_key, 'hue'), 'int', True),
+            Field('sat', (attr_key, 'sat'), 'int', True),
+            Field('ct', (attr_key, 'ct'), 'int', True),
+            Field('xy', (attr_key, 'xy'), 'xy', True),
+            )
+
+
+@traced
+class Bridge(object):
+    """Hue Bridge interface.
+    """
+    _schema = (
+            Field('name'),
+            Field('apiversion'),
+            Field('swversion'),
+            Field('bridgeid'),
+            Field('localtime'),
+            Field('timezone'),
+            Field('zigbeechannel', kind='int'),
+            Field('whitelist'),
+            )
+
+    def __init__(self, ip=None, user=None, config_file=None, cache=False,
+                 https=False):
+        """Initialize the Bridge selected.
+
+        Args:
+            ip: IP address of the Bridge.
+            user: User name to use to connect to Bridge.
+            config_file: Path to file containing IP and user information.
+            cache: If True, start from the state saved by the last run
+                (see CACHE_FILE) without waiting on the Bridge; it is
+                revalidated in the background, and before any write.
+            https: If True, use HTTPS; the Bridge certificate is pinned
+                on first use (see PINS_KEY).
         """
-        self.index = res_id
+        self.config_file = config_file or default_config_file()
+        self.cache = cache
+        self.transport = Transport(ip, https, self._check_pin)
+        # Fingerprint already checked against the pin
+        self._pin = None
+
+        self.ip = ip
+        self.user = user
         self.name = None
-        self._bridge = parent_bridge
-        self._type = res_type
-        self._identifier = '%s (%s)' % (self._type, self.index)
+
         self._state = None
+        self.apiversion = None
+        self.swversion = None
+        self.bridgeid = None
 
-        # Now get the actual values
-        self.refresh()
+        self.localtime = None
+        self.timezone = None
+        self.zigbeechannel = None
+        self.whitelist = None
+
+        self.groups = []
+        self.lights = []
+        # Light index by ID, for resolving Group members without requests
+        self._lights_by_id = {}
+        # Groups (including Group 0) by member Light ID
+        self._groups_by_light = {}
+        self.rules = []
+        # Rule indexes: by sensor ID, condition address and (address, value)
+        self._rules_by_sensor = {}
+        self._rules_by_address = {}
+        self._rules_by_condition = {}
+        self.scenes = []
+        self.schedules = []
+        self.sensors = []
+        self.resourcelinks = []
+
+        self.all_lights = None
+
+        self.breaker = CircuitBreaker('Bridge', probe=self._probe)
+        self.retry_policy = RetryPolicy()
+        self.rate_limits = {
+                'light': RateLimiter(LIGHT_RATE),
+                'group': RateLimiter(GROUP_RATE),
+                'resource': RateLimiter(RESOURCE_RATE),
+                }
+        self.dispatcher = DispatchQueue()
+        self._discovered_at = 0
+        # Set once state has been read from the Bridge (not the cache).
+        self._fresh = threading.Event()
+        self._revalidator = None
+
+        self.connect()
+        self.breaker.name = 'Bridge %s' % self.ip
+        if cache and self._load_cache():
+            self._revalidator = threading.Thread(target=self._revalidate,
+                    name='kphue-revalidate-%s' % self.ip)
+            self._revalidator.daemon = True
+            self._revalidator.start()
+        else:
+            self.refresh()
+        self._save_bridgeid()
 
     def __repr__(self):
-        """Like default python repr function, but add object name.
+        """Like default repr function, but add object name.
 
         Returns:
             Object string representation.
         """
         return '<{0}.{1} object "{2}" ({3}) at {4}>'.format(
                 self.__class__.__module__, self.__class__.__name__,
-                self.name, self.index, hex(id(self)))
+                self.name, self.ip, hex(id(self)))
 
-    def refresh(self):
-        """Refreshes object attributes and state information.
+    def connect(self):
+        """Connect to the Hue bridge.
+
+        The config file is a dictionary keyed by Bridge IP; if no IP was
+        given, the first Bridge listed is used.
         """
-        LOGGER.debug('%s: Refreshing', self._identifier)
-        self._state = self._bridge.api_request('GET', '%ss/%s' % (self._type,
-                self.index))
-        # TODO: Scenes error often (errors are list); API doc doesn't have GET
-        if isinstance(self._state, list):
-            self.name = self.index
-        elif PY3K:
-            self.name = self._state['name']
-        else:
-            self.name = self._state['name'].encode('utf-8')
-        self._identifier = '%s %s (%s)' % (self._type, self.name, self.index)
+        if self.ip and self.user:
+            LOGGER.info('Already connected to %s as %s', self.ip, self.user)
+            return
+        LOGGER.info('Connecting bridge...')
+        config = read_config(self.config_file)
+        try:
+            if not self.ip:
+                self.ip = config_bridges(config)[0]
+            LOGGER.info('Using ip %s', self.ip)
+            self.user = config[self.ip]['username']
+            LOGGER.info('Using username %s', self.user)
+        except (IndexError, KeyError, TypeError):
+            LOGGER.warning('No bridge %s in %s; try registering',
+                    self.ip, self.config_file)
+        if not self.ip:
+            self.ip = cached_bridge_ip(self.config_file)
+        if not self.ip:
+            found = discover_bridges(config_file=self.config_file)
+            if found:
+                self.ip = found[sorted(found)[0]]
+                LOGGER.info('Discovered ip %s', self.ip)
+        if not self.ip or not self.user:
+            self.register()
 
+    def rediscover(self):
+        """Look for this Bridge at a new IP (e.g. after a DHCP change).
 
-class Luminous(HueResource):
-    """Wrapper for objects that set light.
-    """
-    def __init__(self, parent_bridge, res_id, res_type):
+        This is only done when requests fail, at most once every
+        REDISCOVERY_INTERVAL seconds, and never for a Bridge at a
+        loopback address (e.g. a HueProxy).  The IP cached by an earlier
+        discovery is tried first; the network is only searched if the
+        Bridge does not answer there.  If the Bridge has moved, the
+        config file entry is moved to the new IP.
+
+        Returns:
+            Boolean; True if the Bridge was found at a new IP.
         """
+        if (not self.bridgeid or _is_loopback(self.ip)
+                or time.time() - self._discovered_at < REDISCOVERY_INTERVAL):
+            # A Bridge on this computer (e.g. a HueProxy) doesn't move.
+            return False
+        self._discovered_at = time.time()
+        new_ip = cached_bridge_ip(self.config_file, self.bridgeid,
+                exclude=self.ip)
+        if not new_ip:
+            found = discover_bridges(config_file=self.config_file)
+            new_ip = found.get(self.bridgeid.upper())
+        if not new_ip or new_ip == self.ip:
+            return False
+        LOGGER.warning('Bridge %s moved from %s to %s', self.bridgeid,
+                self.ip, new_ip)
+        config = read_config(self.config_file)
+        config[new_ip] = config.pop(self.ip, {'username': self.user})
+        write_config(self.config_file, config)
+        self.ip = new_ip
+        self.breaker.name = 'Bridge %s' % self.ip
+        self.breaker.record_success()
+        return True
+
+    def _save_bridgeid(self):
+        """Record the Bridge ID in the config file, for rediscovery.
         """
-        if res_type == 'group':
-            self._attr_key = 'action'
-        else:
-            self._attr_key = 'state'
-
-        self.effect = None
-        # "on" Boolean
-        self.on = None
+        if not self.bridgeid:
+            return
+        config = read_config(self.config_file)
+        entry = config.get(self.ip)
+        if entry is not None and entry.get('bridgeid') != self.bridgeid:
+            entry['bridgeid'] = self.bridgeid
+            write_config(self.config_file, config)
 
-        self.bri = None
-        # Internal value for previous brightness, to address a Hue bug
-        self._bri = None
+    def _check_pin(self, fingerprint):
+        """Check a Bridge certificate against the pinned one.
 
-        # Color modes: xy, ct, hs
-        #self.xy = None
-        #self.ct = None
-        #self.hue = None
-        #self.sat = None
-        # added mode: value = tuple(r, g, b) where r, g, b are 0 to 255
-        #self.rgb = None
+        The first certificate seen is pinned (trust on first use), in
+        the config file under PINS_KEY, keyed by Bridge ID.
 
-        # Time in ds (0.1 seconds!)
-        self.transitiontime = None
+        Args:
+            fingerprint: SHA-256 hex digest of the certificate.
 
-        super(Luminous, self).__init__(parent_bridge, res_id, res_type)
+        Raises:
+            KphueCertificateError if another certificate was pinned.
+        """
+        if fingerprint == self._pin:
+            return
+        config = read_config(self.config_file)
+        key = self.bridgeid or config.get(self.ip, {}).get('bridgeid')
+        key = key.upper() if key else self.ip
+        pins = config.setdefault(PINS_KEY, {})
+        if key != self.ip and key not in pins and self.ip in pins:
+            # Pinned before the Bridge ID was known.
+            pins[key] = pins.pop(self.ip)
+            write_config(self.config_file, config)
+        pinned = pins.get(key)
+        if pinned is None:
+            LOGGER.info('Pinning certificate of Bridge %s: %s', key,
+                    fingerprint)
+            pins[key] = fingerprint
+            write_config(self.config_file, config)
+        elif pinned != fingerprint:
+            raise KphueCertificateError('Bridge %s certificate %s does not'
+                    ' match pinned %s' % (key, fingerprint, pinned))
+        self._pin = fingerprint
 
     def refresh(self):
-        """Refreshes local attributes with actual values.
+        """Refresh attribute values and resources from actual Bridge device.
+
+        The whole datastore is read with a single request, and only
+        resources whose state changed are updated.
+        """
+        datastore = self.api_request('GET', '')
+        if isinstance(datastore, list):
+            raise KphueException('refresh: %s' % datastore)
+        all_lights = self.api_request('GET', 'groups/0')
+        self._apply_datastore(datastore, all_lights)
+        self._fresh.set()
+        if self.cache:
+            self._save_cache(datastore, all_lights)
+
+    def revalidate(self):
+        """Make sure state loaded from the cache was checked with the Bridge.
+
+        Waits for the background revalidation, or refreshes if it failed.
+        """
+        thread = self._revalidator
+        if thread and thread is not threading.current_thread():
+            thread.join()
+        if not self._fresh.is_set():
+            self.refresh()
+
+    def _revalidate(self):
+        """Background refresh of state loaded from the cache.
         """
-        super(Luminous, self).refresh()
-        self.on = hue_decode(self._state[self._attr_key]['on'])
+        try:
+            with priority('background'):
+                self.refresh()
+        except (KphueException, KphueTimeout) as error:
+            LOGGER.warning('Could not revalidate cached state: %s', error)
 
-        self.effect = hue_decode(self._state[self._attr_key]['effect'])
+    def _apply_datastore(self, datastore, all_lights=None):
+        """Update attributes and resources from a full datastore.
 
-        if 'hue' in self._state[self._attr_key]:
-            self.rgb = None
+        Args:
+            datastore: Dictionary as returned by GET /api/<user>.
+            all_lights: Optional state of Group 0 (all lights).
+        """
+        self._state = datastore.get('config', {})
+        decoder = compile_schema(self.__class__)[0]
+        self.__dict__.update(decoder(self._state))
+
+        # Lights first: Groups resolve their lights from self.lights.
+        self._update_pool(self.lights, Light, datastore.get('lights', {}))
+        self._update_pool(self.groups, Group, datastore.get('groups', {}))
+        self._update_pool(self.rules, Rule, datastore.get('rules', {}))
+        self._update_pool(self.scenes, Scene, datastore.get('scenes', {}))
+        self._update_pool(self.schedules, Schedule,
+                datastore.get('schedules', {}))
+        self._update_pool(self.sensors, Sensor, datastore.get('sensors', {}))
+        if 'resourcelinks' in datastore:
+            self._update_pool(self.resourcelinks, ResourceLink,
+                    datastore['resourcelinks'])
+
+        if all_lights is not None:
+            if self.all_lights:
+                self.all_lights.refresh(all_lights)
+            else:
+                self.all_lights = Group(self, 0, all_lights)
 
-            self.ct = int(self._state[self._attr_key]['ct'])
+    def _update_pool(self, pool, res_class, states):
+        """Update a list of resources from their states, in place.
 
-            self.hue = int(self._state[self._attr_key]['hue'])
-            self.sat = int(self._state[self._attr_key]['sat'])
-            self.bri = int(self._state[self._attr_key]['bri'])
+        Resources whose version marker is unchanged are left alone, new
+        ones are created, and ones no longer on the Bridge are removed.
 
-            self.xy = validate_xy(self._state[self._attr_key]['xy'])
-            self._state[self._attr_key]['xy'] = self.xy
+        Args:
+            pool: List of resources (e.g. self.lights).
+            res_class: Resource class (e.g. Light).
+            states: Dictionary of states, keyed by ID string.
+        """
+        existing = dict((res.index, res) for res in pool)
+        updated = []
+        for id_string in sorted(states, key=_id_sort_key):
+            state = states[id_string]
+            if res_class is Scene:
+                res_id = id_string
+            else:
+                res_id = int(id_string)
+            res = existing.get(res_id)
+            if res is None:
+                res = res_class(self, res_id, state)
+            elif res._version != state_version(state):
+                res.refresh(state)
+            updated.append(res)
+        for res in pool:
+            if res not in updated:
+                res._removed()
+        pool[:] = updated
+        if pool is self.lights:
+            self._lights_by_id = dict((light.index, light) for light in pool)
+
+    def _cache_file(self):
+        """Returns the path of the state cache file.
+        """
+        config_dir = os.path.dirname(os.path.abspath(self.config_file))
+        return os.path.join(config_dir, CACHE_FILE)
 
-    def turn_on(self):
-        """Turns lights on.
+    def _lookup(self, pool, refresh, args):
+        """Returns the resources of a pool specified by name or ID.
+
+        Normally the pool is refreshed first.  With the state cache on,
+        names are resolved from the loaded pool without any request
+        (the background revalidation keeps it up to date); the pool is
+        only refreshed if nothing matches, e.g. for a new resource.
+
+        Args:
+            pool: List of resource objects.
+            refresh: Method refreshing the pool.
+            args: Names (string) or IDs (integer) to select.
+
+        Returns:
+            List of matching resources.
         """
-        LOGGER.debug('%s: Turning on', self._identifier)
-        self.set('on', True)
+        if self.cache and pool:
+            objects = _get_from_pool(pool, *args)
+            if objects:
+                return objects
+        refresh()
+        return _get_from_pool(pool, *args)
 
-    def turn_off(self):
-        """Turns lights off.
+    def _load_cache(self):
+        """Load resources from the state cache, without any requests.
+
+        Returns:
+            Boolean; True if cached state for this Bridge was loaded.
         """
-        LOGGER.debug('%s: Turning off', self._identifier)
-        self.set('on', False)
+        cache_file = self._cache_file()
+        if not os.path.exists(cache_file):
+            return False
+        snapshot = read_config(cache_file).get(self.ip)
+        if not snapshot:
+            return False
+        LOGGER.info('Using state cached at %s',
+                time.ctime(snapshot.get('time', 0)))
+        self._apply_datastore(snapshot['datastore'],
+                snapshot.get('all_lights'))
+        return True
 
-    def reset(self):
-        """Reset all parameters to show white light.
+    def _save_cache(self, datastore, all_lights):
+        """Save the state of this Bridge to the state cache.
+
+        Args:
+            datastore: Dictionary as returned by GET /api/<user>.
+            all_lights: State of Group 0.
         """
-        LOGGER.debug('Resetting %s resource %s', self._type, self.name)
-        self.transitiontime = None
-        self.effect = None
-        self.bri = BRI_MAX
-        if 'hue' in self._state[self._attr_key]:
-            # Only the information for the selected colormode is needed.
-            #   http://www.developers.meethue.com/documentation/lights-api
-            # colormode is not set directly; follows priority xy > ct > hs.
-            # xy is default; is it more accurate to send hs-converted rgb?
-            self.rgb = None
-            rgb = [255, 255, 255]
-            self.ct = MIREDS_MIN
-            self.xy = rgb_to_xy(rgb)
-            self.hue, self.sat, self.bri = rgb_to_hsb(rgb)
-        # Turns on the light because:
-        #   http://www.developers.meethue.com/documentation/lights-api
-        # A light cannot have its hue, saturation, brightness, effect, ct or
-        # xy modified when it is turned off. Doing so will return error 201.
-        self.turn_on()
+        cache_file = self._cache_file()
+        snapshots = {}
+        if os.path.exists(cache_file):
+            snapshots = read_config(cache_file)
+        if 'whitelist' in datastore.get('config', {}):
+            # Don't leave the tokens of all apps on disk.
+            datastore = dict(datastore)
+            datastore['config'] = dict(datastore['config'])
+            del datastore['config']['whitelist']
+        snapshots[self.ip] = {
+                'time': int(time.time()),
+                'datastore': datastore,
+                'all_lights': all_lights,
+                }
+        write_config(cache_file, snapshots)
 
-    def set(self, parameter=None, value=None):
-        """Adjust properties of Luminous objects.
+    def register(self):
+        """Register computer with Hue bridge hardware.
 
-        Sets all values, including an optional override.
-        Some supported parameters and values:
-            'name': string
-            'on' : True | False
-            'xy' : [0.0 - 1.0, 0.0 - 1.0]
-            'ct' : 154 - 500
-            'hue': 0 - 65535
-            'sat': 0 - 254
-            'bri': 0 - 254
-            'alert': 'none', 'select', 'lselect'
-            'effect': 'none', 'colorloop'
-            'transitiontime': 0 - 30000 ds
+        The Bridge also generates a client key, stored with the user in
+        the config file; EntertainmentStream needs it for DTLS.
+        """
+        LOGGER.debug('Registering')
+        registration_request = {'devicetype': 'kphue',
+                                'generateclientkey': True}
+        data = json_dumps(registration_request)
+        responses = self.request('POST', '/api', data)
+        LOGGER.debug('Responses: %s', responses)
+        for response in responses:
+            if 'success' in response:
+                LOGGER.info('Writing config file %s', self.config_file)
+                config_contents = read_config(self.config_file)
+                config_contents[self.ip] = response['success']
+                write_config(self.config_file, config_contents)
+                self.connect()
+                break
+            elif 'error' in response:
+                raise KphueException(response)
+
+    def request(self, mode, address='', data=None, timeout=10,
+                deadline=None):
+        """Utility function for HTTP GET/PUT requests for the API.
+
+        Idempotent requests that time out or hit socket errors are
+        retried according to retry_policy.  Requests fail fast with
+        KphueUnavailable while the Bridge circuit breaker is open,
+        instead of waiting out the timeout again.  A request counts as
+        one breaker failure once all its attempts failed, however many
+        attempts were made.  A busy Bridge (503, KphueBusy) is retried
+        the same way, but does not count against the breaker.  Answers
+        that are not JSON (KphueBadResponse) came from a working Bridge,
+        and are neither retried nor counted.
 
         Args:
-            parameter: Name of API parameter to set.
-            value: Value to set.
+            mode: One of: ('GET', 'DELETE', 'PUT', 'POST')
+            address: Connection address.
+            data: Optional data required for PUT and POST requests.
+            timeout: Timeout for each attempt, in seconds.
+            deadline: Optional bound on the total time of all attempts
+                and backoff delays, in seconds.
 
         Returns:
-            Boolean; True on success, False on errors.
+            Response object.
         """
-        LOGGER.debug('%s: set(%s, %s)?', self._identifier, parameter, value)
-        if parameter:
-            if hasattr(self, parameter):
-                setattr(self, parameter, value)
+        policy = self.retry_policy
+        if policy.is_idempotent(mode, data):
+            attempts = policy.attempts
+        else:
+            attempts = 1
+        if deadline is not None:
+            end_time = time.time() + deadline
+        # Checked once: a half-open breaker lets a single request (with
+        # all its attempts) through.
+        if not self.breaker.allow():
+            raise KphueUnavailable('request: %s %s %s refused; %s is'
+                    ' down.' % (mode, address, _text(data),
+                    self.breaker.name))
+        # Whether an attempt failed other than by the Bridge being busy.
+        failed = False
+        for attempt in range(attempts):
+            attempt_timeout = timeout
+            if deadline is not None:
+                attempt_timeout = min(timeout, end_time - time.time())
+                if attempt_timeout <= 0:
+                    if failed:
+                        self.breaker.record_failure()
+                    raise KphueTimeout('request: %s %s %s exceeded'
+                            ' deadline of %s s.' % (mode, address,
+                            _text(data), deadline))
+            try:
+                result = self._send(mode, address, data, attempt_timeout)
+            except (KphueCertificateError, KphueBadResponse):
+                raise
+            except (KphueException, KphueTimeout) as error:
+                # A busy Bridge is up: back off, but don't trip the breaker.
+                busy = isinstance(error, KphueBusy)
+                failed = failed or not busy
+                if attempt + 1 >= attempts:
+                    if failed:
+                        self.breaker.record_failure()
+                    if busy:
+                        raise
+                    if self.rediscover():
+                        if deadline is not None:
+                            deadline = max(0, end_time - time.time())
+                        return self.request(mode, address, data, timeout,
+                                deadline)
+                    raise
+                delay = policy.delay(attempt)
+                if deadline is not None:
+                    delay = min(delay, max(0, end_time - time.time()))
+                LOGGER.info('request: %s %s failed (%s); retrying in %.2f s',
+                        mode, address, error, delay)
+                time.sleep(delay)
             else:
-                LOGGER.warning('%s: Attribute %s does not exist',
-                        self._identifier, parameter)
+                self.breaker.record_success()
+                return result
 
-        return_status = True
-        # Set attributes then state
-        for path in ('', '/%s' % self._attr_key):
-            if path:
-                data = self._form_state_data()
-            else:
-                data = self._form_attribute_data()
-            if return_status and data:
-                address = '%ss/%s%s' % (self._type, self.index, path)
-                json_data = json.dumps(data)
-                responses = self._bridge.api_request('PUT', address, json_data)
-                for response in responses:
-                    if 'error' in response:
-                        LOGGER.error('%s: %s', self._identifier,
-                                response['error']['description'])
-                        return_status = False
-                if not path:
-                    # self.lights doesn't update fast enough for refresh()
-                    wait()
+    def _send(self, mode, address='', data=None, timeout=10):
+        """Make a single HTTP request to the Bridge.
 
-        # Reload set values
-        self.refresh()
-        return return_status
+        Args:
+            mode: One of: ('GET', 'DELETE', 'PUT', 'POST')
+            address: Connection address.
+            data: Optional data required for PUT and POST requests.
+            timeout: Timeout for making connections.
 
-    def _form_attribute_data(self):
-        """Return object of values that have changed.
+        Returns:
+            Response object.
+        """
+        LOGGER.debug('request: %s %s %s', mode, address, _text(data))
+        if self.transport.host != self.ip:
+            # New Bridge IP (connected or rediscovered).
+            self.transport.close()
+            self.transport.host = self.ip
+        start = time.time()
+        # Whether the Bridge kept up, for the in-flight limit; None for
+        # errors that say nothing about its load (e.g. a pin mismatch).
+        kept_up = None
+        try:
+            result_bytes = self.transport.request(mode, address, data,
+                    timeout)
+            kept_up = True
+        except KphueBusy:
+            kept_up = False
+            raise
+        except socket.timeout:
+            kept_up = False
+            raise KphueTimeout('request: %s %s %s timed out.'
+                    % (mode, address, _text(data)))
+        except (socket.error, httplib.HTTPException):
+            kept_up = False
+            raise KphueException('request: %s %s %s socket.error.'
+                    ' Wrong bridge IP?' % (mode, address, _text(data)))
+        finally:
+            if kept_up is not None:
+                self.dispatcher.record(time.time() - start, kept_up)
+        tracers = _TRACERS.get()
+        if tracers:
+            method = traced_call()
+            elapsed = time.time() - start
+            for tracer in tracers:
+                tracer.record(method, len(data or b''), len(result_bytes),
+                        elapsed)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('response: %s', _text(result_bytes))
+        try:
+            result = json_loads(result_bytes)
+        except ValueError:
+            raise KphueBadResponse('request: %s %s %s invalid response: %s'
+                    % (mode, address, _text(data), _text(result_bytes[:80])))
+        return result
+
+    def _probe(self):
+        """Check whether the Bridge answers at all (for the breaker).
+
+        Raises:
+            KphueException or KphueTimeout if the Bridge does not answer.
+        """
+        self._send('GET', '/api/config', timeout=PROBE_TIMEOUT)
+
+    def api_request(self, mode, address='', data=None, timeout=10,
+                    deadline=None):
+        """Request with api and user prepended.
+
+        Requests go through the dispatch queue, in the priority class
+        set with kphue.priority() ('normal' by default).  Time spent
+        waiting in the queue counts against the deadline.
+
+        Args:
+            mode: One of: ('GET', 'DELETE', 'PUT', 'POST')
+            address: Connection address.
+            data: Optional data required for PUT and POST requests.
+            timeout: Timeout for each attempt, in seconds.
+            deadline: Optional bound on the total time, in seconds.
 
         Returns:
-            Returns data object prepared for API request.
+            Response object.
         """
-        attrs = {}
-        if self.name != self._state['name']:
-            attrs['name'] = self.name
-        if 'lights' in self._state:
-            lights = [int(l_id) for l_id in self._state['lights']]
-            for light in self.lights:
-                try:
-                    lights.remove(light.index)
-                except ValueError:
-                    lights = True
-                    break
-            if lights:
-                attrs['lights'] = [str(light.index) for light in self.lights]
-        if hasattr(self, 'scene') and self.scene:
-            attrs['scene'] = self.scene
-            self.scene = None
-        LOGGER.debug('%s: attributes = %s', self._identifier, attrs)
-        return attrs
+        if mode != 'GET' and not self._fresh.is_set():
+            # Don't write based on cached state that may be stale.
+            self.revalidate()
+        api_address = '/api/%s/%s' % (self.user, address)
+        if mode == 'GET':
+            key = api_address
+        else:
+            key = None
+        start = time.time()
+
+        def send():
+            """Make the request, within what is left of the deadline.
+            """
+            remaining = deadline
+            if deadline is not None:
+                remaining = deadline - (time.time() - start)
+            return self.request(mode, api_address, data, timeout, remaining)
+
+        response = self.dispatcher.call(send, key=key, deadline=deadline)
+        return response
 
-    def _form_state_data(self):
-        """Return object of values that have changed.
+    # Groups ###########################################################
+    def create_group(self, name, *args):
+        """Create a new light Group.
+
+        Args:
+            name: Name of new Group.
+            args: Light IDs or names to be part of the Group.
+                This can also include lists of IDs and names.
+
+        Returns:
+            Integer ID of new Group created, or None on error.
+        """
+        lights = self.get_lights(args)
+        address = 'groups'
+        data = {
+                'name': name,
+                'lights': [str(light.index) for light in lights],
+                }
+        response = self.api_request('POST', address, json_dumps(data))[0]
+        if 'success' in response:
+            id_string = response['success']['id']
+            new_id = int(id_string.split('/')[-1])
+        else:
+            LOGGER.error('Creating Group %s: %s', name,
+                    response['error']['description'])
+            new_id = None
+        wait()
+        self.refresh_groups()
+        return new_id
+
+    def create_entertainment_group(self, name, lights, group_class='TV'):
+        """Create a new Entertainment Group, for streaming.
+
+        Args:
+            name: Name of new Group.
+            lights: List of Light IDs, names or objects.
+            group_class: Entertainment class: 'TV' or 'Other'.
+
+        Returns:
+            Integer ID of new Group created, or None on error.
+        """
+        light_ids = [getattr(light, 'index', light) for light in lights]
+        data = {
+                'name': name,
+                'type': 'Entertainment',
+                'class': group_class,
+                'lights': [str(light.index) for light in
+                           _get_from_pool(self.lights, light_ids)],
+                }
+        response = self.api_request('POST', 'groups', json_dumps(data))[0]
+        if 'success' in response:
+            new_id = int(response['success']['id'].split('/')[-1])
+        else:
+            LOGGER.error('Creating Group %s: %s', name,
+                    response['error']['description'])
+            new_id = None
+        self.refresh_groups()
+        return new_id
+
+    def delete_group(self, name_or_id):
+        """Delete a light Group.
+
+        Args:
+            name_or_id: Name (string) or ID (integer) of Group to
+                delete.
+
+        Returns:
+            Boolean: True on success, False on errors.
+        """
+        return_status = True
+        group = self.get_group(name_or_id)
+        if not group:
+            LOGGER.warning('No group returned for deletion')
+            return_status = False
+        else:
+            LOGGER.info('%s: Delete', group._identifier)
+            address = 'groups/%d' % group.index
+            responses = self.api_request('DELETE', address)
+            for response in responses:
+                if not 'success' in response:
+                    LOGGER.error('Group %s: Delete error: %s', name_or_id,
+                                 response['error']['description'])
+                    return_status = False
+        self.refresh_groups()
+        return return_status
+
+    def get_group(self, *args):
+        """Returns a Group object specified by name or ID.
+
+        Args:
+            *args: Name (string) or ID (integer) to select.
+
+        Returns:
+            Single Group matching the requested name or ID, or None.
+        """
+        objects = self.get_groups(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_groups(self, *args):
+        """Returns a list of Group objects specified by name or ID.
+
+        Args:
+            *args: List of names (string) or IDs (integer) to select.
+
+        Returns:
+            List of Groups matching the requested names and IDs.
+        """
+        objects = self._lookup(self.groups, self.refresh_groups, args)
+        return objects
+
+    def refresh_groups(self):
+        """Refreshes the list of Group objects, with a single request.
+
+        Group members are resolved from the Lights already loaded; use
+        Group.refresh(refetch=True) to also reload the Lights.
+        """
+        responses = self.api_request('GET', 'groups/')
+        if isinstance(responses, dict):
+            self._update_pool(self.groups, Group, responses)
+
+    # Lights ###########################################################
+    def get_light(self, *args):
+        """Returns a Light object specified by name or ID.
+
+        Args:
+            *args: Name (string) or ID (integer) to select.
+
+        Returns:
+            Single Light matching the requested name or ID, or None.
+        """
+        objects = self.get_lights(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_lights(self, *args):
+        """Returns a list of Light objects specified by name or ID.
+
+        Args:
+            *args: List of names (string) or IDs (integer) to select.
+
+        Returns:
+            List of Lights matching the requested names and IDs.
+        """
+        objects = self._lookup(self.lights, self.refresh_lights, args)
+        return objects
+
+    def refresh_lights(self):
+        """Refreshes the list of Light objects.
+
+        All Light states (including reachability) come from a single
+        bulk request.
+        """
+        responses = self.api_request('GET', 'lights/')
+        if isinstance(responses, dict):
+            self._update_pool(self.lights, Light, responses)
+
+    def resolve_lights(self, light_ids):
+        """Returns the loaded Light objects for some Light IDs.
+
+        This is a lookup in the Light index; no requests are made.  IDs
+        of Lights not loaded (yet) are skipped.
+
+        Args:
+            light_ids: List of Light IDs (integers or strings).
+
+        Returns:
+            List of Lights, in the order of the IDs.
+        """
+        lights = []
+        for light_id in light_ids:
+            light = self._lights_by_id.get(int(light_id))
+            if light is None:
+                LOGGER.debug('Light %s is not loaded', light_id)
+            else:
+                lights.append(light)
+        return lights
+
+    def resource_at(self, address):
+        """Returns the loaded resource at a v1 address, without requests.
+
+        Args:
+            address: Address like '/lights/1' or '/scenes/abc-on-0'.
+
+        Returns:
+            Resource object, or None.
+        """
+        pools = {
+                'groups': self.groups,
+                'lights': self.lights,
+                'resourcelinks': self.resourcelinks,
+                'rules': self.rules,
+                'scenes': self.scenes,
+                'schedules': self.schedules,
+                'sensors': self.sensors,
+                }
+        parts = address.split('/')
+        if len(parts) != 3 or parts[1] not in pools:
+            return None
+        if parts[1] == 'scenes':
+            res_id = parts[2]
+        elif parts[2].isdigit():
+            res_id = int(parts[2])
+        else:
+            return None
+        if parts[1] == 'lights':
+            return self._lights_by_id.get(res_id)
+        resources = _get_from_pool(pools[parts[1]], res_id)
+        if resources:
+            return resources[0]
+        return None
+
+    def get_groups_for_light(self, name_or_id):
+        """Get the Groups that contain a Light.
+
+        This is a lookup in the membership index; no requests are made.
+        Group 0 (all lights) is not included.
+
+        Args:
+            name_or_id: Name or ID of Light, or Light object.
+
+        Returns:
+            List of Groups.
+        """
+        if isinstance(name_or_id, Light):
+            lights = [name_or_id]
+        else:
+            lights = _get_from_pool(self.lights, name_or_id)
+        if not lights:
+            return []
+        return [group for group in self._groups_by_light.get(
+                lights[0].index, []) if group.index != 0]
+
+    def _index_group(self, group):
+        """Add (or update) a Group in the membership index.
+
+        Args:
+            group: Group object, after its members were resolved.
+        """
+        self._unindex_group(group)
+        for light in group.lights:
+            groups = self._groups_by_light.setdefault(light.index, [])
+            if group not in groups:
+                groups.append(group)
+        group._indexed_lights = list(group.lights)
+
+    def _unindex_group(self, group):
+        """Remove a Group from the membership index.
+
+        Args:
+            group: Group object.
+        """
+        for light in group._indexed_lights:
+            groups = self._groups_by_light.get(light.index, [])
+            if group in groups:
+                groups.remove(group)
+        group._indexed_lights = []
+
+    def _light_updated(self, light):
+        """Update the aggregate state of the Groups containing a Light.
+
+        Only the change of this Light is applied, so the cost does not
+        depend on the size of the Groups.
+
+        Args:
+            light: Light object, after its state changed.
+        """
+        old = light._aggregate
+        new = light._aggregate_state()
+        if old == new:
+            return
+        light._aggregate = new
+        for group in self._groups_by_light.get(light.index, []):
+            group._member_changed(old, new)
+
+    def capture(self, *args):
+        """Save the current state of Lights, to restore later.
+
+        All states come from a single bulk request.
+
+        Usage:
+            snapshot = my_bridge.capture(my_bridge.lights)
+            # ... flash lights for a notification ...
+            snapshot.restore()
+
+        Args:
+            *args: Light objects, names or IDs to capture.
+
+        Returns:
+            LightSnapshot object.
+        """
+        return LightSnapshot(self, self.get_lights(*args))
+
+    def set_lights(self, lights, parameter=None, value=None):
+        """Set the same parameter on many Lights, skipping unavailable ones.
+
+        Reachability is refreshed with one bulk request first, and Lights
+        that are unreachable (or whose circuit breaker is open) are
+        skipped with a warning instead of being waited on.
+
+        Args:
+            lights: Light objects, names or IDs to set.
+            parameter: Name of API parameter to set.
+            value: Value to set.
+
+        Returns:
+            Boolean; True if all available Lights were set, False on
+            errors.
+        """
+        lights = self.get_lights(lights)
+        return_status = True
+        skipped = []
+        for light in lights:
+            if not light.is_available:
+                skipped.append(light.name)
+            elif not light.set(parameter, value):
+                return_status = False
+        if skipped:
+            LOGGER.warning('Skipped unavailable lights: %s',
+                    ', '.join(str(name) for name in skipped))
+        return return_status
+
+    # ResourceLinks ####################################################
+    def get_resourcelink(self, *args):
+        """Returns a ResourceLink object specified by name or ID.
+
+        Args:
+            *args: Name (string) or ID (integer) to select.
+
+        Returns:
+            Single ResourceLink matching the requested name or ID, or None.
+        """
+        objects = self.get_resourcelinks(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_resourcelinks(self, *args):
+        """Returns a list of ResourceLink objects specified by name or ID.
+
+        Args:
+            *args: List of names (string) or IDs (integer) to select.
+
+        Returns:
+            List of ResourceLinks matching the requested names and IDs.
+        """
+        objects = self._lookup(self.resourcelinks,
+                self.refresh_resourcelinks, args)
+        return objects
+
+    def refresh_resourcelinks(self):
+        """Refreshes the list of ResourceLink objects, with a single request.
+        """
+        responses = self.api_request('GET', 'resourcelinks/')
+        if isinstance(responses, dict):
+            self._update_pool(self.resourcelinks, ResourceLink, responses)
+
+    # Rules ############################################################
+    def create_rule(self, name, conditions, actions, status=None):
+        """Create a new Rule.
+
+        Args:
+            name: Name of new Rule.
+            conditions: List of condition dictionaries ('address',
+                'operator' and optional 'value').
+            actions: List of action dictionaries ('address', 'method'
+                and 'body').
+            status: Optional 'enabled' or 'disabled'.
+
+        Returns:
+            Integer ID of new Rule created, or None on error.
+        """
+        address = 'rules'
+        data = _rule_definition(name, conditions, actions, status)
+        response = self.api_request('POST', address, json_dumps(data))[0]
+        if 'success' in response:
+            id_string = response['success']['id']
+            new_id = int(id_string)
+            data['owner'] = self.user
+            self.rules.append(Rule(self, new_id, data))
+        else:
+            LOGGER.error('Creating Rule %s: %s', name,
+                    response['error']['description'])
+            new_id = None
+        return new_id
+
+    def delete_rule(self, name_or_id):
+        """Delete a Rule.
+
+        Args:
+            name_or_id: Name (string) or ID (integer) of Rule to
+                delete.
+
+        Returns:
+            Boolean: True on success, False on errors.
+        """
+        rule = self.get_rule(name_or_id)
+        if not rule:
+            LOGGER.warning('No rule returned for deletion')
+            return False
+        LOGGER.info('b.%s: Delete', rule._identifier)
+        address = 'rules/%d' % rule.index
+        return_status = True
+        for response in self.api_request('DELETE', address):
+            if 'error' in response:
+                LOGGER.error('b.%s: Delete error: %s', rule._identifier,
+                        response['error']['description'])
+                return_status = False
+        self.refresh_rules()
+        return return_status
+
+    def sync_rules(self, definitions, prefix=None):
+        """Make the Rules on the Bridge match a set of definitions.
+
+        Rules are matched by name; only the differences are sent: new
+        Rules are created, changed ones updated, and the managed Rules
+        not in the definitions deleted.  Managed Rules are those owned
+        by this user (and, with a prefix, whose name starts with it).
+
+        Args:
+            definitions: List of dictionaries with 'name', 'conditions',
+                'actions' and optional 'status'.
+            prefix: Optional name prefix of the managed Rules.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        self.refresh_rules()
+        definitions = [_rule_definition(data['name'], data['conditions'],
+                data['actions'], data.get('status'))
+                for data in definitions]
+        managed = [rule for rule in self.rules if rule.owner == self.user
+                   and (prefix is None or rule._state['name'].startswith(
+                       prefix))]
+
+        def key(data):
+            """Rules match by name.
+            """
+            return data.get('name')
+
+        return_status = self._sync_resources('rules', managed, definitions,
+                key)
+        self.refresh_rules()
+        return return_status
+
+    def get_rule(self, *args):
+        """Returns a Rule object specified by name or ID.
+
+        Args:
+            *args: Name (string) or ID (integer) to select.
+
+        Returns:
+            Single Rule matching the requested name or ID, or None.
+        """
+        objects = self.get_rules(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_rules(self, *args):
+        """Returns a list of Rule objects specified by name or ID.
+
+        Args:
+            *args: List of names (string) or IDs (integer) to select.
+
+        Returns:
+            List of Rules matching the requested names and IDs.
+        """
+        objects = self._lookup(self.rules, self.refresh_rules, args)
+        return objects
+
+    def get_rules_for_sensor(self, name_or_id):
+        """Get rules for a particular sensor.
+
+        This is a lookup in the rule index; no requests are made unless
+        the sensor is not known yet.
+
+        Args:
+            name_or_id: Name or ID for sensor, or Sensor object.
+
+        Returns:
+            List of Rules related to the given sensor.
+        """
+        sensors = _get_from_pool(self.sensors, name_or_id)
+        if not sensors:
+            sensors = self.get_sensors(name_or_id)
+        if not sensors:
+            return []
+        return list(self._rules_by_sensor.get(sensors[0].index, []))
+
+    def get_rules_for_condition(self, address, value=None):
+        """Get rules with a condition on an address (and value).
+
+        Args:
+            address: Condition address, e.g. '/sensors/2/state/buttonevent'.
+            value: Optional condition value, e.g. 34.
+
+        Returns:
+            List of Rules with a matching condition.
+        """
+        if value is None:
+            rules = self._rules_by_address.get(address, [])
+        else:
+            rules = self._rules_by_condition.get((address, str(value)), [])
+        return list(rules)
+
+    def get_rules_for_button(self, sensor, button):
+        """Get rules triggered by a sensor button.
+
+        Args:
+            sensor: Sensor object or ID.
+            button: buttonevent value.
+
+        Returns:
+            List of Rules.
+        """
+        sensor_id = getattr(sensor, 'index', sensor)
+        return self.get_rules_for_condition(
+                '/sensors/%s/state/buttonevent' % sensor_id, button)
+
+    def refresh_rules(self):
+        """Refreshes the list of Rule objects, with a single request.
+        """
+        responses = self.api_request('GET', 'rules/')
+        if isinstance(responses, dict):
+            self._update_pool(self.rules, Rule, responses)
+
+    def _index_rule(self, rule):
+        """Add (or update) a Rule in the rule indexes.
+
+        Args:
+            rule: Rule object, after a refresh.
+        """
+        self._unindex_rule(rule)
+        keys = []
+        for condition in rule.conditions or []:
+            address = condition.get('address')
+            if not address:
+                continue
+            keys.append((self._rules_by_address, address))
+            keys.append((self._rules_by_condition,
+                         (address, str(condition.get('value')))))
+            parts = address.split('/')
+            if len(parts) > 2 and parts[1] == 'sensors' and parts[2].isdigit():
+                keys.append((self._rules_by_sensor, int(parts[2])))
+        for index, key in keys:
+            rules = index.setdefault(key, [])
+            if rule not in rules:
+                rules.append(rule)
+        rule._index_keys = keys
+
+    def _unindex_rule(self, rule):
+        """Remove a Rule from the rule indexes.
+
+        Args:
+            rule: Rule object.
+        """
+        for index, key in rule._index_keys:
+            rules = index.get(key, [])
+            if rule in rules:
+                rules.remove(rule)
+            if not rules:
+                index.pop(key, None)
+        rule._index_keys = []
+
+    # Scenes ###########################################################
+    def get_scene(self, *args):
+        """Returns a Scene object specified by name or ID.
+
+        Args:
+            *args: Name (string) or ID (integer) to select.
+
+        Returns:
+            Single Scene matching the requested name or ID, or None.
+        """
+        objects = self.get_scenes(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_scenes(self, *args):
+        """Returns a list of Scene objects specified by name or ID.
+
+        Args:
+            *args: List of names (string) or IDs (integer) to select.
+
+        Returns:
+            List of Scenes matching the requested names and IDs.
+        """
+        objects = self._lookup(self.scenes, self.refresh_scenes, args)
+        return objects
+
+    def refresh_scenes(self):
+        """Refreshes the list of Scene objects, with a single request.
+
+        Scene IDs are strings (e.g. 'd88f04c36-on-0'), and are kept as is.
+        """
+        responses = self.api_request('GET', 'scenes/')
+        if isinstance(responses, dict):
+            self._update_pool(self.scenes, Scene, responses)
+
+    def create_scene(self, name, *args, **kwargs):
+        """Create a Scene from the current state of some Lights.
+
+        Light states are taken from the states already loaded, so no
+        per-light requests are made.
+
+        Args:
+            name: Name of new Scene.
+            args: Light IDs or names to be part of the Scene.
+                This can also include lists of IDs and names.
+            recycle: Optional Boolean; True lets the Bridge delete the
+                Scene when it needs room.  Defaults to False.
+
+        Returns:
+            String ID of new Scene created, or None on error.
+        """
+        lights = _get_from_pool(self.lights, args)
+        lightstates = dict((str(light.index),
+                            restorable_state(light._state['state']))
+                           for light in lights)
+        data = {
+                'name': name,
+                'lights': [str(light.index) for light in lights],
+                'recycle': kwargs.get('recycle', False),
+                'lightstates': lightstates,
+                }
+        response = self.api_request('POST', 'scenes', json_dumps(data))[0]
+        if 'success' in response:
+            new_id = response['success']['id']
+            self.scenes.append(Scene(self, new_id, data))
+        else:
+            LOGGER.error('Creating Scene %s: %s', name,
+                    response['error']['description'])
+            new_id = None
+        return new_id
+
+    def delete_scene(self, name_or_id):
+        """Delete a Scene.
+
+        Args:
+            name_or_id: Name or ID (string) of Scene to delete.
+
+        Returns:
+            Boolean: True on success, False on errors.
+        """
+        scene = _get_from_pool(self.scenes, name_or_id)
+        if not scene:
+            LOGGER.warning('No scene returned for deletion')
+            return False
+        scene = scene[0]
+        LOGGER.info('%s: Delete', scene._identifier)
+        responses = self.api_request('DELETE', 'scenes/%s' % scene.index)
+        return_status = True
+        for response in responses:
+            if 'error' in response:
+                LOGGER.error('%s: Delete error: %s', scene._identifier,
+                        response['error']['description'])
+                return_status = False
+        if return_status:
+            self.scenes.remove(scene)
+        return return_status
+
+    # Schedules ########################################################
+    def create_schedule(self, name, localtime, target, states,
+                        description='', autodelete=None):
+        """Create a new Schedule.
+
+        Args:
+            name: Name of new Schedule.
+            localtime: When to run, in API format (e.g.
+                'W124/T07:00:00' or '2015-01-01T07:00:00').
+            target: Light or Group to set, or a full API address.
+            states: Dictionary of state values to set.
+            description: Optional description.
+            autodelete: Optional Boolean; delete after running once.
+
+        Returns:
+            Integer ID of new Schedule created, or None on error.
+        """
+        address = 'schedules'
+        data = {
+                'name': name,
+                'description': description,
+                'localtime': localtime,
+                'command': {
+                    'address': self._command_address(target),
+                    'method': 'PUT',
+                    'body': states,
+                    },
+                }
+        if autodelete is not None:
+            data['autodelete'] = autodelete
+        response = self.api_request('POST', address, json_dumps(data))[0]
+        if 'success' in response:
+            new_id = int(response['success']['id'])
+            self.schedules.append(Schedule(self, new_id, data))
+        else:
+            LOGGER.error('Creating Schedule %s: %s', name,
+                    response['error']['description'])
+            new_id = None
+        return new_id
+
+    def get_schedule(self, *args):
+        """Returns a Schedule object specified by name or ID.
+
+        Args:
+            *args: Name (string) or ID (integer) to select.
+
+        Returns:
+            Single Schedule matching the requested name or ID, or None.
+        """
+        objects = self.get_schedules(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_schedules(self, *args):
+        """Returns a list of Schedule objects specified by name or ID.
+
+        Args:
+            *args: List of names (string) or IDs (integer) to select.
+
+        Returns:
+            List of Schedules matching the requested names and IDs.
+        """
+        objects = self._lookup(self.schedules, self.refresh_schedules, args)
+        return objects
+
+    def delete_schedule(self, name_or_id):
+        """Delete a Schedule.
+
+        Args:
+            name_or_id: Name (string) or ID (integer) of Schedule to
+                delete.
+
+        Returns:
+            Boolean: True on success, False on errors.
+        """
+        schedule = self.get_schedule(name_or_id)
+        if not schedule:
+            LOGGER.warning('No schedule returned for deletion')
+            return False
+        LOGGER.info('b.%s: Delete', schedule._identifier)
+        address = 'schedules/%d' % schedule.index
+        return_status = True
+        for response in self.api_request('DELETE', address):
+            if 'error' in response:
+                LOGGER.error('b.%s: Delete error: %s', schedule._identifier,
+                        response['error']['description'])
+                return_status = False
+        self.refresh_schedules()
+        return return_status
+
+    def refresh_schedules(self):
+        """Refreshes the list of Schedule objects, with a single request.
+        """
+        responses = self.api_request('GET', 'schedules/')
+        if isinstance(responses, dict):
+            self._update_pool(self.schedules, Schedule, responses)
+
+    def compile_timetable(self, timetable, prefix=SCHEDULE_PREFIX):
+        """Compile a timetable into as few Schedule definitions as possible.
+
+        Entries with the same time and states are merged, and their
+        lights are covered by existing Groups (including Group 0, all
+        lights) where possible, so one schedule sets a whole Group.
+
+        A timetable is a list of dictionaries like:
+            {
+                'localtime': 'W124/T07:00:00',
+                'lights': [light_name_or_id, ..],  # or 'group': name_or_id
+                'state': {'on': True, 'bri': 200},  # 'rgb' is allowed
+            }
+
+        Args:
+            timetable: List of timetable entries.
+            prefix: Description marking the Schedules as managed.
+
+        Returns:
+            List of Schedule definitions, as POSTed to the API.
+        """
+        merged = collections.OrderedDict()
+        for entry in timetable:
+            states = dict(entry['state'])
+            if 'rgb' in states:
+                states['xy'] = rgb_to_xy(states.pop('rgb'))
+            if 'xy' in states:
+                states['xy'] = [round(coord, 4) for coord in states['xy']]
+            if 'group' in entry:
+                groups = _get_from_pool([self.all_lights] + self.groups,
+                        entry['group'])
+                lights = [light for group in groups for light in group.lights]
+            else:
+                lights = _get_from_pool(self.lights, entry['lights'])
+            key = (entry['localtime'], json_dumps(states, sort_keys=True))
+            merged.setdefault(key, set()).update(
+                    light.index for light in lights)
+
+        definitions = []
+        for (localtime, states), light_ids in merged.items():
+            for target in self._cover_lights(light_ids):
+                definitions.append({
+                        'name': ('%s %s' % (prefix, target.name))[:32],
+                        'description': prefix,
+                        'localtime': localtime,
+                        'command': {
+                            'address': self._command_address(target),
+                            'method': 'PUT',
+                            'body': json_loads(states),
+                            },
+                        'status': 'enabled',
+                        })
+        return definitions
+
+    def sync_schedules(self, timetable, prefix=SCHEDULE_PREFIX):
+        """Make the managed Schedules on the Bridge match a timetable.
+
+        Only the differences are sent: new Schedules are created,
+        changed ones updated, and managed ones no longer needed deleted.
+        Schedules with another description are left alone.
+
+        Args:
+            timetable: List of timetable entries (see compile_timetable).
+            prefix: Description marking the Schedules as managed.
+
+        Returns:
+            Boolean; True on success, False on errors.
+
+        Raises:
+            KphueException if the Schedules would not fit on the Bridge.
+        """
+        self.refresh_schedules()
+        definitions = self.compile_timetable(timetable, prefix)
+        managed = [schedule for schedule in self.schedules
+                   if schedule.description == prefix]
+        total = len(self.schedules) - len(managed) + len(definitions)
+        if total > SCHEDULE_LIMIT:
+            raise KphueException('sync_schedules: %d schedules needed, but'
+                    ' the limit is %d' % (total, SCHEDULE_LIMIT))
+
+        def key(data):
+            """Schedules match if they run at the same time on the same target.
+            """
+            return (data.get('localtime'), data['command'].get('address'))
+
+        return_status = self._sync_resources('schedules', managed,
+                definitions, key)
+        self.refresh_schedules()
+        return return_status
+
+    def _command_address(self, target):
+        """Returns the full API address used to set a Light or Group.
+
+        Args:
+            target: Light or Group object, or an address string.
+
+        Returns:
+            Address string, e.g. '/api/<user>/groups/1/action'.
+        """
+        if isinstance(target, Luminous):
+            return '/api/%s/%ss/%s/%s' % (self.user, target._type,
+                    target.index, target._attr_key)
+        return target
+
+    def _cover_lights(self, light_ids):
+        """Returns the fewest Groups and Lights covering exactly some lights.
+
+        Groups are tried largest first, and only used if all their
+        lights are still uncovered; remaining lights are used directly.
+
+        Args:
+            light_ids: Collection of Light IDs.
+
+        Returns:
+            List of Group and Light objects.
+        """
+        remaining = set(light_ids)
+        targets = []
+        groups = sorted([self.all_lights] + self.groups,
+                key=lambda group: -len(group.lights))
+        for group in groups:
+            group_ids = set(light.index for light in group.lights)
+            if group_ids and group_ids <= remaining:
+                targets.append(group)
+                remaining -= group_ids
+        targets.extend(_get_from_pool(self.lights, sorted(remaining)))
+        return targets
+
+    def _sync_resources(self, res_type, existing, definitions, key):
+        """Make resources match definitions, sending only the differences.
+
+        Deletions go first (to make room), then updates, then creations;
+        all are paced by the 'resource' rate limit.
+
+        Args:
+            res_type: API resource type, e.g. 'schedules'.
+            existing: Resources that may be changed or deleted.
+            definitions: List of wanted resources, as POSTed to the API.
+            key: Function returning the matching key of a definition or
+                a resource state.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        by_key = {}
+        for res in existing:
+            by_key.setdefault(key(res._state), []).append(res)
+        creates = []
+        updates = []
+        for data in definitions:
+            matches = by_key.get(key(data))
+            if matches:
+                res = matches.pop(0)
+                changes = dict((attr, value) for attr, value in data.items()
+                               if res._state.get(attr) != value)
+                if changes:
+                    updates.append(('PUT', '%s/%s' % (res_type, res.index),
+                                    changes))
+            else:
+                creates.append(('POST', res_type, data))
+        deletes = [('DELETE', '%s/%s' % (res_type, res.index), None)
+                   for matches in by_key.values() for res in matches]
+        LOGGER.info('%s: %d to create, %d to update, %d to delete', res_type,
+                len(creates), len(updates), len(deletes))
+
+        return_status = True
+        limiter = self.rate_limits['resource']
+        for mode, address, data in deletes + updates + creates:
+            limiter.acquire()
+            if data is not None:
+                data = json_dumps(data)
+            for response in self.api_request(mode, address, data):
+                if 'error' in response:
+                    LOGGER.error('%s %s: %s', mode, address,
+                            response['error']['description'])
+                    return_status = False
+        return return_status
+
+    # Sensors ##########################################################
+    def create_sensor(self, name, sensor_type='CLIPGenericStatus',
+                      state=None, uniqueid=None):
+        """Create a new (software) Sensor.
+
+        Args:
+            name: Name of new Sensor.
+            sensor_type: CLIP sensor type, e.g. 'CLIPGenericStatus'.
+            state: Optional dictionary of initial state values.
+            uniqueid: Optional unique ID.
+
+        Returns:
+            Integer ID of new Sensor created, or None on error.
+        """
+        address = 'sensors'
+        data = {
+                'name': name,
+                'type': sensor_type,
+                'modelid': sensor_type,
+                'manufacturername': 'kphue',
+                'swversion': '1.0',
+                'uniqueid': uniqueid or name,
+                }
+        if state is not None:
+            data['state'] = state
+        response = self.api_request('POST', address, json_dumps(data))[0]
+        if 'success' in response:
+            new_id = int(response['success']['id'])
+            data.setdefault('state', {})
+            data['config'] = {'on': True}
+            self.sensors.append(Sensor(self, new_id, data))
+        else:
+            LOGGER.error('Creating Sensor %s: %s', name,
+                    response['error']['description'])
+            new_id = None
+        return new_id
+
+    def delete_sensor(self, name_or_id):
+        """Delete a Sensor.
+
+        Args:
+            name_or_id: Name (string) or ID (integer) of Sensor to
+                delete.
+
+        Returns:
+            Boolean: True on success, False on errors.
+        """
+        sensor = self.get_sensor(name_or_id)
+        if not sensor:
+            LOGGER.warning('No sensor returned for deletion')
+            return False
+        LOGGER.info('b.%s: Delete', sensor._identifier)
+        address = 'sensors/%d' % sensor.index
+        return_status = True
+        for response in self.api_request('DELETE', address):
+            if 'error' in response:
+                LOGGER.error('b.%s: Delete error: %s', sensor._identifier,
+                        response['error']['description'])
+                return_status = False
+        self.refresh_sensors()
+        return return_status
+
+    def get_sensor(self, *args):
+        """Returns a Sensor object specified by name or ID.
+
+        Args:
+            *args: Name (string) or ID (integer) to select.
+
+        Returns:
+            Single Sensor matching the requested name or ID, or None.
+        """
+        objects = self.get_sensors(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_sensors(self, *args):
+        """Returns a list of Sensor objects specified by name or ID.
+
+        Args:
+            *args: List of names (string) or IDs (integer) to select.
+
+        Returns:
+            List of Sensors matching the requested names and IDs.
+        """
+        objects = self._lookup(self.sensors, self.refresh_sensors, args)
+        return objects
+
+    def refresh_sensors(self):
+        """Refreshes the list of Sensor objects, with a single request.
+        """
+        responses = self.api_request('GET', 'sensors/')
+        if isinstance(responses, dict):
+            self._update_pool(self.sensors, Sensor, responses)
+
+
+@traced
+class BridgeSet(object):
+    """Several Hue Bridges, used as one.
+
+    Every Bridge listed in the config file is connected and refreshed
+    in parallel.  Lights are found through a merged index of names,
+    unique IDs and Light IDs, so lookups cost no requests and are routed
+    to the Bridge that owns each Light.  Call refresh() to update it.
+    """
+    def __init__(self, ips=None, config_file=None):
+        """Initialize all Bridges selected.
+
+        Args:
+            ips: Optional list of Bridge IPs; all Bridges in the config
+                file are used if not given.
+            config_file: Path to file containing IP and user information.
+        """
+        self.config_file = config_file or default_config_file()
+        config = read_config(self.config_file)
+        if not ips:
+            ips = config_bridges(config)
+
+        def connect(ip):
+            """Connect to one Bridge, returning None on errors.
+            """
+            try:
+                user = config.get(ip, {}).get('username')
+                return Bridge(ip, user, self.config_file)
+            except (KphueException, KphueTimeout) as error:
+                LOGGER.error('Bridge %s: %s', ip, error)
+                return None
+
+        self.bridges = [bridge for bridge in parallel_map(connect, ips)
+                        if bridge]
+        self._light_index = {}
+        self._index()
+
+    def __repr__(self):
+        """Like default repr function, but add Bridge IPs.
+
+        Returns:
+            Object string representation.
+        """
+        return '<{0}.{1} object ({2}) at {3}>'.format(
+                self.__class__.__module__, self.__class__.__name__,
+                ', '.join(bridge.ip for bridge in self.bridges),
+                hex(id(self)))
+
+    @property
+    def lights(self):
+        """All Lights on all Bridges.
+        """
+        return [light for bridge in self.bridges for light in bridge.lights]
+
+    def refresh(self):
+        """Refresh all Bridges in parallel, then rebuild the Light index.
+
+        A Bridge that fails to refresh is logged and keeps its last
+        known state; the others are refreshed regardless.
+
+        Returns:
+            Boolean; True if all Bridges were refreshed.
+        """
+        def refresh(bridge):
+            """Refresh one Bridge, returning False on errors.
+            """
+            try:
+                bridge.refresh()
+            except (KphueException, KphueTimeout) as error:
+                LOGGER.error('Bridge %s: %s', bridge.ip, error)
+                return False
+            return True
+
+        try:
+            results = parallel_map(refresh, self.bridges)
+        finally:
+            self._index()
+        return all(results)
+
+    def _index(self):
+        """Rebuild the merged Light index.
+        """
+        index = {}
+        for light in self.lights:
+            for key in (light.name, light.uniqueid, light.index):
+                if key is not None:
+                    index.setdefault(key, []).append(light)
+        self._light_index = index
+
+    def get_bridge(self, name_or_ip):
+        """Returns a Bridge specified by name or IP.
+
+        Args:
+            name_or_ip: Bridge name or IP address.
+
+        Returns:
+            Bridge object, or None.
+        """
+        for bridge in self.bridges:
+            if name_or_ip in (bridge.name, bridge.ip):
+                return bridge
+        return None
+
+    def get_light(self, *args):
+        """Returns a Light object specified by name or ID.
+
+        Args:
+            *args: Name (string), unique ID or ID (integer) to select.
+
+        Returns:
+            Single Light matching the requested name or ID, or None.
+        """
+        objects = self.get_lights(*args)
+        if objects:
+            the_one = objects[0]
+        else:
+            the_one = None
+        return the_one
+
+    def get_lights(self, *args):
+        """Returns a list of Light objects specified by name or ID.
+
+        Names and unique IDs are looked up across all Bridges; integer
+        IDs are per Bridge, so they match that Light on every Bridge.
+
+        Args:
+            *args: List of names (string), unique IDs or IDs (integer).
+
+        Returns:
+            List of Lights matching the requested names and IDs.
+        """
+        lights = []
+        for item in flatten_struct(args):
+            if isinstance(item, HueResource):
+                matches = [item]
+            else:
+                matches = self._light_index.get(item, [])
+            for light in matches:
+                if light not in lights:
+                    lights.append(light)
+        return lights
+
+    def set_lights(self, lights, parameter=None, value=None):
+        """Set the same parameter on Lights across Bridges concurrently.
+
+        Args:
+            lights: Light objects, names or IDs to set.
+            parameter: Name of API parameter to set.
+            value: Value to set.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        by_bridge = collections.OrderedDict()
+        for light in self.get_lights(lights):
+            by_bridge.setdefault(light._bridge, []).append(light)
+        results = parallel_map(
+                lambda item: item[0].set_lights(item[1], parameter, value),
+                by_bridge.items())
+        return all(results)
+
+
+class HueResource(object):
+    """Generic Hue resource object wrapper.
+
+    Attributes are read from the API state as declared in _schema.
+    """
+    _schema = ()
+
+    def __init__(self, parent_bridge, res_id, res_type, state=None):
+        """
+        """
+        self.index = res_id
+        self.name = None
+        self._bridge = parent_bridge
+        self._type = res_type
+        self._identifier = '%s (%s)' % (self._type, self.index)
+        self._state = None
+        # Version marker of _state, to skip updates that change nothing
+        self._version = None
+
+        # Now get the actual values
+        self.refresh(state)
+
+    def __repr__(self):
+        """Like default python repr function, but add object name.
+
+        Returns:
+            Object string representation.
+        """
+        return '<{0}.{1} object "{2}" ({3}) at {4}>'.format(
+                self.__class__.__module__, self.__class__.__name__,
+                self.name, self.index, hex(id(self)))
+
+    def refresh(self, state=None):
+        """Refreshes object attributes and state information.
+
+        Args:
+            state: Optional state already fetched (e.g. by a bulk request);
+                if not given, it is requested from the Bridge.
+        """
+        LOGGER.debug('%s: Refreshing', self._identifier)
+        if state is None:
+            state = self._bridge.api_request('GET', '%ss/%s' % (self._type,
+                    self.index))
+        self._state = state
+        self._version = state_version(state)
+        # TODO: Scenes error often (errors are list); API doc doesn't have GET
+        if isinstance(self._state, list):
+            self.name = self.index
+        elif PY3K:
+            self.name = self._state['name']
+        else:
+            self.name = self._state['name'].encode('utf-8')
+        self._identifier = '%s %s (%s)' % (self._type, self.name, self.index)
+        if isinstance(self._state, dict):
+            decoder = compile_schema(self.__class__)[0]
+            self.__dict__.update(decoder(self._state))
+
+    def _removed(self):
+        """Called when the resource is no longer on the Bridge.
+        """
+        pass
+
+
+@traced
+class Luminous(HueResource):
+    """Wrapper for objects that set light.
+    """
+    def __init__(self, parent_bridge, res_id, res_type, state=None):
+        """
+        """
+        if res_type == 'group':
+            self._attr_key = 'action'
+        else:
+            self._attr_key = 'state'
+
+        self.effect = None
+        # "on" Boolean
+        self.on = None
+
+        self.bri = None
+        # Internal value for previous brightness, to address a Hue bug
+        self._bri = None
+
+        # Color modes: xy, ct, hs
+        self.xy = None
+        self.ct = None
+        self.hue = None
+        self.sat = None
+        # added mode: value = tuple(r, g, b) where r, g, b are 0 to 255
+        #self.rgb = None
+
+        # Time in ds (0.1 seconds!)
+        self.transitiontime = None
+
+        super(Luminous, self).__init__(parent_bridge, res_id, res_type, state)
+
+    def refresh(self, state=None):
+        """Refreshes local attributes with actual values.
+
+        Args:
+            state: Optional state already fetched.
+        """
+        super(Luminous, self).refresh(state)
+        if 'hue' in self._state[self._attr_key]:
+            self.rgb = None
+        if self.xy is not None:
+            self._state[self._attr_key]['xy'] = self.xy
+
+    def turn_on(self):
+        """Turns lights on.
+        """
+        LOGGER.debug('%s: Turning on', self._identifier)
+        self.set('on', True)
+
+    def turn_off(self):
+        """Turns lights off.
+        """
+        LOGGER.debug('%s: Turning off', self._identifier)
+        self.set('on', False)
+
+    def reset(self):
+        """Reset all parameters to show white light.
+        """
+        LOGGER.debug('Resetting %s resource %s', self._type, self.name)
+        self.transitiontime = None
+        self.effect = None
+        self.bri = BRI_MAX
+        if 'hue' in self._state[self._attr_key]:
+            # Only the information for the selected colormode is needed.
+            #   http://www.developers.meethue.com/documentation/lights-api
+            # colormode is not set directly; follows priority xy > ct > hs.
+            # xy is default; is it more accurate to send hs-converted rgb?
+            self.rgb = None
+            rgb = [255, 255, 255]
+            self.ct = MIREDS_MIN
+            self.xy = rgb_to_xy(rgb)
+            self.hue, self.sat, self.bri = rgb_to_hsb(rgb)
+        # Turns on the light because:
+        #   http://www.developers.meethue.com/documentation/lights-api
+        # A light cannot have its hue, saturation, brightness, effect, ct or
+        # xy modified when it is turned off. Doing so will return error 201.
+        self.turn_on()
+
+    def set(self, parameter=None, value=None):
+        """Adjust properties of Luminous objects.
+
+        Sets all values, including an optional override.
+        Some supported parameters and values:
+            'name': string
+            'on' : True | False
+            'xy' : [0.0 - 1.0, 0.0 - 1.0]
+            'ct' : 154 - 500
+            'hue': 0 - 65535
+            'sat': 0 - 254
+            'bri': 0 - 254
+            'alert': 'none', 'select', 'lselect'
+            'effect': 'none', 'colorloop'
+            'transitiontime': 0 - 30000 ds
+
+        Args:
+            parameter: Name of API parameter to set.
+            value: Value to set.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        LOGGER.debug('%s: set(%s, %s)?', self._identifier, parameter, value)
+        if parameter:
+            if hasattr(self, parameter):
+                setattr(self, parameter, value)
+            else:
+                LOGGER.warning('%s: Attribute %s does not exist',
+                        self._identifier, parameter)
+
+        return_status = True
+        # Set attributes then state
+        for path in ('', '/%s' % self._attr_key):
+            if path:
+                data = self._form_state_data()
+            else:
+                data = self._form_attribute_data()
+            if return_status and data:
+                address = '%ss/%s%s' % (self._type, self.index, path)
+                json_data = json_dumps(data)
+                responses = self._bridge.api_request('PUT', address, json_data)
+                for response in responses:
+                    if 'error' in response:
+                        LOGGER.error('%s: %s', self._identifier,
+                                response['error']['description'])
+                        return_status = False
+                if not path:
+                    # self.lights doesn't update fast enough for refresh()
+                    wait()
+
+        # Reload set values
+        self.refresh()
+        return return_status
+
+    def send(self, states, transitiontime=None):
+        """Send state values as they are, for fast updates like animations.
+
+        Unlike set(), nothing is compared or re-read from the Bridge:
+        one rate-limited PUT is made, and the values the Bridge reports
+        as set are applied locally.
+
+        Args:
+            states: Dictionary of API state values, e.g. {'bri': 100}.
+            transitiontime: Optional transition time, in ds.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        states = dict(states)
+        if transitiontime is not None:
+            states['transitiontime'] = int(round(transitiontime))
+        self._bridge.rate_limits[self._type].acquire()
+        address = '%ss/%s/%s' % (self._type, self.index, self._attr_key)
+        responses = self._bridge.api_request('PUT', address,
+                json_dumps(states))
+        return self._apply_responses(responses)
+
+    def _apply_responses(self, responses):
+        """Apply values reported as set by the Bridge to local state.
+
+        Args:
+            responses: List of responses to a state PUT.
+
+        Returns:
+            Boolean; True if there were no errors.
+        """
+        return_status = True
+        for response in responses:
+            if 'error' in response:
+                LOGGER.error('%s: %s', self._identifier,
+                        response['error']['description'])
+                return_status = False
+            elif 'success' in response:
+                for path, value in response['success'].items():
+                    attr = path.split('/')[-1]
+                    if attr in self._state[self._attr_key]:
+                        self._state[self._attr_key][attr] = value
+                        setattr(self, attr, hue_decode(value))
+                        # The Bridge may report other values; don't let
+                        # the next bulk refresh skip this resource.
+                        self._version = None
+        return return_status
+
+    def _form_attribute_data(self):
+        """Return object of values that have changed.
+
+        Returns:
+            Returns data object prepared for API request.
+        """
+        attrs = {}
+        if self.name != self._state['name']:
+            attrs['name'] = self.name
+        if 'lights' in self._state:
+            lights = [int(l_id) for l_id in self._state['lights']]
+            for light in self.lights:
+                try:
+                    lights.remove(light.index)
+                except ValueError:
+                    lights = True
+                    break
+            if lights:
+                attrs['lights'] = [str(light.index) for light in self.lights]
+        if hasattr(self, 'scene') and self.scene:
+            attrs['scene'] = self.scene
+            self.scene = None
+        LOGGER.debug('%s: attributes = %s', self._identifier, attrs)
+        return attrs
+
+    def _form_state_data(self):
+        """Return object of values that have changed.
+
+        Returns:
+            Returns data object prepared for API request.
+        """
+        if 'hue' in self._state[self._attr_key]:
+            # Conform object attributes to valid ranges/values.
+            if self.rgb:
+                # should 0,0,0 turn the light off?
+                if list(self.rgb) == [0, 0, 0]:
+                    self.on = False
+                elif hasattr(self, 'color_mode') and self.color_mode == 'hs':
+                    self.hue, self.sat, self.bri = rgb_to_hsb(self.rgb)
+                else:
+                    self.xy = rgb_to_xy(self.rgb)
+                self.rgb = None
+            else:
+                self.xy = validate_xy(self.xy)
+            LOGGER.debug('hsb = %s %s %s', self.hue, self.sat, self.bri)
+            self.ct = constrain_value(self.ct, MIREDS_MIN, MIREDS_MAX)
+            self.hue = constrain_value(self.hue, 0, HUE_MAX)
+            self.sat = constrain_value(self.sat, 0, SAT_MAX)
+        self.bri = constrain_value(self.bri, 0, BRI_MAX)
+        if self.transitiontime is not None:
+            self.transitiontime = int(round(self.transitiontime))
+        if self.effect not in (None, 'colorloop'):
+            self.effect = None
+
+        # Some added code here to work around known bug where turning off
+        # with transitiontime set makes it restart on brightness = 1
+        #   http://www.everyhue.com/vanilla/discussion/204/
+        #     bug-with-brightness-when-requesting-ontrue-transitiontime5
+        # This now works regardless of how the light is turned on/off.
+        on_state = hue_decode(self._state[self._attr_key]['on'])
+        if on_state != self.on and self.transitiontime is not None:
+            if self.on:
+                if self._bri:
+                    self.bri = self._bri
+                    self._bri = None
+            else:
+                self._bri = self.bri
+                # only changes get applied, so change brightness a little
+                if self.bri > 0:
+                    self.bri = self._bri - 1
+                else:
+                    # This will get restored
+                    self.bri = 1
+
+        # Only request changes for value that have changed
+        states = {}
+        current = self._state[self._attr_key]
+        for attr, path, encode in compile_schema(self.__class__)[1]:
+            state = path[-1]
+            if state in current:
+                set_value = encode(self.__dict__[attr])
+                if current[state] != set_value:
+                    states[state] = set_value
+                    LOGGER.debug('%s (%s) --> %s', state, current[state],
+                            set_value)
+        if states and self.transitiontime is not None:
+            states['transitiontime'] = self.transitiontime
+        # If setting something but light is off, turn light on
+        if 'on' not in states and states:
+            states['on'] = hue_encode(True)
+            LOGGER.debug('Originally off, now on; states: %s', states)
+        LOGGER.debug('%s: states = %s', self._identifier, states)
+        return states
+
+
+@traced
+class Light(Luminous):
+    """Light object.
+    """
+    _schema = _luminous_fields('state') + (
+            Field('alert', ('state', 'alert'), 'none', True),
+            Field('is_reachable', ('state', 'reachable')),
+            Field('color_mode', ('state', 'colormode')),
+            Field('modelid'),
+            Field('swversion'),
+            Field('uniqueid'),
+            )
+
+    def __init__(self, parent_bridge, res_id, state=None):
+        """
+        """
+        self.alert = None
+        # These cannot be set, only read:
+        self.color_mode = None
+        self.is_reachable = None
+        self.modelid = None
+        self.swversion = None
+        self.uniqueid = None
+        self.breaker = CircuitBreaker('light %s' % res_id)
+        # (on, bri) as counted in the aggregate state of its Groups
+        self._aggregate = None
+        super(Light, self).__init__(parent_bridge, res_id, 'light', state)
+        self.breaker.name = self._identifier
+
+    def refresh(self, state=None):
+        """Refreshes local attributes with actual values.
+
+        Args:
+            state: Optional state already fetched.
+        """
+        super(Light, self).refresh(state)
+        # Lights that don't report reachability are taken as reachable.
+        if self.is_reachable is False:
+            self.breaker.trip()
+        else:
+            self.breaker.record_success()
+        self._bridge._light_updated(self)
+
+    def _apply_responses(self, responses):
+        """Apply values reported as set, and update Group aggregates.
+
+        Args:
+            responses: List of responses to a state PUT.
+
+        Returns:
+            Boolean; True if there were no errors.
+        """
+        return_status = super(Light, self)._apply_responses(responses)
+        self._bridge._light_updated(self)
+        return return_status
+
+    def _aggregate_state(self):
+        """Returns what this Light adds to the aggregate state of Groups.
+
+        Returns:
+            Tuple (on, bri); bri is 0 while off.
+        """
+        if self.on:
+            return (True, self.bri or 0)
+        return (False, 0)
+
+    def _removed(self):
+        """Take the Light out of the aggregate state of its Groups.
+        """
+        old = self._aggregate
+        self._aggregate = (False, 0)
+        for group in self._bridge._groups_by_light.get(self.index, []):
+            group._member_changed(old, self._aggregate)
+
+    @property
+    def is_available(self):
+        """Whether the Light should be sent requests at all.
+
+        False while the Light is unreachable or its breaker is open; once
+        the recovery time has passed, one trial is allowed.  Checking
+        does not use up the trial.
+
+        Returns:
+            Boolean.
+        """
+        return self.breaker.available()
+
+    def reset(self):
+        """Reset all parameters to show white light.
+        """
+        self.alert = None
+        super(Light, self).reset()
+
+    def set(self, parameter=None, value=None):
+        """Sets light attributes and states.
+
+        Args:
+            parameter: Name of API parameter to set.
+            value: Value to set.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        if not self.breaker.allow():
+            LOGGER.warning('%s: Unreachable; not setting %s', self._identifier,
+                    parameter)
+            return False
+        # Reachability is recorded by refresh(); request errors are the
+        # Bridge's, and only count against its breaker.
+        return super(Light, self).set(parameter, value)
+
+
+@traced
+class Group(Luminous):
+    """Group object.
+    """
+    _schema = _luminous_fields('action')
+
+    def __init__(self, parent_bridge, resource_id, state=None):
+        """
+        """
+        self.lights = []
+        #self.scenes = None
+        self.scene = None
+        # Members in the Bridge membership index
+        self._indexed_lights = []
+        # Aggregate state of members: how many are on, and their brightness
+        self._on_count = 0
+        self._bri_sum = 0
+        super(Group, self).__init__(parent_bridge, resource_id, 'group',
+                state)
+
+    def refresh(self, state=None, refetch=False):
+        """Refreshes local attributes with actual values.
+
+        Members are resolved from the Lights already loaded by the
+        Bridge, without requests.
+
+        Args:
+            state: Optional state already fetched.
+            refetch: If True, also reload all Lights (one request), for
+                when member states are needed fresh.
+        """
+        super(Group, self).refresh(state)
+        if refetch:
+            self._bridge.refresh_lights()
+        lights = self._bridge.resolve_lights(self._state['lights'])
+        if lights != self._indexed_lights:
+            self.lights = lights
+            self._bridge._index_group(self)
+            self._recount()
+        else:
+            self.lights = lights
+        # scenes are really just stored on light.  Why is this provided?
+        #self.scenes = [str(s_id) for s_id in self._state['scenes']]
+
+    def _apply_responses(self, responses):
+        """Apply values reported as set to the Group and its Lights.
+
+        A Group action sets its reachable member Lights too, so their
+        loaded states (and the aggregates) follow without a refresh.
+
+        Args:
+            responses: List of responses to an action PUT.
+
+        Returns:
+            Boolean; True if there were no errors.
+        """
+        return_status = super(Group, self)._apply_responses(responses)
+        values = {}
+        for response in responses:
+            for path, value in response.get('success', {}).items():
+                values[path.split('/')[-1]] = value
+        for light in self.lights:
+            if light.is_reachable is False:
+                continue
+            state = light._state['state']
+            changed = False
+            for attr, value in values.items():
+                if attr in state:
+                    state[attr] = value
+                    setattr(light, attr, hue_decode(value))
+                    changed = True
+            if changed:
+                light._version = None
+                self._bridge._light_updated(light)
+        return return_status
+
+    def _removed(self):
+        """Drop the Group from the Bridge membership index.
+        """
+        self._bridge._unindex_group(self)
+
+    def _recount(self):
+        """Compute the aggregate state of all members again.
+        """
+        self._on_count = 0
+        self._bri_sum = 0
+        for light in self.lights:
+            self._member_changed(None, light._aggregate)
+
+    def _member_changed(self, old, new):
+        """Apply the change of one member to the aggregate state.
+
+        Args:
+            old: Previous (on, bri) of the member, or None.
+            new: New (on, bri) of the member.
+        """
+        if old is not None and old[0]:
+            self._on_count -= 1
+            self._bri_sum -= old[1]
+        if new[0]:
+            self._on_count += 1
+            self._bri_sum += new[1]
+
+    @property
+    def any_on(self):
+        """Whether any member Light is on, from the loaded Light states.
+
+        Returns:
+            Boolean.
+        """
+        return self._on_count > 0
+
+    @property
+    def all_on(self):
+        """Whether all member Lights are on, from the loaded Light states.
+
+        Returns:
+            Boolean.
+        """
+        return bool(self.lights) and self._on_count == len(self.lights)
+
+    @property
+    def bri_average(self):
+        """Average brightness of the member Lights that are on.
+
+        Returns:
+            Brightness (0 - 254), or None if no Light is on.
+        """
+        if not self._on_count:
+            return None
+        return self._bri_sum / float(self._on_count)
+
+    def reset(self):
+        """Reset all parameters to show white light.
+        """
+        self.scene = None
+        super(Group, self).reset()
+
+
+@traced
+class Rule(HueResource):
+    """Rule object.
+    """
+    _schema = (
+            Field('lasttriggered', kind='none'),
+            Field('timestriggered', kind='int'),
+            Field('owner'),
+            Field('status'),
+            # Copies, so changes made before set() can be told apart.
+            Field('conditions', kind='copy'),
+            Field('actions', kind='copy'),
+            )
+
+    def __init__(self, parent_bridge, resource_id, state=None):
+        """
+        """
+        self.lasttriggered = None
+        self.timestriggered = None
+        self.owner = None
+        self.status = None
+        self.conditions = None
+        self.actions = None
+        # Keys of this Rule in the Bridge rule indexes
+        self._index_keys = []
+        super(Rule, self).__init__(parent_bridge, resource_id, 'rule',
+                state)
+
+    def refresh(self, state=None):
+        """Refreshes local attributes with actual values.
+
+        Args:
+            state: Optional state already fetched.
+        """
+        super(Rule, self).refresh(state)
+        self._bridge._index_rule(self)
+
+    def _removed(self):
+        """Drop the Rule from the Bridge rule indexes.
+        """
+        self._bridge._unindex_rule(self)
+
+    def set(self, parameter=None, value=None):
+        """Changes the attributes of a Rule.
+
+        Only values that changed are sent.  Supported parameters:
+            'name', 'status': string
+            'conditions', 'actions': list of dictionaries
+        Any other parameter is set in the body of each action that
+        already has it, e.g. set('scene', scene_id).
+
+        Args:
+            parameter: Attribute to set.
+            value: Value to set.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        if parameter in RULE_FIELDS:
+            setattr(self, parameter, value)
+        elif parameter:
+            for action in self.actions:
+                if 'body' in action and parameter in action['body']:
+                    action['body'][parameter] = value
+
+        data = {}
+        for attr in RULE_FIELDS:
+            attr_value = getattr(self, attr)
+            if attr_value is not None and attr_value != self._state.get(attr):
+                data[attr] = attr_value
+        if 'conditions' in data:
+            data['conditions'] = _rule_definition(self.name,
+                    data['conditions'], [])['conditions']
+        if not data:
+            return True
+
+        return_status = True
+        address = '%ss/%s' % (self._type, self.index)
+        json_data = json_dumps(data)
+        responses = self._bridge.api_request('PUT', address, json_data)
+        for response in responses:
+            if 'error' in response:
+                LOGGER.error('%s: %s', self._identifier,
+                        response['error']['description'])
+                return_status = False
+
+        if return_status:
+            # The values sent are now the values stored; no need to GET.
+            self._state.update(copy.deepcopy(data))
+            self.refresh(self._state)
+        else:
+            self.refresh()
+        return return_status
+
+
+@traced
+class Scene(HueResource):
+    """Scene object.
+
+    The light states of a Scene are only returned by a GET of that one
+    Scene, so they are fetched the first time they are needed, and
+    again only after the Scene changes.
+    """
+    _schema = (
+            Field('owner'),
+            Field('recycle'),
+            Field('locked'),
+            Field('lastupdated'),
+            )
+
+    def __init__(self, parent_bridge, resource_id, state=None):
+        """
+        """
+        self.active = None
+        self.lights = []
+        self.owner = None
+        self.recycle = None
+        self.locked = None
+        self.lastupdated = None
+        self._lightstates = None
+        super(Scene, self).__init__(parent_bridge, resource_id, 'scene',
+                state)
+
+    def refresh(self, state=None):
+        """Refreshes local attributes with actual values.
+
+        Args:
+            state: Optional state already fetched.
+        """
+        lastupdated = self.lastupdated
+        super(Scene, self).refresh(state)
+        if isinstance(self._state, list):
+            return
+        light_ids = [int(light_id)
+                     for light_id in self._state.get('lights', [])]
+        self.lights = _get_from_pool(self._bridge.lights, light_ids)
+        if 'lightstates' in self._state:
+            self._lightstates = self._state['lightstates']
+        elif lastupdated != self.lastupdated:
+            self._lightstates = None
+
+    @property
+    def lightstates(self):
+        """Light states stored in the Scene, keyed by light ID string.
+        """
+        if self._lightstates is None:
+            state = self._bridge.api_request('GET', 'scenes/%s' % self.index)
+            if isinstance(state, dict):
+                self._lightstates = state.get('lightstates', {})
+        return self._lightstates or {}
+
+    def recall(self, group=0):
+        """Recall the Scene with a single Group action.
+
+        Local Light states are updated from the cached light states,
+        without re-reading the Lights.
+
+        Args:
+            group: Group object or ID to recall the Scene on; Group 0
+                (all lights) by default, which only affects the lights
+                in the Scene.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        group_id = getattr(group, 'index', group)
+        address = 'groups/%s/action' % group_id
+        responses = self._bridge.api_request('PUT', address,
+                json_dumps({'scene': self.index}))
+        return_status = True
+        for response in responses:
+            if 'error' in response:
+                LOGGER.error('%s: %s', self._identifier,
+                        response['error']['description'])
+                return_status = False
+        if return_status and self._lightstates:
+            for light in self.lights:
+                lightstate = self._lightstates.get(str(light.index))
+                if lightstate:
+                    light._state['state'].update(lightstate)
+                    light.refresh(light._state)
+        return return_status
+
+
+@traced
+class Schedule(HueResource):
+    """Schedule object.
+    """
+    _schema = (
+            Field('_command', 'command'),
+            Field('description'),
+            Field('created'),
+            Field('localtime'),
+            Field('time'),
+            Field('status'),
+            Field('autodelete', kind='none'),
+            Field('starttime'),
+            )
+
+    def __init__(self, parent_bridge, resource_id, state=None):
+        """
+        """
+        # Provided by API
+        self._command = None
+        self.description = None
+        self.created = None
+        self.localtime = None
+        self.time = None
+        self.status = None
+        self.autodelete = None
+        # Added by kphue
+        self.address = None
+        self.group = None
+        self.state = None
+        # Only provided for timers
+        self.starttime = None
+        super(Schedule, self).__init__(parent_bridge, resource_id, 'schedule',
+                state)
+
+    def refresh(self, state=None):
+        """Refreshes local attributes with actual values.
+
+        Args:
+            state: Optional state already fetched.
+        """
+        super(Schedule, self).refresh(state)
+        self.address = self._command.get('address')
+        if self.address:
+            self.group = self.address.split('/')[-2]
+        if 'body' in self._command:
+            self.state = dict(self._command['body'])
+
+    def set(self, parameter=None, value=None):
+        """Changes the attributes of a Schedule.
+
+        Only values that changed are sent.  Supported parameters:
+            'name', 'description', 'localtime', 'status': string
+            'autodelete': True | False
+            'state': dictionary of state values the command sets
+            'address': full API address the command sets
+
+        Args:
+            parameter: Name of attribute to set.
+            value: Value to set.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        if parameter:
+            if hasattr(self, parameter):
+                setattr(self, parameter, value)
+            else:
+                LOGGER.warning('%s: Attribute %s does not exist',
+                        self._identifier, parameter)
+
+        data = {}
+        for attr in ('name', 'description', 'localtime', 'status',
+                     'autodelete'):
+            attr_value = getattr(self, attr)
+            if attr_value is not None and attr_value != self._state.get(attr):
+                data[attr] = attr_value
+        command = dict(self._command)
+        if self.state is not None:
+            command['body'] = self.state
+        if self.address:
+            command['address'] = self.address
+        if command != self._command:
+            data['command'] = command
+        if not data:
+            return True
+
+        return_status = True
+        address = '%ss/%s' % (self._type, self.index)
+        responses = self._bridge.api_request('PUT', address, json_dumps(data))
+        for response in responses:
+            if 'error' in response:
+                LOGGER.error('%s: %s', self._identifier,
+                        response['error']['description'])
+                return_status = False
+        if return_status:
+            self._state.update(data)
+            self.refresh(self._state)
+        else:
+            self.refresh()
+        return return_status
+
+
+@traced
+class Sensor(HueResource):
+    """Sensor object.
+    """
+    _schema = (
+            Field('state'),
+            Field('config'),
+            Field('type'),
+            Field('modelid'),
+            Field('manufacturername'),
+            Field('swversion'),
+            Field('uniqueid'),
+            )
+
+    def __init__(self, parent_bridge, resource_id, state=None):
+        """
+        "state": {
+            "daylight": false,
+            "lastupdated": "2014-06-27T07:38:51"
+        },
+        "config": {
+            "on": true,
+            "long": "none",
+            "lat": "none",
+            "sunriseoffset": 50,
+            "sunsetoffset": 50
+        },
+        "name": "Daylight",
+        "type": "Daylight",
+        "modelid": "PHDL00",
+        "manufacturername": "Philips",
+        "swversion": "1.0"
+        """
+        self.state = None
+        self.config = None
+        self.type = None
+        self.modelid = None
+        self.manufacturername = None
+        self.swversion = None
+        self.uniqueid = None
+        super(Sensor, self).__init__(parent_bridge, resource_id, 'sensor',
+                state)
+
+
+@traced
+class ResourceLink(HueResource):
+    """ResourceLink object: a named, owned set of links to resources.
+    """
+    _schema = (
+            Field('description'),
+            Field('type'),
+            Field('classid', kind='int'),
+            Field('owner'),
+            Field('recycle'),
+            Field('links'),
+            )
+
+    def __init__(self, parent_bridge, resource_id, state=None):
+        """
+        """
+        self.description = None
+        self.type = None
+        self.classid = None
+        self.owner = None
+        self.recycle = None
+        self.links = None
+        super(ResourceLink, self).__init__(parent_bridge, resource_id,
+                'resourcelink', state)
+
+    @property
+    def resources(self):
+        """Resources linked, where kphue knows them.
+
+        Returns:
+            List of resource objects, e.g. Scenes and Rules.
+        """
+        resources = []
+        for link in self.links or []:
+            resource = self._bridge.resource_at(link)
+            if resource is not None:
+                resources.append(resource)
+        return resources
+
+
+@traced
+class LightSnapshot(object):
+    """Saved state of many Lights (see Bridge.capture).
+    """
+    def __init__(self, bridge, lights):
+        """Save the already loaded states of Lights.
+
+        Args:
+            bridge: Bridge the Lights belong to.
+            lights: List of Light objects.
+        """
+        self._bridge = bridge
+        self.time = time.time()
+        self.states = collections.OrderedDict(
+                (light, restorable_state(light._state['state']))
+                for light in lights)
+
+    def __repr__(self):
+        """Like default repr function, but add Light count.
+
+        Returns:
+            Object string representation.
+        """
+        return '<{0}.{1} object ({2} lights) at {3}>'.format(
+                self.__class__.__module__, self.__class__.__name__,
+                len(self.states), hex(id(self)))
+
+    def changes(self):
+        """Returns what must be sent to restore each Light.
+
+        Current states come from a single bulk request; Lights already
+        in their saved state, and unavailable ones, are left out.
+
+        Returns:
+            List of (light, states) tuples.
+        """
+        self._bridge.refresh_lights()
+        changes = []
+        for light, saved in self.states.items():
+            if not light.is_available:
+                continue
+            states = diff_state(light._state['state'], saved)
+            if states:
+                changes.append((light, states))
+        return changes
+
+    def restore(self, transitiontime=None, workers=PARALLEL_WORKERS):
+        """Put the Lights back the way they were.
+
+        Only the Lights and values that differ are sent, several Lights
+        at a time, within the Bridge rate limits.
+
+        Args:
+            transitiontime: Optional transition time, in ds.
+            workers: Maximum number of concurrent requests.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        changes = self.changes()
+        LOGGER.info('Restoring %d of %d lights', len(changes),
+                len(self.states))
+        results = parallel_map(
+                lambda change: change[0].send(change[1], transitiontime),
+                changes, workers)
+        return all(results)
+
+
+@traced
+class Animation(object):
+    """Keyframe animation of Lights and Groups.
+
+    Keyframes give the values (rgb, xy, bri, ct, hue, sat, on) a target
+    should reach at a given time.  They are compiled into as few
+    commands as possible: each command is sent when the previous
+    keyframe is reached and uses transitiontime to fade to the next
+    one, and values that do not change are left out.  Lights sent the
+    same values at the same time are sent one command through the
+    largest Groups made of only such Lights.
+
+    Usage:
+        animation = Animation(my_bridge)
+        animation.keyframe(my_light, 0, rgb=(255, 0, 0), bri=254)
+        animation.keyframe(my_light, 2.5, rgb=(0, 0, 255))
+        animation.keyframe(my_group, 1, bri=50)
+        animation.play()
+
+    While playing, commands are paced by the Bridge rate limits.  A
+    command that is more than max_lag seconds late is merged into the
+    next command for the same target, if that one is due too, so delays
+    do not build up.
+    """
+    def __init__(self, bridge, max_lag=ANIMATION_MAX_LAG):
+        """Initialize the animation.
+
+        Args:
+            bridge: Bridge the targets belong to.
+            max_lag: Seconds a command may be late before it is merged.
+        """
+        self._bridge = bridge
+        self.max_lag = max_lag
+        self.keyframes = collections.OrderedDict()
+        self.sent = 0
+        self.dropped = 0
+        self._stop = threading.Event()
+
+    def keyframe(self, targets, seconds, **states):
+        """Add a keyframe.
+
+        Args:
+            targets: Light or Group, or a list of them.
+            seconds: Time from the start of the animation.
+            **states: Values to reach; rgb is converted to xy.
+        """
+        if 'rgb' in states:
+            rgb = states.pop('rgb')
+            if list(rgb) == [0, 0, 0]:
+                states['on'] = False
+            else:
+                states['xy'] = rgb_to_xy(rgb)
+        for target in flatten_struct([targets]):
+            frames = self.keyframes.setdefault(target, [])
+            frames.append((seconds, states))
+            frames.sort(key=lambda frame: frame[0])
+
+    def compile(self):
+        """Returns the commands needed to play the animation.
+
+        Returns:
+            List of [due, target, states, transitiontime] lists sorted by
+            due time; due is in seconds from the start, transitiontime
+            in ds.
+        """
+        commands = []
+        for target, frames in self.keyframes.items():
+            # Lights must be on to change; assume so unless told.
+            current = {}
+            start = 0
+            for seconds, states in frames:
+                changes = {}
+                for key, value in states.items():
+                    if key == 'xy':
+                        value = [round(coord, 4) for coord in value]
+                    if current.get(key) != value:
+                        changes[key] = value
+                if changes and 'on' not in current:
+                    changes.setdefault('on', True)
+                current.update(changes)
+                if changes:
+                    transitiontime = int(round((seconds - start) * 10))
+                    commands.append([start, target, changes, transitiontime])
+                start = seconds
+        commands = self._merge_lights(commands)
+        commands.sort(key=lambda command: command[0])
+        return commands
+
+    def _merge_lights(self, commands):
+        """Merge Light commands with the same values into Group commands.
+
+        Args:
+            commands: List of [due, target, states, transitiontime].
+
+        Returns:
+            List of commands, with Light commands sent at the same time
+            with the same values covered by Groups where possible.
+        """
+        merged = []
+        buckets = collections.OrderedDict()
+        for command in commands:
+            due, target, states, transitiontime = command
+            if not isinstance(target, Light):
+                merged.append(command)
+                continue
+            key = (due, transitiontime, state_version(states))
+            bucket = buckets.setdefault(key, (states, set()))
+            bucket[1].add(target.index)
+        for (due, transitiontime, _), (states, light_ids) in buckets.items():
+            for target in self._bridge._cover_lights(light_ids):
+                merged.append([due, target, states, transitiontime])
+        return merged
+
+    def play(self, block=True):
+        """Play the animation.
+
+        Args:
+            block: If False, play in a background thread.
+
+        Returns:
+            The playing thread if not blocking, else None.
+        """
+        self._stop.clear()
+        if not block:
+            thread = threading.Thread(target=self.play,
+                    name='kphue-animation')
+            thread.daemon = True
+            thread.start()
+            return thread
+        commands = self.compile()
+        start_time = time.time()
+        for index, (due, target, states, transitiontime) in enumerate(
+                commands):
+            if self._stop.is_set():
+                break
+            delay = start_time + due - time.time()
+            if delay > 0:
+                self._stop.wait(delay)
+            limiter = self._bridge.rate_limits[target._type]
+            elapsed = time.time() + limiter.wait_time() - start_time
+            late = elapsed - due
+            if late > self.max_lag and self._merge_into_next(commands, index,
+                                                             elapsed):
+                self.dropped += 1
+                continue
+            if late > 0:
+                # Keep the end of the transition on schedule.
+                transitiontime = max(0, int(transitiontime - late * 10))
+            try:
+                target.send(states, transitiontime)
+                self.sent += 1
+            except (KphueException, KphueTimeout) as error:
+                LOGGER.warning('%s: Animation frame failed: %s',
+                        target._identifier, error)
+        LOGGER.info('Animation done: %d commands sent, %d merged',
+                self.sent, self.dropped)
+        return None
+
+    def _merge_into_next(self, commands, index, elapsed):
+        """Merge a late command into the next one for the same target.
+
+        Only done if that next command is already due, so no values are
+        lost and the target goes straight to the later state.
+
+        Args:
+            commands: Compiled commands.
+            index: Index of the late command.
+            elapsed: Seconds since the animation started.
+
+        Returns:
+            Boolean; True if the command was merged.
+        """
+        target = commands[index][1]
+        for later in commands[index + 1:]:
+            if later[1] is target:
+                if later[0] > elapsed:
+                    return False
+                merged = dict(commands[index][2])
+                merged.update(later[2])
+                later[2] = merged
+                return True
+        return False
+
+    def stop(self):
+        """Stop playing.
+        """
+        self._stop.set()
+
+
+@traced
+class Reconciler(object):
+    """Keeps Lights in a declared state, with as few commands as possible.
+
+    Instead of sending commands, callers declare the state Lights (or
+    the Lights of Groups) should be in.  Each pass reads all Lights with
+    a single request and sends only the values that differ; Lights that
+    need the same correction are sent one Group command when a Group
+    holds exactly such Lights.  Once the Lights match, a pass makes no
+    writes at all.
+
+    Usage:
+        reconciler = Reconciler(my_bridge)
+        reconciler.desire(my_group, on=True, bri=200)
+        reconciler.desire(my_light, rgb=(255, 0, 0))
+        reconciler.start()
+
+    If the Bridge keeps reporting another color than the one sent (xy
+    or ct fitted to the gamut or range of a Light, see SETTLE_KEYS), the
+    reported color is accepted rather than fought over, until the Light
+    changes again.  Other values, like on and bri, are always corrected.
+    """
+    def __init__(self, bridge, transitiontime=None):
+        """Initialize the reconciler.
+
+        Args:
+            bridge: Bridge the Lights belong to.
+            transitiontime: Optional transition time of corrections, in
+                ds.
+        """
+        self._bridge = bridge
+        self.transitiontime = transitiontime
+        self.desired = collections.OrderedDict()
+        self.polls = 0
+        self.sent = 0
+        # Corrections sent, and observed values accepted, by Light.
+        self._pending = {}
+        self._settled = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def desire(self, targets, **states):
+        """Declare the state of Lights.
+
+        Values are added to (or replace) those already declared.
+
+        Args:
+            targets: Light or Group, or a list of them; a Group stands
+                for its Lights.
+            **states: Values (rgb, xy, bri, ct, hue, sat, on); rgb is
+                converted to xy.
+        """
+        if 'rgb' in states:
+            rgb = states.pop('rgb')
+            if list(rgb) == [0, 0, 0]:
+                states['on'] = False
+            else:
+                states['xy'] = rgb_to_xy(rgb)
+        if 'xy' in states:
+            states['xy'] = [round(coord, 4) for coord in states['xy']]
+        with self._lock:
+            for light in self._lights_of(targets):
+                self.desired.setdefault(light, {}).update(states)
+                self._pending.pop(light, None)
+                self._settled.pop(light, None)
+
+    def release(self, targets=None):
+        """Stop keeping Lights in their declared state.
+
+        Args:
+            targets: Light or Group, or a list of them; all if None.
+        """
+        with self._lock:
+            if targets is None:
+                lights = list(self.desired)
+            else:
+                lights = self._lights_of(targets)
+            for light in lights:
+                self.desired.pop(light, None)
+                self._pending.pop(light, None)
+                self._settled.pop(light, None)
+
+    @staticmethod
+    def _lights_of(targets):
+        """Returns the Lights of Lights and Groups.
+        """
+        lights = []
+        for target in flatten_struct([targets]):
+            if isinstance(target, Group):
+                lights.extend(target.lights)
+            else:
+                lights.append(target)
+        return lights
+
+    def corrections(self):
+        """Returns the corrections needed, after one bulk poll.
+
+        Returns:
+            List of (light, states) tuples.
+        """
+        self._bridge.refresh_lights()
+        self.polls += 1
+        corrections = []
+        with self._lock:
+            for light, desired in self.desired.items():
+                if not light.is_available:
+                    continue
+                observed = light._state['state']
+                # Accepted values hold until the Light reports others.
+                settled = dict((key, value) for key, value in
+                        self._settled.pop(light, {}).items()
+                        if observed.get(key) == value)
+                states = diff_state(observed, self._unsettled(desired,
+                        settled))
+                sent = self._pending.pop(light, None) or {}
+                kept = [key for key in SETTLE_KEYS
+                        if key in states and states[key] == sent.get(key)]
+                if kept:
+                    for key in kept:
+                        LOGGER.info('%s: Bridge keeps %s %s; accepted',
+                                light._identifier, key, observed.get(key))
+                        settled[key] = observed.get(key)
+                    states = diff_state(observed, self._unsettled(desired,
+                            settled))
+                if settled:
+                    self._settled[light] = settled
+                if states:
+                    corrections.append((light, states))
+        return corrections
+
+    @staticmethod
+    def _unsettled(desired, settled):
+        """Returns the desired values not replaced by accepted ones.
+        """
+        return dict((key, value) for key, value in desired.items()
+                    if key not in settled)
+
+    def commands(self, corrections):
+        """Returns the commands to send for corrections.
+
+        Lights needing the same values are sent a single command through
+        the largest Groups made of only such Lights; the rest are sent
+        one command each.
+
+        Args:
+            corrections: List of (light, states) tuples.
+
+        Returns:
+            List of (target, states, lights) tuples.
+        """
+        buckets = collections.OrderedDict()
+        for light, states in corrections:
+            bucket = buckets.setdefault(state_version(states), (states, set()))
+            bucket[1].add(light)
+        groups = [group for group in self._bridge.groups + [
+                self._bridge.all_lights] if group is not None
+                and len(group.lights) > 1]
+        groups.sort(key=lambda group: -len(group.lights))
+        commands = []
+        for states, lights in buckets.values():
+            for group in groups:
+                members = set(group.lights)
+                if len(lights) < len(members):
+                    continue
+                if members <= lights:
+                    commands.append((group, states, members))
+                    lights -= members
+            for light in sorted(lights, key=lambda light: light.index):
+                commands.append((light, states, [light]))
+        return commands
+
+    def reconcile(self, workers=PARALLEL_WORKERS):
+        """Make one pass: poll, and send the corrections needed.
+
+        Args:
+            workers: Maximum number of concurrent requests.
+
+        Returns:
+            Number of commands sent.
+        """
+        commands = self.commands(self.corrections())
+        if not commands:
+            return 0
+        LOGGER.info('Reconciling %d lights with %d commands',
+                sum(len(command[2]) for command in commands), len(commands))
+
+        def send(command):
+            """Send a command; note what its Lights were sent, if sent.
+            """
+            target, states, lights = command
+            if target.send(states, self.transitiontime):
+                with self._lock:
+                    for light in lights:
+                        self._pending[light] = states
+
+        parallel_map(send, commands, workers)
+        self.sent += len(commands)
+        return len(commands)
+
+    def start(self, interval=RECONCILE_INTERVAL):
+        """Reconcile in a thread, until stop() is called.
+
+        Args:
+            interval: Seconds between passes.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, args=(interval,),
+                name='kphue-reconcile-%s' % self._bridge.ip)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self, interval=RECONCILE_INTERVAL):
+        """Reconcile until stop() is called.
+
+        Args:
+            interval: Seconds between passes.
+        """
+        while not self._stop.is_set():
+            try:
+                with priority('background'):
+                    self.reconcile()
+            except (KphueException, KphueTimeout) as error:
+                LOGGER.warning('Reconciler: Pass failed: %s', error)
+            self._stop.wait(interval)
+
+    def stop(self):
+        """Stop reconciling.
+        """
+        self._stop.set()
+
+
+@traced
+class Cycler(object):
+    """Cycle colors or scenes with sensor buttons.
+
+    Each press of a configured button moves on to the next color (for
+    lights) or scene.  Scene cycles rewrite the scene of the rules that
+    the button triggers, so the next press recalls the next scene.
+
+    Cycles are a dictionary like this (JSON keys can be strings):
+        {
+            sensor_name_or_id: {
+                buttonevent: {
+                    'lights': [light_name_or_id, ..],
+                    'rgb': [[r, g, b], ..],
+                    },
+                buttonevent: {
+                    'scenes': [scene_id, ..],
+                    },
+                },
+            }
+    A plain list of scene IDs can be given instead of {'scenes': ...}.
+
+    Targets are resolved once.  All sensors are read with a single
+    request per poll, and a button press is recognized by a change of
+    its lastupdated value.  Callbacks added with on_press() are called
+    for every press, configured or not.
+
+    Alternatively, compile() moves the cycles onto the Bridge as rules,
+    so they run instantly and without polling.
+    """
+    def __init__(self, bridge, cycles=None, cycles_file=None):
+        """Initialize the cycler.
+
+        Args:
+            bridge: Bridge to use.
+            cycles: Dictionary of cycles, as described above.
+            cycles_file: Path to a JSON file of cycles, used if cycles
+                is not given.
+        """
+        self._bridge = bridge
+        if cycles is None:
+            with open(cycles_file, 'r') as file_handle:
+                cycles = json.loads(file_handle.read())
+        self.cycles = {}
+        self.positions = {}
+        self._callbacks = []
+        self._last_events = {}
+        self._stop = threading.Event()
+        self._resolve(cycles)
+
+    def _resolve(self, cycles):
+        """Resolve sensors, buttons, lights and rules, once.
+
+        Args:
+            cycles: Dictionary of cycles, as described in the class.
+        """
+        for sensor_key, buttons in cycles.items():
+            if isinstance(sensor_key, basestring) and sensor_key.isdigit():
+                sensor_key = int(sensor_key)
+            sensors = _get_from_pool(self._bridge.sensors, sensor_key)
+            if not sensors:
+                LOGGER.warning('Cycler: No sensor %s', sensor_key)
+                continue
+            sensor = sensors[0]
+            for button, cycle in buttons.items():
+                button = int(button)
+                if not isinstance(cycle, dict):
+                    cycle = {'scenes': cycle}
+                resolved = {}
+                if 'rgb' in cycle:
+                    resolved['states'] = [
+                            {'on': False} if list(rgb) == [0, 0, 0]
+                            else {'on': True, 'xy': [round(coord, 4)
+                                    for coord in rgb_to_xy(rgb)]}
+                            for rgb in cycle['rgb']]
+                    resolved['lights'] = _get_from_pool(self._bridge.lights,
+                            cycle.get('lights', []))
+                if 'scenes' in cycle:
+                    resolved['scenes'] = list(cycle['scenes'])
+                    resolved['rules'] = self._bridge.get_rules_for_button(
+                            sensor, button)
+                self.cycles[(sensor.index, button)] = resolved
+                self.positions[(sensor.index, button)] = 0
+
+    def on_press(self, callback):
+        """Add a function to call on every button press.
+
+        Args:
+            callback: Function taking (sensor, button).
+        """
+        self._callbacks.append(callback)
+
+    def poll(self):
+        """Read all sensors once, and dispatch any new button presses.
+
+        Returns:
+            List of (sensor, button) presses found.
+        """
+        self._bridge.refresh_sensors()
+        presses = []
+        for sensor in self._bridge.sensors:
+            state = sensor.state or {}
+            if 'buttonevent' not in state:
+                continue
+            event = (state.get('lastupdated'), state['buttonevent'])
+            previous = self._last_events.get(sensor.index)
+            self._last_events[sensor.index] = event
+            if previous is None or previous == event or event[0] is None:
+                continue
+            presses.append((sensor, int(event[1])))
+        for sensor, button in presses:
+            self.dispatch(sensor, button)
+        return presses
+
+    def dispatch(self, sensor, button):
+        """Move to the next step of a button's cycle, and apply it.
+
+        Requests are sent with 'interactive' priority, ahead of polling.
+
+        Args:
+            sensor: Sensor object.
+            button: buttonevent value.
+        """
+        with priority('interactive'):
+            self._dispatch(sensor, button)
+
+    def _dispatch(self, sensor, button):
+        """Move to the next step of a button's cycle, and apply it.
+        """
+        for callback in self._callbacks:
+            callback(sensor, button)
+        key = (sensor.index, button)
+        cycle = self.cycles.get(key)
+        if not cycle or cycle.get('compiled'):
+            return
+        steps = cycle.get('states') or cycle.get('scenes')
+        position = (self.positions[key] + 1) % len(steps)
+        self.positions[key] = position
+        LOGGER.info('Cycler: %s (button %s): step %d', sensor.name, button,
+                position)
+        if 'states' in cycle:
+            for light in cycle['lights']:
+                if light.is_available:
+                    light.send(cycle['states'][position])
+        else:
+            for rule in cycle['rules']:
+                rule.set('scene', cycle['scenes'][position])
+
+    def compile(self, prefix=CYCLE_PREFIX):
+        """Deploy the cycles as Bridge rules, so no polling is needed.
+
+        Each cycle gets a CLIPGenericStatus sensor holding its position,
+        and one rule per step: when the button is pressed and the
+        position is i, the next step is applied and the position set to
+        the one after.  Rules and sensors are named with the prefix, and
+        rules are deployed with Bridge.sync_rules, so compiling the same
+        cycles again sends nothing.  Compiled cycles are skipped by
+        dispatch(); on_press() callbacks still need polling.
+
+        Rules of earlier compiles are kept for cycles that cannot be
+        compiled now, and nothing is changed if no cycle compiles.
+        Rules and status sensors of cycles no longer configured are
+        deleted.
+
+        Args:
+            prefix: Name prefix of the rules and sensors.
+
+        Returns:
+            Boolean; True on success, False on errors.
+        """
+        bridge = self._bridge
+        bridge.refresh_rules()
+        definitions = []
+        # Names of the cycles whose rules and sensor are to stay
+        names = set()
+        compiled = 0
+        return_status = True
+        for (sensor_id, button), cycle in sorted(self.cycles.items()):
+            name = '%s %s/%s' % (prefix, sensor_id, button)
+            names.add(name)
+            steps = self._step_actions(cycle)
+            if max(len(actions) for actions in steps) >= RULE_ACTION_LIMIT:
+                LOGGER.warning('Cycler: %s/%s has too many lights to compile',
+                        sensor_id, button)
+                definitions.extend(self._compiled_rules(name))
+                continue
+            memory = self._memory_sensor(name)
+            if memory is None:
+                return_status = False
+                definitions.extend(self._compiled_rules(name))
+                continue
+            compiled += 1
+            for position in range(len(steps)):
+                next_position = (position + 1) % len(steps)
+                definitions.append({
+                        'name': '%s %d' % (name, position),
+                        'conditions': [
+                            {'address': '/sensors/%s/state/buttonevent'
+                                        % sensor_id,
+                             'operator': 'eq', 'value': button},
+                            {'address': '/sensors/%s/state/lastupdated'
+                                        % sensor_id,
+                             'operator': 'dx'},
+                            {'address': '/sensors/%s/state/status'
+                                        % memory.index,
+                             'operator': 'eq', 'value': position},
+                            ],
+                        'actions': steps[next_position] + [
+                            {'address': '/sensors/%s/state' % memory.index,
+                             'method': 'PUT',
+                             'body': {'status': next_position}},
+                            ],
+                        })
+            other_rules = [rule.name for rule in cycle.get('rules', [])
+                           if not rule.name.startswith(prefix)]
+            if other_rules:
+                LOGGER.warning('Cycler: %s/%s also triggers rules %s',
+                        sensor_id, button, other_rules)
+            cycle['compiled'] = True
+        if not compiled:
+            LOGGER.warning('Cycler: Nothing compiled; rules left as they are')
+            return False
+        if not bridge.sync_rules(definitions, prefix):
+            return False
+        for sensor in list(bridge.sensors):
+            if (sensor.type == 'CLIPGenericStatus' and sensor.name
+                    and sensor.name.startswith(prefix)
+                    and sensor.name not in names):
+                LOGGER.info('Cycler: Deleting unused sensor %s', sensor.name)
+                if not bridge.delete_sensor(sensor.index):
+                    return_status = False
+        return return_status
+
+    def _compiled_rules(self, name):
+        """Returns the definitions of a cycle's rules already on the Bridge.
+
+        Args:
+            name: Name of the cycle (its rules are named name + ' i').
+
+        Returns:
+            List of rule definitions, for Bridge.sync_rules.
+        """
+        return [dict((field, rule._state[field]) for field in RULE_FIELDS
+                     if field in rule._state)
+                for rule in self._bridge.rules
+                if rule._state['name'].startswith(name + ' ')]
+
+    def _step_actions(self, cycle):
+        """Returns the rule actions of each step of a cycle.
+
+        Args:
+            cycle: Resolved cycle.
+
+        Returns:
+            List (per step) of lists of action dictionaries.
+        """
+        if 'states' in cycle:
+            return [[{'address': '/lights/%s/state' % light.index,
+                      'method': 'PUT', 'body': state}
+                     for light in cycle['lights']]
+                    for state in cycle['states']]
+        return [[{'address': '/groups/0/action', 'method': 'PUT',
+                  'body': {'scene': scene}}]
+                for scene in cycle['scenes']]
+
+    def _memory_sensor(self, name):
+        """Returns the status Sensor that holds a cycle position.
+
+        Args:
+            name: Sensor name; it is created if not on the Bridge yet.
+
+        Returns:
+            Sensor object, or None on error.
+        """
+        for sensor in self._bridge.sensors:
+            if sensor.name == name and sensor.type == 'CLIPGenericStatus':
+                return sensor
+        sensor_id = self._bridge.create_sensor(name, 'CLIPGenericStatus',
+                {'status': 0}, name.replace(' ', '-'))
+        if sensor_id is None:
+            return None
+        return _get_from_pool(self._bridge.sensors, sensor_id)[0]
+
+    def listen(self, clip):
+        """Dispatch button presses pushed by a CLIP v2 event stream.
+
+        This replaces polling: call clip.start() instead of run().
+
+        Args:
+            clip: ClipV2 client of the same Bridge.
+        """
+        def on_event(resource, change):
+            """Dispatch button changes of known Sensors.
+            """
+            if isinstance(resource, Sensor) and 'button' in change:
+                button = (resource.state or {}).get('buttonevent')
+                if button is not None:
+                    self.dispatch(resource, int(button))
+
+        clip.on_event(on_event)
+
+    def run(self, interval=CYCLER_INTERVAL):
+        """Poll until stop() is called.
+
+        Args:
+            interval: Seconds between polls.
+        """
+        with priority('background'):
+            self.poll()
+            while not self._stop.wait(interval):
+                try:
+                    self.poll()
+                except (KphueException, KphueTimeout) as error:
+                    LOGGER.warning('Cycler: Poll failed: %s', error)
+
+    def stop(self):
+        """Stop polling.
+        """
+        self._stop.set()
+
+
+@traced
+class ClipV2(object):
+    """CLIP v2 (Hue API v2) client of a Bridge, with its event stream.
+
+    The event stream pushes light, button and motion changes as they
+    happen; they are applied to the v1 Light and Sensor objects of the
+    Bridge (so Group aggregates, rule lookups etc. stay current), and
+    passed to callbacks added with on_event().  v2 resource IDs are
+    mapped to v1 objects through their id_v1.
+
+    The stream runs in a thread (start/stop).  After a disconnect it
+    reconnects with backoff, sending the last event ID, and resyncs the
+    Lights and Sensors with one bulk request each, in case events were
+    missed.
+    """
+    def __init__(self, bridge, https=True):
+        """Initialize the client.
+
+        Args:
+            bridge: Bridge to use.
+            https: Whether to use HTTPS (the Bridge only serves v2 over
+                HTTPS; plain HTTP is for local stand-ins).
+        """
+        self._bridge = bridge
+        self.transport = Transport(bridge.ip, https, bridge._check_pin)
+        self.last_event_id = None
+        # v2 resource ID: v2 resource (with id_v1 and metadata)
+        self.resources = {}
+        self._callbacks = []
+        self._stop = threading.Event()
+        self._thread = None
+        # Socket of the stream, shut down by stop() to end a blocked read
+        self._sock = None
+
+    def __repr__(self):
+        """Like default repr function, but add the Bridge IP.
+
+        Returns:
+            Object string representation.
+        """
+        return '<{0}.{1} {2} at {3}>'.format(self.__class__.__module__,
+                self.__class__.__name__, self._bridge.ip, hex(id(self)))
+
+    def _headers(self):
+        """Returns the HTTP headers of v2 requests.
+        """
+        return {'hue-application-key': self._bridge.user}
+
+    def request(self, mode, address, data=None, timeout=10,
+                deadline=None):
+        """Make a v2 request.
+
+        v2 requests share the dispatch queue and circuit breaker of the
+        Bridge with v1 requests (see Bridge.api_request), and are
+        recorded by active RequestTracers.  They are not retried.  The
+        event stream is not sent this way: it would hold a dispatch
+        slot for as long as it runs.
+
+        Args:
+            mode: One of: ('GET', 'DELETE', 'PUT', 'POST')
+            address: Address below /clip/v2/, e.g. 'resource/light'.
+            data: Optional dictionary to send.
+            timeout: Timeout in seconds.
+            deadline: Optional bound on the total time, including the
+                wait in the dispatch queue, in seconds.
+
+        Returns:
+            List of resources ('data' of the response).
+
+        Raises:
+            KphueException on errors; KphueUnavailable while the
+            breaker is open.
+        """
+        bridge = self._bridge
+        path = '/clip/v2/%s' % address
+        if data is not None:
+            data = json_dumps(data)
+        if mode == 'GET':
+            key = path
+        else:
+            key = None
+
+        def send():
+            """Make the request, if the breaker allows it.
+            """
+            if not bridge.breaker.allow():
+                raise KphueUnavailable('v2 request: %s %s refused; %s is'
+                        ' down.' % (mode, address, bridge.breaker.name))
+            start = time.time()
+            # As in Bridge._send: None for errors that say nothing about
+            # the load of the Bridge.
+            kept_up = None
+            try:
+                body = self.transport.request(mode, path, data, timeout,
+                        self._headers())
+                kept_up = True
+            except KphueBusy:
+                kept_up = False
+                raise
+            except socket.timeout:
+                kept_up = False
+                bridge.breaker.record_failure()
+                raise KphueTimeout('v2 request: %s %s timed out.'
+                        % (mode, address))
+            except (socket.error, httplib.HTTPException) as error:
+                kept_up = False
+                bridge.breaker.record_failure()
+                raise KphueException('v2 request: %s %s: %s'
+                        % (mode, address, error))
+            finally:
+                if kept_up is not None:
+                    bridge.dispatcher.record(time.time() - start, kept_up)
+            bridge.breaker.record_success()
+            tracers = _TRACERS.get()
+            if tracers:
+                method = traced_call()
+                elapsed = time.time() - start
+                for tracer in tracers:
+                    tracer.record(method, len(data or b''), len(body),
+                            elapsed)
+            try:
+                return json_loads(body)
+            except ValueError:
+                raise KphueBadResponse('v2 request: %s %s invalid'
+                        ' response: %s' % (mode, address, _text(body[:80])))
+
+        result = bridge.dispatcher.call(send, key=key, deadline=deadline)
+        if result.get('errors'):
+            raise KphueException('v2 request: %s %s: %s'
+                    % (mode, address, result['errors']))
+        return result.get('data', [])
+
+    def map_resources(self):
+        """Read all v2 resources, to map their IDs to v1 objects.
+        """
+        self.resources = dict((resource['id'], resource)
+                              for resource in self.request('GET', 'resource'))
+        LOGGER.debug('%s: %d v2 resources', self, len(self.resources))
+
+    def v1_object(self, resource):
+        """Returns the v1 object of a v2 resource, if it has one.
+
+        Args:
+            resource: v2 resource (or event data) dictionary.
+
+        Returns:
+            Light, Sensor, Group, ... object, or None.
+        """
+        id_v1 = resource.get('id_v1')
+        if not id_v1:
+            id_v1 = self.resources.get(resource.get('id'), {}).get('id_v1')
+        if not id_v1:
+            return None
+        return self._bridge.resource_at(id_v1)
+
+    def on_event(self, callback):
+        """Add a function to call for every resource change.
+
+        Args:
+            callback: Function taking (v1 object or None, v2 data).
+        """
+        self._callbacks.append(callback)
+
+    def start(self):
+        """Consume the event stream in a thread, until stop() is called.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run,
+                name='kphue-events-%s' % self._bridge.ip)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop consuming the event stream.
+        """
+        self._stop.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def run(self):
+        """Consume the event stream until stop() is called.
+        """
+        attempt = 0
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                if not self.resources:
+                    self.map_resources()
+                if connected_before:
+                    self._resync()
+                connected_before = True
+                for event_id, data in self._stream():
+                    attempt = 0
+                    self.last_event_id = event_id or self.last_event_id
+                    self.handle(data)
+            except (KphueException, KphueTimeout, socket.error,
+                    httplib.HTTPException, ValueError) as error:
+                if self._stop.is_set():
+                    break
+                LOGGER.warning('%s: Event stream failed: %s', self, error)
+            delay = self._bridge.retry_policy.delay(attempt)
+            attempt += 1
+            if self._stop.wait(delay):
+                break
+
+    def _resync(self):
+        """Catch up on changes that may have been missed while away.
+        """
+        with priority('background'):
+            self._bridge.refresh_lights()
+            self._bridge.refresh_sensors()
+
+    def _stream(self):
+        """Yields server-sent events of the stream, as they arrive.
+
+        Yields:
+            Tuples (event ID, data string).
+        """
+        headers = self._headers()
+        headers['Accept'] = 'text/event-stream'
+        if self.last_event_id:
+            headers['Last-Event-ID'] = self.last_event_id
+        connection = self.transport._new_connection(EVENTSTREAM_TIMEOUT)
+        try:
+            connection.request('GET', '/eventstream/clip/v2', headers=headers)
+            self._sock = connection.sock
+            response = connection.getresponse()
+            if response.status != 200:
+                raise KphueException('Event stream: HTTP %s'
+                        % response.status)
+            LOGGER.info('%s: Event stream connected', self)
+            event_id = None
+            data = []
+            while not self._stop.is_set():
+                line = response.readline()
+                if not line:
+                    raise KphueException('Event stream closed')
+                line = line.decode('utf-8').rstrip('\r\n')
+                if not line:
+                    if data:
+                        yield event_id, '\n'.join(data)
+                    event_id = None
+                    data = []
+                elif line.startswith(':'):
+                    continue
+                else:
+                    field, _, value = line.partition(':')
+                    value = value[1:] if value.startswith(' ') else value
+                    if field == 'id':
+                        event_id = value
+                    elif field == 'data':
+                        data.append(value)
+        finally:
+            self._sock = None
+            connection.close()
+
+    def handle(self, data):
+        """Apply one server-sent event, and call the callbacks.
+
+        A change that cannot be applied (or whose callback fails) is
+        logged and skipped, so it does not end the stream.
+
+        Args:
+            data: Data of the event: a JSON list of events, each with a
+                'type' and a list of resource changes in 'data'.
+        """
+        try:
+            events = json_loads(data)
+        except ValueError:
+            LOGGER.warning('%s: Malformed event: %s', self, data[:80])
+            return
+        for event in events:
+            if event.get('type') not in ('update', 'add'):
+                continue
+            for change in event.get('data', []):
+                try:
+                    self._handle_change(change, event.get('creationtime'))
+                except Exception as error:
+                    LOGGER.error('%s: Could not handle event %s: %r', self,
+                            change, error)
+
+    def _handle_change(self, change, creationtime=None):
+        """Apply one v2 resource change, and call the callbacks.
+
+        Args:
+            change: v2 resource data.
+            creationtime: Optional time of the event.
+        """
+        resource = self.v1_object(change)
+        if isinstance(resource, Light):
+            self._apply_light(resource, change)
+        elif isinstance(resource, Sensor):
+            self._apply_sensor(resource, change, creationtime)
+        for callback in self._callbacks:
+            callback(resource, change)
+
+    def _apply_light(self, light, change):
+        """Apply a v2 light change to a v1 Light.
+
+        Args:
+            light: Light object.
+            change: v2 light data.
+        """
+        state = light._state['state']
+        if 'on' in change:
+            state['on'] = change['on']['on']
+        if 'dimming' in change:
+            state['bri'] = constrain_value(
+                    int(round(change['dimming']['brightness'] * 2.54)), 1,
+                    BRI_MAX)
+        if 'color' in change and 'xy' in change['color']:
+            xy = change['color']['xy']
+            state['xy'] = [xy['x'], xy['y']]
+            state['colormode'] = 'xy'
+        if change.get('color_temperature', {}).get('mirek') is not None:
+            state['ct'] = change['color_temperature']['mirek']
+            state['colormode'] = 'ct'
+        light.refresh(light._state)
+
+    def _apply_sensor(self, sensor, change, creationtime=None):
+        """Apply a v2 button, motion, temperature or light level change.
+
+        Args:
+            sensor: Sensor object.
+            change: v2 resource data.
+            creationtime: Optional time of the event.
+        """
+        state = sensor._state.setdefault('state', {})
+        if 'button' in change:
+            event = (change['button'].get('button_report', {}).get('event')
+                     or change['button'].get('last_event'))
+            control_id = self.resources.get(change.get('id'), {}).get(
+                    'metadata', {}).get('control_id', 1)
+            if sensor.type == 'ZGPSwitch':
+                state['buttonevent'] = TAP_BUTTONS[control_id - 1]
+            elif event in BUTTON_EVENTS:
+                state['buttonevent'] = control_id * 1000 + BUTTON_EVENTS[event]
+        if 'motion' in change:
+            state['presence'] = change['motion']['motion']
+        if 'temperature' in change:
+            state['temperature'] = int(round(
+                    change['temperature']['temperature'] * 100))
+        if 'light' in change:
+            state['lightlevel'] = change['light']['light_level']
+        if creationtime:
+            state['lastupdated'] = creationtime.rstrip('Z')
+        sensor.refresh(sensor._state)
+
+
+@traced
+class EntertainmentStream(object):
+    """Stream colors to the Lights of an Entertainment Group.
+
+    Streaming is started over REST, then a sender thread sends one
+    HueStream frame (all Lights, xy and brightness) per tick of a fixed
+    rate clock, over DTLS (PSK: user name and client key) to UDP port
+    STREAM_PORT.  Colors set between ticks only change the next frame,
+    so producers never wait on the network.
+
+    DTLS needs python-mbedtls; dtls=False sends plain UDP, for local
+    stand-ins.  A DTLS error (e.g. the Bridge ended the session) stops
+    the sender thread and is kept in error; stop() still deactivates
+    streaming on the Group.
+    """
+    HEADER = b'HueStream\x01\x00'
+
+    def __init__(self, bridge, group, rate=STREAM_RATE, clientkey=None,
+                 dtls=True, address=None):
+        """Initialize the stream.
+
+        Args:
+            bridge: Bridge to use.
+            group: Entertainment Group object, name or ID.
+            rate: Frames per second (25 to 50 works well).
+            clientkey: Client key (hex string) from registering with
+                'generateclientkey'; read from the config file entry of
+                the Bridge if not given.
+            dtls: Whether to use DTLS.
+            address: Optional (host, port) to send to.
+        """
+        self._bridge = bridge
+        if not isinstance(group, Group):
+            group = _get_from_pool(bridge.groups, group)[0]
+        self.group = group
+        self.rate = float(rate)
+        if clientkey is None:
+            clientkey = read_config(bridge.config_file).get(
+                    bridge.ip, {}).get('clientkey')
+        self.clientkey = clientkey
+        self.dtls = dtls
+        self.address = address or (bridge.ip.split(':')[0], STREAM_PORT)
+        # Frames sent, and ticks late enough that a frame was skipped
+        self.frames = 0
+        self.skipped = 0
+        self._sequence = 0
+        self._records = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._socket = None
+        self._thread = None
+        # DTLS error that stopped the sender thread, if any
+        self.error = None
+        for light in group.lights:
+            self.set_xy(light, light.xy or [0.3127, 0.329], 0)
+
+    def __repr__(self):
+        """Like default repr function, but add the Group name.
+
+        Returns:
+            Object string representation.
+        """
+        return '<{0}.{1} "{2}" at {3}>'.format(self.__class__.__module__,
+                self.__class__.__name__, self.group.name, hex(id(self)))
+
+    def set_rgb(self, light, rgb):
+        """Set the color of a Light in the next frames.
+
+        Args:
+            light: Light object or ID.
+            rgb: [r, g, b], 0 to 255.
+        """
+        rgb = validate_rgb(rgb)
+        self.set_xy(light, rgb_to_xy(rgb), max(rgb) / 255.0)
+
+    def set_xy(self, light, xy, brightness):
+        """Set the color of a Light in the next frames.
+
+        Args:
+            light: Light object or ID.
+            xy: [x, y], 0.0 to 1.0.
+            brightness: 0.0 to 1.0.
+        """
+        light_id = getattr(light, 'index', light)
+        values = [int(round(constrain_value(value, 0.0, 1.0) * 0xffff))
+                  for value in (xy[0], xy[1], brightness)]
+        record = struct.pack('>BHHHH', 0, light_id, *values)
+        with self._lock:
+            self._records[light_id] = record
+
+    def frame(self):
+        """Returns the next HueStream frame.
+
+        Returns:
+            Frame bytes.
+        """
+        with self._lock:
+            records = b''.join(self._records.values())
+        self._sequence = (self._sequence + 1) % 256
+        # Sequence, 2 reserved bytes, color space (1: xy + brightness),
+        # 1 reserved byte.
+        return (self.HEADER + struct.pack('>BHBB', self._sequence, 0, 1, 0)
+                + records)
+
+    def start(self):
+        """Activate streaming on the Group, and start sending frames.
+
+        Raises:
+            KphueException if streaming can't be started.
+        """
+        responses = self._bridge.api_request('PUT',
+                'groups/%s' % self.group.index,
+                json_dumps({'stream': {'active': True}}))
+        for response in responses:
+            if 'error' in response:
+                raise KphueException('%s: %s' % (self,
+                        response['error']['description']))
+        self._socket = self._open_socket()
+        self.error = None
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                name='kphue-stream-%s' % self.group.index)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop sending frames, and deactivate streaming on the Group.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._bridge.api_request('PUT', 'groups/%s' % self.group.index,
+                json_dumps({'stream': {'active': False}}))
+        LOGGER.info('%s: %d frames sent, %d skipped', self, self.frames,
+                self.skipped)
+
+    def _open_socket(self):
+        """Returns a connected UDP (or DTLS) socket.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if self.dtls:
+            if mbedtls_tls is None:
+                raise KphueException('DTLS streaming needs python-mbedtls')
+            if not self.clientkey:
+                raise KphueException('DTLS streaming needs a client key')
+            config = mbedtls_tls.DTLSConfiguration(
+                    pre_shared_key=(self._bridge.user,
+                                    bytes(bytearray.fromhex(self.clientkey))),
+                    ciphers=[STREAM_CIPHER],
+                    validate_certificates=False)
+            sock = mbedtls_tls.ClientContext(config).wrap_socket(sock,
+                    server_hostname=None)
+        sock.connect(self.address)
+        if self.dtls:
+            sock.do_handshake()
+        return sock
+
+    def _run(self):
+        """Send a frame per tick until stop() is called.
+
+        Ticks follow a fixed clock: a late frame does not delay the
+        next ones, and ticks missed entirely are skipped.
+        """
+        period = 1 / self.rate
+        next_tick = time.time()
+        while not self._stop.is_set():
+            try:
+                self._socket.send(self.frame())
+                self.frames += 1
+            except _STREAM_TLS_ERRORS as error:
+                # The DTLS session is gone; frames would only fail too.
+                LOGGER.error('%s: DTLS error, stopping: %s', self, error)
+                self.error = error
+                self._stop.set()
+                return
+            except socket.error as error:
+                LOGGER.warning('%s: Send failed: %s', self, error)
+            next_tick += period
+            delay = next_tick - time.time()
+            if delay < 0:
+                missed = int(-delay / period) + 1
+                self.skipped += missed
+                next_tick += missed * period
+                delay += missed * period
+            self._stop.wait(delay)
+
+
+@traced
+class HueProxy(object):
+    """Local caching proxy, so many processes share one Bridge session.
+
+    The proxy owns the Bridge connection: it polls the full state with
+    a single request every interval, and serves the same /api/<user>/
+    surface over HTTP, so scripts just use Bridge(ip='localhost:8089').
+
+    Reads are answered from the polled state; reads of anything else
+    (e.g. groups/0) are forwarded and cached for an interval.  PUTs to
+    the same address are coalesced: while one waits for the Bridge rate
+    limit, later ones are merged into it, and each client gets the
+    results for its own values.  PUTs of relative values (*_inc) or
+    alerts are never merged, as each one counts.  Values the Bridge
+    reports as set are applied to the cached state; after other writes
+    (POST, DELETE, Group actions) the state is polled before the client
+    is answered, so it reads its own writes.  Requests for other users
+    are forwarded as they are.  All requests to the Bridge go through
+    its dispatch queue.
+
+    The proxy serves on this computer, so Bridges at loopback addresses
+    are never rediscovered elsewhere (see Bridge.rediscover).
+
+    Usage:
+        proxy = HueProxy(my_bridge)
+        proxy.serve_forever()
+    """
+    def __init__(self, bridge, port=PROXY_PORT, interval=PROXY_INTERVAL,
+                 host='127.0.0.1'):
+        """Initialize the proxy.
+
+        Args:
+            bridge: Bridge to serve.
+            port: Local port to listen on; 0 picks a free one.
+            interval: Seconds between polls.
+            host: Local address to listen on.
+        """
+        self._bridge = bridge
+        self.interval = interval
+        self.datastore = {}
+        self.polls = 0
+        self.hits = 0
+        self.forwarded = 0
+        self.writes = 0
+        self.merged = 0
+        # Encoded responses from the polled state, by address.
+        self._encoded = {}
+        # Forwarded reads by address: (time, response bytes).
+        self._extra = {}
+        # PUTs waiting for the rate limit, by address.
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._server = _ProxyServer((host, port), _ProxyHandler)
+        self._server.proxy = self
+        self.port = self._server.server_address[1]
+
+    def __repr__(self):
+        """Like default repr function, but add the port.
+
+        Returns:
+            Object string representation.
+        """
+        return '<{0}.{1} object (port {2}) at {3}>'.format(
+                self.__class__.__module__, self.__class__.__name__,
+                self.port, hex(id(self)))
+
+    def start(self):
+        """Poll and serve in threads, until stop() is called.
+        """
+        self.poll()
+        self._stop.clear()
+        for target, name in ((self._run_poller, 'kphue-proxy-poll'),
+                             (self._server.serve_forever,
+                              'kphue-proxy-%d' % self.port)):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+        LOGGER.info('Proxy for %s on port %d', self._bridge.ip, self.port)
+
+    def serve_forever(self):
+        """Poll and serve until stop() is called (e.g. by a signal).
+        """
+        self.start()
+        while not self._stop.wait(1):
+            pass
+
+    def stop(self):
+        """Stop polling and serving.
+        """
+        self._stop.set()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def poll(self):
+        """Read the full Bridge state with a single request.
+        """
+        with priority('background'):
+            datastore = self._bridge.api_request('GET', '')
+        if not isinstance(datastore, dict) or 'lights' not in datastore:
+            LOGGER.warning('Proxy: Poll failed: %s', datastore)
+            return
+        with self._lock:
+            self.datastore = datastore
+            self._encoded = {}
+            self._extra = {}
+            self.polls += 1
+
+    def _run_poller(self):
+        """Poll every interval, until stop() is called.
+        """
+        while not self._stop.wait(self.interval):
+            self._poll_logged()
+
+    def _poll_logged(self):
+        """Poll, logging failures instead of raising them.
+        """
+        try:
+            self.poll()
+        except (KphueException, KphueTimeout) as error:
+            LOGGER.warning('Proxy: Poll failed: %s', error)
+
+    def handle(self, mode, path, body=None):
+        """Answer a client request.
+
+        Args:
+            mode: HTTP method.
+            path: Request path, like '/api/<user>/lights/1'.
+            body: Request body bytes, or None.
+
+        Returns:
+            Response body bytes.
+        """
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if parts[:2] != ['api', self._bridge.user]:
+            return self._forward(mode, path, body)
+        address = '/'.join(parts[2:])
+        if mode == 'GET':
+            return self._read(address, path)
+        if mode == 'PUT' and body:
+            try:
+                values = json_loads(body)
+            except ValueError as error:
+                return json_dumps(_proxy_error(path, error, 2))
+            if isinstance(values, dict):
+                return self._write(address, values)
+        response = self._forward(mode, path, body)
+        self._poll_logged()
+        return response
+
+    def _forward(self, mode, path, body=None):
+        """Send a request on to the Bridge as it is.
+
+        Returns:
+            Response body bytes.
+        """
+        self.forwarded += 1
+        key = path if mode == 'GET' else None
+        try:
+            return json_dumps(self._bridge.dispatcher.call(
+                    lambda: self._bridge.request(mode, path, body), key=key))
+        except (KphueException, KphueTimeout) as error:
+            return json_dumps(_proxy_error(path, error))
+
+    def _read(self, address, path):
+        """Answer a read from the polled state, or forward it.
+
+        Args:
+            address: Address after /api/<user>/, like 'lights/1'.
+            path: Full request path.
+
+        Returns:
+            Response body bytes.
+        """
+        with self._lock:
+            encoded = self._encoded.get(address)
+            if encoded is None:
+                node = self.datastore
+                for key in address.split('/'):
+                    if not key:
+                        continue
+                    if not isinstance(node, dict) or key not in node:
+                        node = None
+                        break
+                    node = node[key]
+                if node is not None:
+                    encoded = self._encoded[address] = json_dumps(node)
+            if encoded is None:
+                cached = self._extra.get(address)
+                if cached and time.time() - cached[0] < self.interval:
+                    encoded = cached[1]
+        if encoded is not None:
+            self.hits += 1
+            return encoded
+        encoded = self._forward('GET', path)
+        with self._lock:
+            self._extra[address] = (time.time(), encoded)
+        return encoded
+
+    def _write(self, address, values):
+        """Send a PUT, merged with the others to the same address.
+
+        Args:
+            address: Address after /api/<user>/, like 'lights/1/state'.
+            values: Dictionary of values to set.
+
+        Returns:
+            Response body bytes, with the results for these values.
+        """
+        if any(key.endswith('_inc') or key == 'alert' for key in values):
+            # Each of these counts; merged, some would be lost.
+            with self._lock:
+                self.writes += 1
+            pending = _PendingWrite(values)
+            self._send(address, pending)
+            return json_dumps(pending.response)
+        with self._lock:
+            self.writes += 1
+            pending = self._pending.get(address)
+            if pending is None:
+                pending = self._pending[address] = _PendingWrite(values)
+                owner = True
+            else:
+                pending.values.update(values)
+                self.merged += 1
+                owner = False
+        if owner:
+            self._send(address, pending)
+        else:
+            pending.done.wait()
+        response = pending.response
+        results = [result for result in response if 'error' in result
+                   or any(path.split('/')[-1] in values
+                          for path in result.get('success', {}))]
+        return json_dumps(results or response)
+
+    def _send(self, address, pending):
+        """Send a coalesced PUT once the rate limit allows.
+
+        Args:
+            address: Address after /api/<user>/.
+            pending: _PendingWrite; closed to merging once sent.
+        """
+        resource_type = {'lights': 'light', 'groups': 'group'}.get(
+                address.split('/')[0], 'resource')
+        try:
+            self._bridge.rate_limits[resource_type].acquire()
+            with self._lock:
+                if self._pending.get(address) is pending:
+                    del self._pending[address]
+                data = json_dumps(pending.values)
+            response = self._bridge.api_request('PUT', address, data)
+        except (KphueException, KphueTimeout) as error:
+            response = _proxy_error('/' + address, error)
+        else:
+            self._apply(address, response)
+        finally:
+            with self._lock:
+                if self._pending.get(address) is pending:
+                    del self._pending[address]
+        pending.response = response
+        pending.done.set()
+
+    def _apply(self, address, response):
+        """Apply values the Bridge reports as set to the polled state.
+
+        Args:
+            address: Address the PUT was sent to.
+            response: List of responses to the PUT.
+        """
+        if not isinstance(response, list):
+            return
+        with self._lock:
+            for result in response:
+                for path, value in result.get('success', {}).items():
+                    keys = [key for key in path.split('/') if key]
+                    node = self.datastore
+                    for key in keys[:-1]:
+                        node = node.get(key) if isinstance(node, dict) \
+                                else None
+                    if isinstance(node, dict) and keys[-1] in node:
+                        node[keys[-1]] = value
+            self._encoded = {}
+            self._extra = {}
+        if not address.startswith('lights/'):
+            # Group actions and others change more than they report.
+            self._poll_logged()
+
+
+class _PendingWrite(object):
+    """A PUT waiting in a HueProxy, to which others can be merged.
+    """
+    def __init__(self, values):
+        """Initialize the write.
+
+        Args:
+            values: Dictionary of values to set.
+        """
+        self.values = dict(values)
+        self.done = threading.Event()
+        self.response = None
+
+
+class _ProxyServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server of a HueProxy.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    """Hands HTTP requests to the HueProxy of the server.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        """Log requests at debug level, not to stderr.
+        """
+        LOGGER.debug('Proxy: ' + format, *args)
+
+    def _answer(self, mode):
+        """Answer a request with the response of the proxy.
+
+        Args:
+            mode: HTTP method.
+        """
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        response = self.server.proxy.handle(mode, self.path, body)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def do_GET(self):
+        """Answer a GET.
+        """
+        self._answer('GET')
+
+    def do_PUT(self):
+        """Answer a PUT.
+        """
+        self._answer('PUT')
+
+    def do_POST(self):
+        """Answer a POST.
+        """
+        self._answer('POST')
+
+    def do_DELETE(self):
+        """Answer a DELETE.
+        """
+        self._answer('DELETE')
+
+
+def debug(loglevel='DEBUG'):
+    """Start library logging manually (for interactive shell testing).
+    """
+    loglevel = getattr(logging, loglevel)
+    logging.basicConfig(level=loglevel)
+
+
+def default_config_file():
+    """Returns the path of the config file for this platform.
+
+    Returns:
+        Path to the config file.
+    """
+    home_dir = os.getenv(USER_HOME)
+    if home_dir and os.access(home_dir, os.W_OK):
+        config_file = os.path.join(home_dir, CONFIG_FILE)
+    elif ('iPod' in platform.machine() or 'iPhone' in platform.machine()
+            or 'iPad' in platform.machine()):
+        config_file = os.path.join(home_dir, 'Documents', CONFIG_FILE)
+    else:
+        config_file = os.path.join(os.getcwd(), CONFIG_FILE)
+    return config_file
+
+
+def read_config(config_file):
+    """Returns the contents of a config file.
+
+    Args:
+        config_file: Path to the config file.
+
+    Returns:
+        Dictionary keyed by Bridge IP; empty if the file can't be read.
+    """
+    try:
+        with open(config_file, 'rb') as file_handle:
+            config = json_loads(file_handle.read())
+    except IOError:
+        LOGGER.warning('Could not read %s', config_file)
+        config = {}
+    except ValueError:
+        LOGGER.warning('Malformed file %s', config_file)
+        config = {}
+    return config
+
+
+def write_config(config_file, config):
+    """Writes a config file, replacing it atomically.
+
+    Args:
+        config_file: Path to the config file.
+        config: Dictionary keyed by Bridge IP.
+    """
+    # A temporary file of its own, as several processes may write at once.
+    handle, temp_file = tempfile.mkstemp(prefix='.kphue',
+            dir=os.path.dirname(os.path.abspath(config_file)))
+    try:
+        with os.fdopen(handle, 'wb') as file_handle:
+            file_handle.write(json_dumps(config))
+        if os.path.exists(config_file) and not hasattr(os, 'replace'):
+            os.remove(config_file)
+        getattr(os, 'replace', os.rename)(temp_file, config_file)
+    except (IOError, OSError):
+        os.remove(temp_file)
+        raise
+
+
+def config_bridges(config):
+    """Returns the Bridge IPs listed in a config file.
+
+    Args:
+        config: Contents of the config file.
+
+    Returns:
+        List of IPs in the order listed, without reserved keys like
+        DISCOVERY_KEY.
+    """
+    return [key for key in config if not key.startswith('_')]
+
+
+def discover_bridges(timeout=DISCOVERY_TIMEOUT, config_file=None,
+                     ssdp_address=None, mdns_address=None):
+    """Find Bridges on the local network, without internet access.
+
+    UPnP (SSDP M-SEARCH) and mDNS (_hue._tcp) queries run concurrently;
+    both wait at most timeout seconds for answers.
+
+    Args:
+        timeout: Seconds to wait for answers.
+        config_file: Optional path to the config file; results are
+            cached in it under DISCOVERY_KEY, keyed by Bridge ID.
+        ssdp_address: (host, port) the SSDP query is sent to, if not
+            SSDP_ADDRESS (e.g. a local stand-in responder).
+        mdns_address: (host, port) the mDNS query is sent to, if not
+            MDNS_ADDRESS.
+
+    Returns:
+        Dictionary of Bridge IP, keyed by (upper case) Bridge ID.
+    """
+    searches = ((_discover_ssdp, ssdp_address or SSDP_ADDRESS),
+                (_discover_mdns, mdns_address or MDNS_ADDRESS))
+    found = {}
+    for result in parallel_map(lambda search: search[0](search[1], timeout),
+                               searches):
+        found.update(result)
+    LOGGER.info('Discovered bridges: %s', found)
+    if config_file and found:
+        config = read_config(config_file)
+        cache = config.setdefault(DISCOVERY_KEY, {})
+        for bridge_id, ip in found.items():
+            cache[bridge_id] = {'ip': ip, 'time': int(time.time())}
+        write_config(config_file, config)
+    return found
+
+
+def cached_bridge_ip(config_file, bridgeid=None, exclude=None,
+                     timeout=PROBE_TIMEOUT):
+    """Returns the IP of a Bridge found by an earlier discovery.
+
+    Cached IPs (see discover_bridges) are checked lazily: the most
+    recently seen one that still answers as the same Bridge is used.
+
+    Args:
+        config_file: Path to the config file.
+        bridgeid: Optional Bridge ID to look for; any Bridge if None.
+        exclude: Optional IP to skip (e.g. the one that just failed).
+        timeout: Seconds to wait for each Bridge to answer.
+
+    Returns:
+        IP string, or None if no cached Bridge answered.
+    """
+    config = read_config(config_file)
+    cache = config.get(DISCOVERY_KEY) or {}
+    if bridgeid:
+        wanted = bridgeid.upper()
+        cache = dict((key, value) for key, value in cache.items()
+                     if key == wanted)
+    for cached_id, entry in sorted(cache.items(),
+                                   key=lambda item: -item[1].get('time', 0)):
+        ip = entry.get('ip')
+        if not ip or ip == exclude:
+            continue
+        if _bridge_id_at(ip, timeout) == cached_id:
+            LOGGER.info('Cached ip %s of bridge %s still valid', ip, cached_id)
+            return ip
+        LOGGER.info('Cached ip %s of bridge %s is stale', ip, cached_id)
+    return None
+
+
+def _is_loopback(ip):
+    """Returns whether a Bridge IP is on this computer, like a HueProxy.
+
+    Args:
+        ip: Bridge IP, optionally with ':port'.
+
+    Returns:
+        Boolean.
+    """
+    host = ip
+    if host.startswith('['):
+        host = host[1:].split(']')[0]
+    elif host.count(':') == 1:
+        host = host.split(':')[0]
+    return host in ('localhost', '::1') or host.startswith('127.')
+
+
+def _bridge_id_at(ip, timeout=PROBE_TIMEOUT):
+    """Returns the (upper case) ID of the Bridge answering at an IP.
+
+    Args:
+        ip: Bridge IP, optionally with ':port'.
+        timeout: Seconds to wait for an answer.
+
+    Returns:
+        Bridge ID string, or None if nothing (or no Bridge) answered.
+    """
+    transport = Transport(ip)
+    try:
+        config = json_loads(transport.request('GET', '/api/config',
+                timeout=timeout))
+    except (socket.error, httplib.HTTPException, KphueException, ValueError):
+        return None
+    finally:
+        transport.close()
+    if not isinstance(config, dict) or not config.get('bridgeid'):
+        return None
+    return config['bridgeid'].upper()
+
+
+def _multicast_socket(timeout):
+    """Returns a UDP socket for sending multicast queries.
+
+    Args:
+        timeout: Socket timeout, in seconds.
+
+    Returns:
+        socket object.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+    sock.settimeout(timeout)
+    return sock
+
+
+def _receive_all(sock, timeout):
+    """Yields datagrams received until timeout seconds have passed.
+
+    Args:
+        sock: Socket to read from.
+        timeout: Seconds to keep reading.
+
+    Yields:
+        (data, (host, port)) tuples.
+    """
+    end_time = time.time() + timeout
+    while True:
+        remaining = end_time - time.time()
+        if remaining <= 0:
+            return
+        sock.settimeout(remaining)
+        try:
+            yield sock.recvfrom(4096)
+        except socket.timeout:
+            return
+
+
+def _discover_ssdp(address, timeout):
+    """Find Bridges with a UPnP M-SEARCH.
+
+    Args:
+        address: (host, port) to send the query to.
+        timeout: Seconds to wait for answers.
+
+    Returns:
+        Dictionary of Bridge IP, keyed by Bridge ID.
+    """
+    query = '\r\n'.join((
+            'M-SEARCH * HTTP/1.1',
+            'HOST: %s:%d' % address,
+            'MAN: "ssdp:discover"',
+            'MX: %d' % max(1, int(timeout)),
+            'ST: urn:schemas-upnp-org:device:basic:1',
+            '', ''))
+    found = {}
+    sock = _multicast_socket(timeout)
+    try:
+        sock.sendto(query.encode('ascii'), address)
+        for data, (host, _) in _receive_all(sock, timeout):
+            text = data.decode('utf-8', 'replace')
+            bridge_id = re.search(r'^hue-bridgeid:\s*(\S+)', text, re.I | re.M)
+            if not bridge_id:
+                continue
+            location = re.search(r'^location:\s*https?://([^/\s]+)', text,
+                    re.I | re.M)
+            if location:
+                host = re.sub(r':80$', '', location.group(1))
+            found[bridge_id.group(1).upper()] = host
+    except socket.error as error:
+        LOGGER.warning('SSDP discovery failed: %s', error)
+    finally:
+        sock.close()
+    return found
+
+
+def _discover_mdns(address, timeout):
+    """Find Bridges with an mDNS query for the _hue._tcp service.
+
+    The query is sent from an ephemeral port, so responders answer
+    directly to it (a "legacy unicast" query).
+
+    Args:
+        address: (host, port) to send the query to.
+        timeout: Seconds to wait for answers.
+
+    Returns:
+        Dictionary of Bridge IP, keyed by Bridge ID.
+    """
+    query = struct.pack('>HHHHHH', 0, 0, 1, 0, 0, 0)
+    query += _dns_name(MDNS_SERVICE) + struct.pack('>HH', 12, 1)
+    found = {}
+    sock = _multicast_socket(timeout)
+    try:
+        sock.sendto(query, address)
+        for data, (host, _) in _receive_all(sock, timeout):
+            try:
+                records = _dns_records(data)
+            except (IndexError, struct.error):
+                LOGGER.debug('Malformed mDNS answer from %s', host)
+                continue
+            bridge_id = None
+            for _, rtype, rdata in records:
+                if rtype == 16:
+                    for item in rdata:
+                        if item.lower().startswith('bridgeid='):
+                            bridge_id = item.split('=', 1)[1]
+                elif rtype == 1:
+                    host = rdata
+            if bridge_id:
+                found[bridge_id.upper()] = host
+    except socket.error as error:
+        LOGGER.warning('mDNS discovery failed: %s', error)
+    finally:
+        sock.close()
+    return found
+
+
+def _dns_name(name):
+    """Returns a DNS name in wire format.
+
+    Args:
+        name: Dotted name, e.g. '_hue._tcp.local'.
+
+    Returns:
+        Encoded bytes.
+    """
+    encoded = b''
+    for label in name.split('.'):
+        encoded += struct.pack('B', len(label)) + label.encode('ascii')
+    return encoded + b'\0'
+
+
+def _read_dns_name(packet, offset):
+    """Reads a (possibly compressed) DNS name.
+
+    Args:
+        packet: Whole DNS packet.
+        offset: Where the name starts.
+
+    Returns:
+        Tuple of the dotted name and the offset just past it.
+    """
+    labels = []
+    end = None
+    for _ in range(128):
+        length = bytearray(packet[offset:offset + 1])[0]
+        if length >= 0xc0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack('>H', packet[offset:offset + 2])[0] & 0x3fff
+        elif length:
+            labels.append(packet[offset + 1:offset + 1 + length]
+                          .decode('utf-8', 'replace'))
+            offset += 1 + length
+        else:
+            break
+    if end is None:
+        end = offset + 1
+    return '.'.join(labels), end
+
+
+def _dns_records(packet):
+    """Parses the resource records of a DNS answer.
+
+    Args:
+        packet: Whole DNS packet.
+
+    Returns:
+        List of (name, type, data) tuples.  Data is decoded for A (IP
+        string), PTR (name) and TXT (list of strings) records, and raw
+        bytes for other types.
+    """
+    counts = struct.unpack('>HHHH', packet[4:12])
+    offset = 12
+    for _ in range(counts[0]):
+        _, offset = _read_dns_name(packet, offset)
+        offset += 4
+    records = []
+    for _ in range(sum(counts[1:])):
+        name, offset = _read_dns_name(packet, offset)
+        rtype, _, _, length = struct.unpack('>HHIH',
+                packet[offset:offset + 10])
+        offset += 10
+        rdata = packet[offset:offset + length]
+        if rtype == 1:
+            rdata = socket.inet_ntoa(rdata)
+        elif rtype == 12:
+            rdata = _read_dns_name(packet, offset)[0]
+        elif rtype == 16:
+            items = []
+            index = 0
+            while index < length:
+                size = bytearray(rdata[index:index + 1])[0]
+                items.append(rdata[index + 1:index + 1 + size]
+                             .decode('utf-8', 'replace'))
+                index += 1 + size
+            rdata = items
+        records.append((name, rtype, rdata))
+        offset += length
+    return records
+
+
+def compile_schema(res_class):
+    """Returns the compiled schema of a resource class.
+
+    Key paths and conversions are resolved once per class, so decoding
+    a state is a single pass over the Fields, without reflection.
 
-        Returns:
-            Returns data object prepared for API request.
-        """
-        if 'hue' in self._state[self._attr_key]:
-            # Conform object attributes to valid ranges/values.
-            if self.rgb:
-                # should 0,0,0 turn the light off?
-                if list(self.rgb) == [0, 0, 0]:
-                    self.on = False
-                elif hasattr(self, 'color_mode') and self.color_mode == 'hs':
-                    self.hue, self.sat, self.bri = rgb_to_hsb(self.rgb)
-                else:
-                    self.xy = rgb_to_xy(self.rgb)
-                self.rgb = None
-            else:
-                self.xy = validate_xy(self.xy)
-            LOGGER.debug('hsb = %s %s %s', self.hue, self.sat, self.bri)
-            self.ct = constrain_value(self.ct, MIREDS_MIN, MIREDS_MAX)
-            self.hue = constrain_value(self.hue, 0, HUE_MAX)
-            self.sat = constrain_value(self.sat, 0, SAT_MAX)
-        self.bri = constrain_value(self.bri, 0, BRI_MAX)
-        if self.transitiontime is not None:
-            self.transitiontime = int(round(self.transitiontime))
-        if self.effect not in (None, 'colorloop'):
-            self.effect = None
+    Args:
+        res_class: Class with a _schema of Fields.
 
-        # Some added code here to work around known bug where turning off
-        # with transitiontime set makes it restart on brightness = 1
-        #   http://www.everyhue.com/vanilla/discussion/204/
-        #     bug-with-brightness-when-requesting-ontrue-transitiontime5
-        # This now works regardless of how the light is turned on/off.
-        on_state = hue_decode(self._state[self._attr_key]['on'])
-        if on_state != self.on and self.transitiontime is not None:
-            if self.on:
-                if self._bri:
-                    self.bri = self._bri
-                    self._bri = None
-            else:
-                self._bri = self.bri
-                # only changes get applied, so change brightness a little
-                if self.bri > 0:
-                    self.bri = self._bri - 1
+    Returns:
+        Tuple (decoder, encoders): decoder is a function taking an API
+        state and returning a dictionary of attribute values; encoders
+        is a list of (attr, path, encode function) for settable Fields.
+    """
+    compiled = _COMPILED_SCHEMAS.get(res_class)
+    if compiled is None:
+        steps = []
+        encoders = []
+        for field in res_class._schema:
+            decode, encode = FIELD_TYPES[field.kind]
+            subkey = field.path[1] if len(field.path) > 1 else None
+            steps.append((field.attr, field.path[0], subkey, decode))
+            if field.settable:
+                encoders.append((field.attr, field.path, encode))
+
+        def decoder(state):
+            """Decode an API state into attribute values.
+            """
+            values = {}
+            for attr, key, subkey, decode in steps:
+                value = state.get(key)
+                if subkey is not None and value is not None:
+                    value = value.get(subkey)
+                if value is None or decode is None:
+                    values[attr] = value
                 else:
-                    # This will get restored
-                    self.bri = 1
+                    values[attr] = decode(value)
+            return values
 
-        # Only request changes for value that have changed
-        states = {}
-        for state in self._state[self._attr_key]:
-            if hasattr(self, state):
-                self_value = getattr(self, state)
-                set_value = hue_encode(self_value)
-                if self._state[self._attr_key][state] != set_value:
-                    states[state] = set_value
-                    LOGGER.debug('%s (%s) --> %s', state,
-                            self._state[self._attr_key][state], set_value)
-        if states and self.transitiontime is not None:
-            states['transitiontime'] = self.transitiontime
-        # If setting something but light is off, turn light on
-        if 'on' not in states and states:
-            states['on'] = hue_encode(True)
-            LOGGER.debug('Originally off, now on; states: %s', states)
-        LOGGER.debug('%s: states = %s', self._identifier, states)
-        return states
+        compiled = (decoder, encoders)
+        _COMPILED_SCHEMAS[res_class] = compiled
+    return compiled
 
 
-class Light(Luminous):
-    """Light object.
-    """
-    def __init__(self, parent_bridge, res_id):
-        """
-        """
-        self.alert = None
-        # These cannot be set, only read:
-        self.color_mode = None
-        self.is_reachable = None
-        self.modelid = None
-        self.swversion = None
-        super(Light, self).__init__(parent_bridge, res_id, 'light')
+def _decode_none(value):
+    """Returns None for the API 'none' string, else the value unchanged.
 
-    def refresh(self):
-        """Refreshes local attributes with actual values.
-        """
-        super(Light, self).refresh()
-        self.alert = hue_decode(self._state['state']['alert'])
-        self.is_reachable = self._state['state']['reachable']
-        if 'colormode' in self._state['state']:
-            self.color_mode = self._state['state']['colormode']
-        # attributes
-        self.modelid = hue_decode(self._state['modelid'])
-        self.swversion = hue_decode(self._state['swversion'])
+    Args:
+        value: Hue API value.
 
-    def reset(self):
-        """Reset all parameters to show white light.
-        """
-        self.alert = None
-        super(Light, self).reset()
+    Returns:
+        Python value.
+    """
+    if value == 'none':
+        return None
+    return value
 
-    def set(self, parameter=None, value=None):
-        """Sets light attributes and states.
 
-        Args:
-            parameter: Name of API parameter to set.
-            value: Value to set.
+def state_version(state):
+    """Returns a version marker for a resource state.
 
-        Returns:
-            Boolean; True on success, False on errors.
-        """
-        if not self.is_reachable:
-            return False
-        else:
-            super(Light, self).set(parameter, value)
+    The v1 API has no ETags, so this is a digest of the state; equal
+    markers mean nothing changed.
 
+    Args:
+        state: Resource state, as returned by the Bridge.
 
-class Group(Luminous):
-    """Group object.
+    Returns:
+        Hex digest string.
     """
-    def __init__(self, parent_bridge, resource_id):
-        """
-        """
-        self.lights = []
-        #self.scenes = None
-        self.scene = None
-        super(Group, self).__init__(parent_bridge, resource_id, 'group')
+    encoded = json_dumps(state, sort_keys=True)
+    return hashlib.md5(encoded).hexdigest()
 
-    def refresh(self):
-        """Refreshes local attributes with actual values.
-        """
-        super(Group, self).refresh()
-        light_ids = [int(light_id) for light_id in self._state['lights']]
-        self.lights = self._bridge.get_lights(light_ids)
-        # scenes are really just stored on light.  Why is this provided?
-        #self.scenes = [str(s_id) for s_id in self._state['scenes']]
 
-    def reset(self):
-        """Reset all parameters to show white light.
-        """
-        self.scene = None
-        super(Group, self).reset()
+def use_json_backend(name=None):
+    """Select the JSON library used for requests, caches and versions.
 
+    orjson and ujson are used if installed, as they are several times
+    faster than the standard library on large datastores.  All backends
+    decode straight from bytes, and encode to bytes.
 
-class Rule(HueResource):
-    """Rule object.
+    Args:
+        name: 'orjson', 'ujson' or 'json'; if not given, the fastest
+            one installed.
+
+    Returns:
+        Name of the backend selected.
+
+    Raises:
+        KphueException if the named backend is not installed.
     """
-    def __init__(self, parent_bridge, resource_id):
-        """
-        """
-        self.lasttriggered = None
-        self.owner = None
-        self.status = None
-        self.conditions = None
-        self.actions = None
-        super(Rule, self).__init__(parent_bridge, resource_id, 'rule')
+    global JSON_BACKEND, json_loads, json_dumps
+    backends = collections.OrderedDict()
+    if orjson is not None:
+        backends['orjson'] = (orjson.loads, _orjson_dumps)
+    if ujson is not None:
+        backends['ujson'] = (ujson.loads, _ujson_dumps)
+    backends['json'] = (_stdlib_loads, _stdlib_dumps)
+    if name is None:
+        name = list(backends)[0]
+    if name not in backends:
+        raise KphueException('JSON backend %s is not installed' % name)
+    json_loads, json_dumps = backends[name]
+    JSON_BACKEND = name
+    LOGGER.debug('Using JSON backend %s', name)
+    return name
+
+
+def _orjson_dumps(obj, sort_keys=False):
+    """Returns obj encoded as JSON bytes, with orjson.
+    """
+    option = orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, option=option)
 
-    def refresh(self):
-        """Refreshes local attributes with actual values.
-        """
-        super(Rule, self).refresh()
-        for attr in self._state:
-            if hasattr(self, attr):
-                setattr(self, attr, hue_decode(self._state[attr]))
 
-    def set(self, parameter=None, value=None):
-        """Set a Rule attribute.
+def _ujson_dumps(obj, sort_keys=False):
+    """Returns obj encoded as JSON bytes, with ujson.
+    """
+    return ujson.dumps(obj, sort_keys=sort_keys,
+            escape_forward_slashes=False).encode('utf-8')
 
-        Args:
-            parameter: Attribute to set.
-            value: Value to set.
-        """
-        # TODO: Just testing action body now, but generalize.
-        for action in self.actions:
-            if 'body' in action and parameter in action['body']:
-                action['body'][parameter] = value
-        data = {'actions': self.actions}
 
-        return_status = True
-        address = '%ss/%s' % (self._type, self.index)
-        json_data = json.dumps(data)
-        responses = self._bridge.api_request('PUT', address, json_data)
-        for response in responses:
-            if 'error' in response:
-                LOGGER.error('%s: %s', self._identifier,
-                        response['error']['description'])
-                return_status = False
+def _stdlib_loads(data):
+    """Returns the value of JSON bytes or string, with the json module.
+    """
+    if PY3K and sys.version_info < (3, 6) and isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
 
-        # Reload set values
-        self.refresh()
-        return return_status
 
-class Scene(HueResource):
-    """Scene object.
+def _stdlib_dumps(obj, sort_keys=False):
+    """Returns obj encoded as JSON bytes, with the json module.
     """
-    def __init__(self, parent_bridge, resource_id):
-        """
-        """
-        self.active = None
-        self.lights = None
-        super(Scene, self).__init__(parent_bridge, resource_id, 'scene')
+    return json.dumps(obj, sort_keys=sort_keys).encode('utf-8')
 
-    def refresh(self):
-        """Refreshes local attributes with actual values.
-        """
-        super(Scene, self).refresh()
 
+def _text(data):
+    """Returns request or response data as text, for messages.
+    """
+    if isinstance(data, bytes):
+        return data.decode('utf-8', 'replace')
+    return data
 
-class Schedule(HueResource):
-    """Schedule object.
+
+def _id_sort_key(id_string):
+    """Sort key for resource ID strings: numeric IDs in numeric order.
     """
-    def __init__(self, parent_bridge, resource_id):
-        """
-        """
-        # Provided by API
-        self._command = None
-        self.description = None
-        self.created = None
-        self.localtime = None
-        self.time = None
-        self.status = None
-        self.autodelete = None
-        # Added by kphue
-        self.group = None
-        self.state = None
-        # Only provided for timers
-        self.starttime = None
-        super(Schedule, self).__init__(parent_bridge, resource_id, 'schedule')
+    if id_string.isdigit():
+        return (0, int(id_string), id_string)
+    return (1, 0, id_string)
 
-    def refresh(self):
-        """Refreshes local attributes with actual values.
-        """
-        super(Schedule, self).refresh()
-        self._command = self._state['command']
-        if 'address' in self._command:
-            self.group = self._command['address'].split('/')[-2]
-        if 'body' in self._command:
-            self.state = self._command['body']
-        self.description = self._state['description']
-        self.created = self._state['created']
-        self.time = self._state['time']
-        self.status = self._state['status']
-        self.autodelete = hue_decode(self._state['autodelete'])
-        if 'starttime' in self._state:
-            self.starttime = self._state['starttime']
-        else:
-            self.starttime = None
-        if 'localtime' in self._state:
-            self.localtime = self._state['localtime']
-            LOGGER.warning('localtime: %s', self.localtime)
-        else:
-            self.localtime = None
 
-    def set(self, parameter=None, value=None):
-        """Changes the attributes of a Schedule.
+def parallel_map(function, items, workers=PARALLEL_WORKERS):
+    """Calls a function on each item, using a pool of threads.
 
-        TODO: This may require generalization of Luminous attributes
-        and state...
-        """
-        pass
+    Args:
+        function: Function taking a single item.
+        items: Items to process.
+        workers: Maximum number of threads.
 
+    Returns:
+        List of results, in the same order as items.
 
-class Sensor(HueResource):
-    """Sensor object.
+    Raises:
+        The first exception raised by any call, once all calls finished.
     """
-    def __init__(self, parent_bridge, resource_id):
-        """
-        "state": {
-            "daylight": false,
-            "lastupdated": "2014-06-27T07:38:51"
-        },
-        "config": {
-            "on": true,
-            "long": "none",
-            "lat": "none",
-            "sunriseoffset": 50,
-            "sunsetoffset": 50
-        },
-        "name": "Daylight",
-        "type": "Daylight",
-        "modelid": "PHDL00",
-        "manufacturername": "Philips",
-        "swversion": "1.0"
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+    pending = queue.Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+    # Threads don't inherit the tracers, traced method and priority of
+    # the caller.
+    tracers = _TRACERS.get()
+    caller = traced_call()
+    level = _PRIORITY.get()
+
+    def work():
+        """Process items until there are none left.
         """
-        self.state = None
-        self.config = None
-        self.type = None
-        self.modelid = None
-        self.manufacturername = None
-        self.swversion = None
-        super(Sensor, self).__init__(parent_bridge, resource_id, 'sensor')
+        # The context of the thread ends with it; no reset needed.
+        _TRACERS.set(tracers)
+        with traced_scope(caller), priority(level):
+            while True:
+                try:
+                    index, item = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[index] = function(item)
+                except Exception as error:
+                    errors.append(error)
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+@contextlib.contextmanager
+def expect_requests(max=None, min=0):
+    """Assert how many Bridge requests a block of code makes.
 
-    def refresh(self):
-        """Refreshes local attributes with actual values.
-        """
-        super(Sensor, self).refresh()
-        for attr in self._state:
-            if hasattr(self, attr):
-                setattr(self, attr, hue_decode(self._state[attr]))
+    Usage:
+        with expect_requests(max=2):
+            bridge.get_light('Desk').set('bri', 100)
+
+    Args:
+        max: Most requests allowed, or None for no limit.
+        min: Fewest requests expected.
 
+    Yields:
+        The RequestTracer counting the requests.
 
-def debug(loglevel='DEBUG'):
-    """Start library logging manually (for interactive shell testing).
+    Raises:
+        AssertionError with the per-method report if outside the range.
     """
-    loglevel = getattr(logging, loglevel)
-    logging.basicConfig(level=loglevel)
+    with RequestTracer() as tracer:
+        yield tracer
+    count = tracer.requests
+    if count < min or (max is not None and count > max):
+        raise AssertionError('%d requests made, expected %s to %s:\n%s'
+                % (count, min, max, tracer.report()))
+
+
+def _proxy_error(path, error, error_type=901):
+    """Returns a Hue API error response for a failed proxy request.
+
+    Args:
+        path: Request path.
+        error: Exception raised.
+        error_type: Hue API error type; 901 is an internal error, 2 a
+            body that is not valid JSON.
+
+    Returns:
+        List of one error dictionary.
+    """
+    return [{'error': {'type': error_type, 'address': path,
+                       'description': str(error)}}]
+
+
+def _milliseconds(seconds):
+    """Returns seconds as a string of milliseconds, or '-' for None.
+    """
+    if seconds is None:
+        return '-'
+    return '%.1f' % (seconds * 1000)
 
 
 def _get_from_pool(pool, *args):
@@ -1229,10 +6374,96 @@ def _get_from_pool(pool, *args):
         else:
             names.append(str(item))
     things += [thing for thing in pool
-               if thing.name in names or thing.index in ids]
+               if thing.name in names or thing.index in ids
+               or thing.index in names]
     return things
 
 
+def _rule_definition(name, conditions, actions, status=None):
+    """Returns a Rule definition as stored by the Bridge.
+
+    Condition values are stored as strings, so they are converted here
+    to let definitions be compared with Rules read back.
+
+    Args:
+        name: Rule name.
+        conditions: List of condition dictionaries.
+        actions: List of action dictionaries.
+        status: Optional 'enabled' or 'disabled'.
+
+    Returns:
+        Dictionary to POST or PUT.
+    """
+    data = {
+            'name': name,
+            'conditions': [],
+            'actions': [dict(action) for action in actions],
+            }
+    for condition in conditions:
+        condition = dict(condition)
+        if 'value' in condition:
+            condition['value'] = str(condition['value'])
+        data['conditions'].append(condition)
+    if status is not None:
+        data['status'] = status
+    return data
+
+
+def restorable_state(state):
+    """Returns the settable values of a Light state, for its color mode.
+
+    Only the values for the current color mode are kept, since setting
+    others would change the mode.
+
+    Args:
+        state: Light 'state' dictionary, as returned by the Bridge.
+
+    Returns:
+        Dictionary of state values.
+    """
+    keys = ['on', 'bri']
+    color_mode = state.get('colormode')
+    if color_mode == 'ct':
+        keys.append('ct')
+    elif color_mode == 'hs':
+        keys.extend(('hue', 'sat'))
+    else:
+        keys.append('xy')
+    return dict((key, state[key]) for key in keys if key in state)
+
+
+def diff_state(current, desired):
+    """Returns the state values to send to go from one state to another.
+
+    Like Luminous._form_state_data, only values that differ are kept,
+    and a Light that must change while off is turned on.  Nothing but
+    'on' is sent to a Light that should end up off.
+
+    Args:
+        current: Current Light state dictionary.
+        desired: Desired state values.
+
+    Returns:
+        Dictionary of state values; empty if nothing differs.
+    """
+    if desired.get('on') is False:
+        if current.get('on'):
+            return {'on': False}
+        return {}
+    states = {}
+    for key, value in desired.items():
+        current_value = current.get(key)
+        if key == 'xy' and current_value:
+            if all(abs(a - b) < 0.0001 for a, b in zip(current_value, value)):
+                continue
+        elif current_value == value:
+            continue
+        states[key] = value
+    if states and not current.get('on'):
+        states['on'] = True
+    return states
+
+
 def validate_rgb(r_val, g_val=None, b_val=None):
     """Validates RGB values (0 to 255).
 
@@ -1247,7 +6478,7 @@ def validate_rgb(r_val, g_val=None, b_val=None):
         Returns a list containing two items, x and y: [x, y]
     """
     # Handle the case where a list trio is submitted
-    if isinstance(r_val, collections.Iterable):
+    if isinstance(r_val, Iterable):
         r_val, g_val, b_val = r_val
     r_val = constrain_value(int(r_val), 0, 255)
     g_val = constrain_value(int(g_val), 0, 255)
@@ -1268,7 +6499,7 @@ def validate_xy(x_val, y_val=None):
         Returns a list containing two items, x and y: [x, y]
     """
     # Handle the case where a list pair is submitted
-    if isinstance(x_val, collections.Iterable):
+    if isinstance(x_val, Iterable):
         x_val, y_val = x_val
     x_val = constrain_value(float(x_val), 0.0, 1.0)
     y_val = constrain_value(float(y_val), 0.0, 1.0)
@@ -1442,7 +6673,7 @@ def flatten_struct(struct):
         A simple list.
     """
     for item in struct:
-        if (isinstance(item, collections.Iterable)
+        if (isinstance(item, Iterable)
                 and not isinstance(item, basestring)):
             for subitem in flatten_struct(item):
                 yield subitem
@@ -1515,6 +6746,20 @@ def hue_decode(value):
     return return_value
 
 
+JSON_BACKEND = None
+use_json_backend()
+
+# Field kinds: (decode, encode) functions; None means "as is".
+FIELD_TYPES = {
+        None: (None, hue_encode),
+        'int': (int, hue_encode),
+        'none': (_decode_none, hue_encode),
+        'xy': (validate_xy, hue_encode),
+        'copy': (copy.deepcopy, hue_encode),
+        }
+_COMPILED_SCHEMAS = {}
+
+
 def wait(delay=COMPLETION_DELAY):
     """Sleeps for a given amount of time.
 
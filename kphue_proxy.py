@@ -0,0 +1,74 @@
+#!/usr/bin/python
+"""Local Caching Proxy of Kphue.
+
+Owns the single connection to a Bridge and serves its /api/<user>/...
+surface locally (see kphue.HueProxy), so any number of kphue scripts
+can share one session with:
+    kphue.Bridge(ip='localhost:8089', user=...)
+Reads are answered from state polled once per interval, and writes to
+the same address are coalesced.
+"""
+import logging
+import signal
+import sys
+
+from argparse import ArgumentParser
+
+import kphue
+
+LOG_LEVELS = ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG')
+DEFAULT_LOG_LEVEL = LOG_LEVELS[3]
+LOGGER = logging.getLogger()
+
+
+def parse_args():
+    """Parse user arguments and return as parser object.
+
+    Returns:
+        Parser object with arguments as attributes.
+    """
+    parser = ArgumentParser(description='Serve a Bridge to local clients.')
+    parser.add_argument('-b', '--bridge',
+            help='IP of Bridge.')
+    parser.add_argument('-p', '--port', default=kphue.PROXY_PORT, type=int,
+            help='Local port to serve on.')
+    parser.add_argument('-H', '--host', default='127.0.0.1',
+            help='Local address to serve on.')
+    parser.add_argument('-i', '--interval', default=kphue.PROXY_INTERVAL,
+            type=float, help='Seconds between polls of the Bridge.')
+    parser.add_argument('-L', '--loglevel', choices=LOG_LEVELS,
+            default=DEFAULT_LOG_LEVEL, help='Set the logging level.')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    """Main script.
+    """
+    bridge = kphue.Bridge(ARGS.bridge)
+    proxy = kphue.HueProxy(bridge, ARGS.port, ARGS.interval, ARGS.host)
+
+    def stop_serving(signum, frame):
+        """Stops the proxy.
+
+        Args:
+            signum: Signal number.
+            frame: Frame.
+        """
+        LOGGER.info('Stopping proxy...')
+        proxy.stop()
+
+    signal.signal(signal.SIGINT, stop_serving)
+    signal.signal(signal.SIGTERM, stop_serving)
+    proxy.serve_forever()
+    LOGGER.info('%d polls; %d reads from cache, %d forwarded; %d writes'
+            ' (%d merged)', proxy.polls, proxy.hits, proxy.forwarded,
+            proxy.writes, proxy.merged)
+    return 0
+
+
+if __name__ == '__main__':
+    ARGS = parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                        level=getattr(logging, ARGS.loglevel))
+    sys.exit(main())
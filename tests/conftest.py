@@ -0,0 +1,36 @@
+"""Fixtures for testing Kphue against local stand-ins.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+        __file__))))
+
+import kphue
+
+from fakehue import FakeBridge, USER
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    """Path to an empty config file.
+    """
+    return str(tmp_path / 'kphue.json')
+
+
+@pytest.fixture
+def fake():
+    """A FakeBridge with 5 Lights.
+    """
+    bridge = FakeBridge()
+    yield bridge
+    bridge.stop()
+
+
+@pytest.fixture
+def bridge(fake, config_file):
+    """A Bridge connected to the fake one.
+    """
+    return kphue.Bridge(ip=fake.address, user=USER, config_file=config_file)
@@ -0,0 +1,439 @@
+"""Local stand-ins for a Hue Bridge, for testing Kphue without hardware.
+
+FakeBridge serves enough of the v1 REST API (and the CLIP v2 event
+stream) over HTTP or HTTPS on 127.0.0.1, and logs every request it
+gets.  Responder answers SSDP or mDNS discovery queries on a local UDP
+port.
+"""
+import copy
+import json
+import socket
+import struct
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import queue
+
+USER = 'testuser'
+BRIDGE_ID = '001788FFFE000001'
+
+
+def make_light(light_id, name, reachable=True):
+    """Returns the state of a color Light.
+
+    Args:
+        light_id: Integer Light ID.
+        name: Light name.
+        reachable: Whether the Light is reachable.
+
+    Returns:
+        Dictionary, as in GET /lights/<id>.
+    """
+    return {
+            'state': {
+                'on': False, 'bri': 100, 'hue': 1000, 'sat': 100,
+                'effect': 'none', 'xy': [0.3, 0.3], 'ct': 300,
+                'alert': 'none', 'colormode': 'xy', 'reachable': reachable,
+                },
+            'type': 'Extended color light', 'name': name,
+            'modelid': 'LCT001', 'swversion': '1.0',
+            'uniqueid': 'u%d' % light_id,
+            }
+
+
+def make_datastore(light_count=5, bridge_id=BRIDGE_ID):
+    """Returns a small datastore, as in GET /api/<user>.
+
+    Args:
+        light_count: Number of Lights.
+        bridge_id: Bridge ID reported in the config.
+
+    Returns:
+        Dictionary.
+    """
+    lights = dict((str(index), make_light(index, 'Light%d' % index))
+                  for index in range(1, light_count + 1))
+    action = copy.deepcopy(lights['1']['state'])
+    del action['reachable'], action['colormode']
+    groups = {
+            '1': {'name': 'Room', 'lights': ['1', '2'], 'type': 'Room',
+                  'action': action,
+                  'state': {'any_on': False, 'all_on': False}},
+            }
+    sensors = {
+            '1': {'state': {'daylight': False, 'lastupdated': 'none'},
+                  'config': {'on': True}, 'name': 'Daylight',
+                  'type': 'Daylight', 'modelid': 'PHDL00',
+                  'manufacturername': 'Philips', 'swversion': '1.0'},
+            '2': {'state': {'buttonevent': 34,
+                            'lastupdated': '2020-01-01T00:00:00'},
+                  'config': {'on': True}, 'name': 'Tap', 'type': 'ZGPSwitch',
+                  'modelid': 'ZGPSWITCH', 'manufacturername': 'Philips',
+                  'swversion': '1.0', 'uniqueid': 'tap'},
+            }
+    scenes = {
+            'abc-on-0': {'name': 'Relax', 'lights': ['1', '2'], 'owner': USER,
+                         'recycle': False, 'locked': False, 'appdata': {},
+                         'picture': '', 'lastupdated': '2020', 'version': 2},
+            }
+    config = {
+            'name': 'Fake', 'apiversion': '1.30.0', 'swversion': '1',
+            'bridgeid': bridge_id, 'mac': '00:17:88:00:00:01',
+            'localtime': 'x', 'timezone': 'UTC', 'zigbeechannel': 15,
+            'whitelist': {USER: {'name': 'kphue#test'}}, 'UTC': '2020',
+            }
+    return {'lights': lights, 'groups': groups, 'sensors': sensors,
+            'rules': {}, 'scenes': scenes, 'schedules': {},
+            'config': config, 'resourcelinks': {}}
+
+
+class FakeBridge(object):
+    """HTTP(S) server answering like a Bridge, from an in-memory datastore.
+
+    Requests are logged in self.log as (method, path, body) tuples.
+    """
+    def __init__(self, light_count=5, port=0, tls=None,
+                 bridge_id=BRIDGE_ID):
+        """Start serving.
+
+        Args:
+            light_count: Number of Lights.
+            port: Port to listen on; 0 picks a free one.
+            tls: Optional (certificate file, key file) to serve HTTPS.
+            bridge_id: Bridge ID reported in the config.
+        """
+        self.store = make_datastore(light_count, bridge_id)
+        self.log = []
+        self.fail = False
+        # Requests to drop after reading them, before answering
+        self.drop = 0
+        self.events = queue.Queue()
+        self.event_headers = []
+        self.v2_resources = []
+        self.lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.fake = self
+        if tls:
+            import ssl
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*tls)
+            self.server.socket = context.wrap_socket(self.server.socket,
+                    server_side=True)
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def address(self):
+        """'host:port' to give to kphue.Bridge as its IP.
+        """
+        return '127.0.0.1:%d' % self.port
+
+    def requests(self, mode=None):
+        """Returns the logged requests, optionally of one method.
+        """
+        return [entry for entry in self.log
+                if mode is None or entry[0] == mode]
+
+    def stop(self):
+        """Stop serving.
+        """
+        self.events.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, mode, path, body):
+        """Returns the response to a v1 API request.
+
+        Args:
+            mode: HTTP method.
+            path: Request path.
+            body: Request body bytes.
+
+        Returns:
+            JSON-serializable response.
+        """
+        parts = [part for part in path.split('/') if part]
+        if parts == ['api'] and mode == 'POST':
+            data = json.loads(body)
+            success = {'username': USER}
+            if data.get('generateclientkey'):
+                success['clientkey'] = '0123456789ABCDEF0123456789ABCDEF'
+            return [{'success': success}]
+        if parts[:2] == ['api', 'config'] or parts == ['api', 'nouser',
+                                                      'config']:
+            config = self.store['config']
+            return dict((key, config[key]) for key in (
+                    'name', 'apiversion', 'swversion', 'bridgeid', 'mac'))
+        if len(parts) < 2 or parts[1] != USER:
+            return [{'error': {'type': 1, 'address': '/',
+                               'description': 'unauthorized user'}}]
+        parts = parts[2:]
+        data = json.loads(body) if body else None
+        if not parts:
+            return self.store
+        resource_type = parts[0]
+        if resource_type == 'config':
+            return self.store['config']
+        resources = self.store.get(resource_type)
+        if resources is None:
+            return [{'error': {'type': 3, 'address': path,
+                               'description': 'not available'}}]
+        if len(parts) == 1:
+            if mode == 'GET':
+                return resources
+            if mode == 'POST':
+                return self._create(resource_type, resources, data)
+        resource_id = parts[1]
+        if resource_type == 'groups' and resource_id == '0':
+            resource = {'name': 'Group 0', 'type': 'LightGroup',
+                        'lights': sorted(self.store['lights'], key=int),
+                        'action': {'on': False, 'bri': 1}}
+        else:
+            resource = resources.get(resource_id)
+        if resource is None:
+            return [{'error': {'type': 3, 'address': path,
+                               'description': 'resource not available'}}]
+        if mode == 'GET' and len(parts) == 2:
+            return resource
+        if mode == 'DELETE':
+            del resources[resource_id]
+            return [{'success': '/%s/%s deleted' % (resource_type,
+                                                     resource_id)}]
+        if mode == 'PUT':
+            return self._update(parts, resource, data)
+        return [{'error': {'type': 4, 'address': path,
+                           'description': 'method not available'}}]
+
+    def _create(self, resource_type, resources, data):
+        """POST a new resource.
+        """
+        new_id = str(max([int(key) for key in resources if key.isdigit()]
+                         + [0]) + 1)
+        if resource_type == 'scenes':
+            new_id = 'new%s-on-0' % new_id
+        resource = dict(data)
+        if resource_type == 'groups':
+            resource.setdefault('action', {'on': False, 'bri': 1})
+        elif resource_type == 'rules':
+            resource.setdefault('owner', USER)
+            resource.setdefault('status', 'enabled')
+        elif resource_type == 'sensors':
+            resource.setdefault('state', {})
+            resource.setdefault('config', {'on': True})
+        resources[new_id] = resource
+        return [{'success': {'id': new_id}}]
+
+    def _update(self, parts, resource, data):
+        """PUT values to a resource or one of its attributes.
+        """
+        if len(parts) == 2:
+            target = resource
+        else:
+            target = resource.setdefault(parts[2], {})
+        results = []
+        for key, value in data.items():
+            address = '/' + '/'.join(parts + [key])
+            if key == 'transitiontime':
+                results.append({'success': {address: value}})
+                continue
+            if key.endswith('_inc') and key[:-4] in target:
+                value = target[key[:-4]] + value
+                key = key[:-4]
+                address = '/' + '/'.join(parts + [key])
+            target[key] = value
+            if parts[0] == 'groups' and len(parts) == 3:
+                for light_id in resource.get('lights', []):
+                    state = self.store['lights'][light_id]['state']
+                    if key in state:
+                        state[key] = value
+            results.append({'success': {address: value}})
+        return results
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    """Threaded server of a FakeBridge.
+    """
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Request handler of a FakeBridge.
+    """
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        """Don't log to stderr.
+        """
+        pass
+
+    def _answer(self, mode):
+        """Answer a request from the datastore of the FakeBridge.
+        """
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if fake.fail:
+            self.close_connection = True
+            return
+        if fake.drop:
+            fake.drop -= 1
+            with fake.lock:
+                fake.log.append((mode, self.path, body))
+            self.close_connection = True
+            return
+        if self.path == '/eventstream/clip/v2':
+            return self._stream(fake)
+        if self.path.startswith('/clip/v2/'):
+            return self._send({'errors': [], 'data': fake.v2_resources})
+        with fake.lock:
+            fake.log.append((mode, self.path, body))
+            result = fake.handle(mode, self.path, body)
+        self._send(result)
+
+    def _send(self, result):
+        """Send a JSON response.
+        """
+        out = json.dumps(result).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _stream(self, fake):
+        """Send queued server-sent events until None is queued.
+        """
+        fake.event_headers.append(dict(self.headers))
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        while True:
+            item = fake.events.get()
+            if item is None:
+                return
+            self.wfile.write(item.encode('utf-8'))
+            self.wfile.flush()
+
+    def do_GET(self):
+        """Answer a GET.
+        """
+        self._answer('GET')
+
+    def do_PUT(self):
+        """Answer a PUT.
+        """
+        self._answer('PUT')
+
+    def do_POST(self):
+        """Answer a POST.
+        """
+        self._answer('POST')
+
+    def do_DELETE(self):
+        """Answer a DELETE.
+        """
+        self._answer('DELETE')
+
+
+def _dns_name(name):
+    """Returns a DNS name in wire format.
+    """
+    encoded = b''
+    for label in name.split('.'):
+        encoded += struct.pack('B', len(label)) + label.encode('ascii')
+    return encoded + b'\0'
+
+
+class Responder(object):
+    """Answers SSDP or mDNS discovery queries like a Bridge, on 127.0.0.1.
+
+    Give self.address to kphue.discover_bridges as ssdp_address or
+    mdns_address.
+    """
+    def __init__(self, kind, bridge_id, location):
+        """Start answering.
+
+        Args:
+            kind: 'ssdp' or 'mdns'.
+            bridge_id: Bridge ID to announce.
+            location: For SSDP, 'host:port' of the Bridge; for mDNS, its
+                IPv4 address.
+        """
+        self.kind = kind
+        self.bridge_id = bridge_id
+        self.location = location
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """Stop answering.
+        """
+        self.sock.close()
+
+    def _run(self):
+        """Answer queries until closed.
+        """
+        while True:
+            try:
+                data, peer = self.sock.recvfrom(4096)
+            except socket.error:
+                return
+            self.queries += 1
+            if self.kind == 'ssdp':
+                answer = self._ssdp_answer()
+            else:
+                answer = self._mdns_answer(data)
+            self.sock.sendto(answer, peer)
+
+    def _ssdp_answer(self):
+        """Returns an M-SEARCH answer.
+        """
+        return ('HTTP/1.1 200 OK\r\n'
+                'LOCATION: http://%s/description.xml\r\n'
+                'hue-bridgeid: %s\r\n\r\n'
+                % (self.location, self.bridge_id)).encode('ascii')
+
+    def _mdns_answer(self, query):
+        """Returns an answer to a _hue._tcp PTR query, with TXT and A.
+        """
+        instance = 'Hue Bridge - 000001._hue._tcp.local'
+        header = struct.pack('>HHHHHH', 0, 0x8400, 1, 1, 0, 2)
+        pointer = _dns_name(instance)
+        answer = b'\xc0\x0c' + struct.pack('>HHIH', 12, 1, 120,
+                len(pointer)) + pointer
+        txt = b''
+        for item in ('bridgeid=%s' % self.bridge_id.lower(),
+                     'modelid=BSB002'):
+            txt += struct.pack('B', len(item)) + item.encode('ascii')
+        text_record = _dns_name(instance) + struct.pack('>HHIH', 16, 1, 120,
+                len(txt)) + txt
+        address_record = _dns_name('hue.local') + struct.pack('>HHIH', 1, 1,
+                120, 4) + socket.inet_aton(self.location)
+        return header + query[12:] + answer + text_record + address_record
+
+
+def wait_for(condition, timeout=2):
+    """Wait until a condition function returns True.
+
+    Returns:
+        Boolean; the last result of the condition.
+    """
+    end_time = time.time() + timeout
+    while not condition():
+        if time.time() > end_time:
+            return False
+        time.sleep(0.01)
+    return True
@@ -0,0 +1,64 @@
+"""Keyframe animations.
+"""
+import kphue
+
+from fakehue import USER
+
+
+def puts(fake):
+    """Returns the (path, body) of the PUTs sent to a FakeBridge.
+    """
+    return [(path, kphue.json_loads(body))
+            for mode, path, body in fake.requests('PUT')]
+
+
+def test_keyframes_compiled_to_transitions(bridge):
+    light = bridge.lights[3]
+    animation = kphue.Animation(bridge)
+    animation.keyframe(light, 0, bri=254)
+    animation.keyframe(light, 2.5, bri=50, ct=300)
+    animation.keyframe(light, 4, bri=50, ct=400)
+    assert animation.compile() == [
+            [0, light, {'bri': 254, 'on': True}, 0],
+            [0, light, {'bri': 50, 'ct': 300}, 25],
+            [2.5, light, {'ct': 400}, 15],
+            ]
+
+
+def test_rgb_keyframes(bridge):
+    light = bridge.lights[3]
+    animation = kphue.Animation(bridge)
+    animation.keyframe(light, 0, rgb=(255, 0, 0))
+    animation.keyframe(light, 1, rgb=(0, 0, 0))
+    commands = animation.compile()
+    assert commands[0][2]['xy'] == [round(coord, 4) for coord in
+                                    kphue.rgb_to_xy((255, 0, 0))]
+    assert commands[1][2] == {'on': False}
+
+
+def test_same_values_sent_to_groups(fake, bridge):
+    lights = bridge.lights
+    animation = kphue.Animation(bridge)
+    # Group 1 holds Lights 1 and 2.
+    animation.keyframe(lights[:3], 0, bri=100)
+    animation.keyframe(lights[0], 1, bri=10)
+    commands = animation.compile()
+    assert [(command[1], command[2]) for command in commands] == [
+            (bridge.groups[0], {'bri': 100, 'on': True}),
+            (lights[2], {'bri': 100, 'on': True}),
+            (lights[0], {'bri': 10}),
+            ]
+    del fake.log[:]
+    animation.play()
+    assert animation.sent == 3
+    sent = puts(fake)
+    assert sent[:2] == [
+            ('/api/%s/groups/1/action' % USER,
+             {'bri': 100, 'on': True, 'transitiontime': 0}),
+            ('/api/%s/lights/3/state' % USER,
+             {'bri': 100, 'on': True, 'transitiontime': 0}),
+            ]
+    path, body = sent[2]
+    assert path == '/api/%s/lights/1/state' % USER
+    assert body['bri'] == 10 and body['transitiontime'] <= 10
+
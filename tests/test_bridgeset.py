@@ -0,0 +1,68 @@
+"""Several Bridges used as one.
+"""
+import pytest
+
+import kphue
+
+from fakehue import FakeBridge, USER
+
+
+@pytest.fixture
+def fakes(config_file):
+    """Two FakeBridges, listed in the config file.
+    """
+    downstairs = FakeBridge(2)
+    upstairs = FakeBridge(3, bridge_id='001788FFFE000002')
+    upstairs.store['config']['name'] = 'Upstairs'
+    for light_id, light in upstairs.store['lights'].items():
+        light['name'] = 'Up%s' % light_id
+        light['uniqueid'] = 'up%s' % light_id
+    kphue.write_config(config_file, {
+            downstairs.address: {'username': USER},
+            upstairs.address: {'username': USER}})
+    yield downstairs, upstairs
+    downstairs.stop()
+    upstairs.stop()
+
+
+def test_all_bridges_connected(fakes, config_file):
+    bridges = kphue.BridgeSet(config_file=config_file)
+    assert sorted(bridge.ip for bridge in bridges.bridges) == sorted(
+            fake.address for fake in fakes)
+    assert len(bridges.lights) == 5
+
+
+def test_lookups_routed_to_owner(fakes, config_file):
+    downstairs, upstairs = fakes
+    bridges = kphue.BridgeSet(config_file=config_file)
+    assert bridges.get_bridge('Upstairs').ip == upstairs.address
+    assert bridges.get_bridge(downstairs.address).name == 'Fake'
+    assert bridges.get_light('Up2')._bridge.ip == upstairs.address
+    assert bridges.get_light('u1')._bridge.ip == downstairs.address
+    # Integer IDs are per Bridge.
+    assert len(bridges.get_lights(1)) == 2
+
+
+def test_set_lights_fans_out(fakes, config_file):
+    downstairs, upstairs = fakes
+    bridges = kphue.BridgeSet(config_file=config_file)
+    for fake in fakes:
+        del fake.log[:]
+    assert bridges.set_lights(['Light1', 'Up3'], 'on', True)
+    assert [path for mode, path, body in downstairs.requests('PUT')] == [
+            '/api/%s/lights/1/state' % USER]
+    assert [path for mode, path, body in upstairs.requests('PUT')] == [
+            '/api/%s/lights/3/state' % USER]
+
+
+def test_failed_bridge_does_not_stop_refresh(fakes, config_file):
+    downstairs, upstairs = fakes
+    bridges = kphue.BridgeSet(config_file=config_file)
+    for bridge in bridges.bridges:
+        bridge.retry_policy = kphue.RetryPolicy(attempts=1)
+    downstairs.fail = True
+    upstairs.store['lights']['1']['name'] = 'Landing'
+    assert not bridges.refresh()
+    assert bridges.get_light('Landing')._bridge.ip == upstairs.address
+    # The failed Bridge keeps its last known Lights.
+    assert bridges.get_light('Light2')._bridge.ip == downstairs.address
@@ -0,0 +1,43 @@
+"""State cache and config file writes.
+"""
+import os
+import threading
+
+import kphue
+
+from fakehue import USER
+
+
+def test_warm_cache_lookup_makes_no_requests(fake, config_file):
+    kphue.Bridge(ip=fake.address, user=USER, config_file=config_file,
+                 cache=True)
+    cached = kphue.Bridge(ip=fake.address, user=USER,
+                          config_file=config_file, cache=True)
+    cached.revalidate()
+    del fake.log[:]
+    assert cached.get_light('Light3').index == 3
+    assert fake.log == []
+
+
+def test_cache_leaves_out_whitelist(fake, config_file):
+    bridge = kphue.Bridge(ip=fake.address, user=USER,
+                          config_file=config_file, cache=True)
+    snapshot = kphue.read_config(bridge._cache_file())[fake.address]
+    assert 'whitelist' not in snapshot['datastore']['config']
+    assert snapshot['datastore']['config']['bridgeid']
+
+
+def test_concurrent_config_writes(config_file):
+    def write(index):
+        for _ in range(20):
+            kphue.write_config(config_file, {'10.0.0.%d' % index: {}})
+
+    threads = [threading.Thread(target=write, args=(index,))
+               for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(kphue.read_config(config_file)) == 1
+    assert os.listdir(os.path.dirname(config_file)) == [
+            os.path.basename(config_file)]
@@ -0,0 +1,85 @@
+"""Button cycles, polled or compiled into Bridge rules.
+"""
+import kphue
+
+from fakehue import USER
+
+CYCLES = {
+        'Tap': {
+            34: {'lights': ['Light1', 'Light2'],
+                 'rgb': [[255, 0, 0], [0, 0, 255]]},
+            },
+        }
+
+
+def writes(fake):
+    """Returns the requests that changed the FakeBridge.
+    """
+    return [entry for entry in fake.log if entry[0] != 'GET']
+
+
+def test_compile_creates_rules_and_status_sensor(fake, bridge):
+    cycler = kphue.Cycler(bridge, CYCLES)
+    assert cycler.compile()
+    statuses = [sensor for sensor in fake.store['sensors'].values()
+                if sensor['type'] == 'CLIPGenericStatus']
+    assert [sensor['name'] for sensor in statuses] == ['kphue cycle 2/34']
+    memory_id = [key for key, sensor in fake.store['sensors'].items()
+                 if sensor is statuses[0]][0]
+    rules = sorted(fake.store['rules'].values(),
+                   key=lambda rule: rule['name'])
+    assert [rule['name'] for rule in rules] == [
+            'kphue cycle 2/34 0', 'kphue cycle 2/34 1']
+    assert rules[0]['conditions'] == [
+            {'address': '/sensors/2/state/buttonevent', 'operator': 'eq',
+             'value': '34'},
+            {'address': '/sensors/2/state/lastupdated', 'operator': 'dx'},
+            {'address': '/sensors/%s/state/status' % memory_id,
+             'operator': 'eq', 'value': '0'},
+            ]
+    blue = [round(coord, 4) for coord in kphue.rgb_to_xy((0, 0, 255))]
+    assert rules[0]['actions'] == [
+            {'address': '/lights/1/state', 'method': 'PUT',
+             'body': {'on': True, 'xy': blue}},
+            {'address': '/lights/2/state', 'method': 'PUT',
+             'body': {'on': True, 'xy': blue}},
+            {'address': '/sensors/%s/state' % memory_id, 'method': 'PUT',
+             'body': {'status': 1}},
+            ]
+
+
+def test_compile_again_sends_nothing(fake, bridge):
+    assert kphue.Cycler(bridge, CYCLES).compile()
+    del fake.log[:]
+    assert kphue.Cycler(bridge, CYCLES).compile()
+    assert writes(fake) == []
+
+
+def test_poll_dispatches_new_presses(fake, bridge):
+    cycler = kphue.Cycler(bridge, CYCLES)
+    pressed = []
+    cycler.on_press(lambda sensor, button: pressed.append(button))
+    # The first poll only learns the last press.
+    assert cycler.poll() == []
+    fake.store['sensors']['2']['state']['lastupdated'] = '2020-01-01T00:01:00'
+    del fake.log[:]
+    presses = cycler.poll()
+    assert [(sensor.index, button) for sensor, button in presses] == [
+            (2, 34)]
+    assert pressed == [34]
+    blue = [round(coord, 4) for coord in kphue.rgb_to_xy((0, 0, 255))]
+    assert sorted((path, kphue.json_loads(body))
+                  for mode, path, body in writes(fake)) == [
+            ('/api/%s/lights/1/state' % USER, {'on': True, 'xy': blue}),
+            ('/api/%s/lights/2/state' % USER, {'on': True, 'xy': blue}),
+            ]
+    # Nothing changed: no press.
+    assert cycler.poll() == []
+
+
+def test_compiled_cycles_not_dispatched(fake, bridge):
+    cycler = kphue.Cycler(bridge, CYCLES)
+    assert cycler.compile()
+    del fake.log[:]
+    cycler.dispatch(bridge.sensors[1], 34)
+    assert writes(fake) == []
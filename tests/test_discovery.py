@@ -0,0 +1,63 @@
+"""Bridge discovery, against local SSDP and mDNS stand-ins.
+"""
+import kphue
+
+from fakehue import BRIDGE_ID, FakeBridge, Responder, USER
+
+
+def test_discover_ssdp_and_mdns(config_file):
+    ssdp = Responder('ssdp', BRIDGE_ID, '127.0.0.2:8080')
+    mdns = Responder('mdns', '001788FFFE000002', '127.0.0.3')
+    try:
+        found = kphue.discover_bridges(0.3, config_file, ssdp.address,
+                                       mdns.address)
+    finally:
+        ssdp.close()
+        mdns.close()
+    assert found == {BRIDGE_ID: '127.0.0.2:8080',
+                     '001788FFFE000002': '127.0.0.3'}
+    cache = kphue.read_config(config_file)[kphue.DISCOVERY_KEY]
+    assert cache[BRIDGE_ID]['ip'] == '127.0.0.2:8080'
+
+
+def test_cached_ip_is_used_when_bridge_answers(fake, config_file):
+    kphue.write_config(config_file, {kphue.DISCOVERY_KEY: {
+            BRIDGE_ID: {'ip': fake.address, 'time': 1}}})
+    assert kphue.cached_bridge_ip(config_file) == fake.address
+    assert kphue.cached_bridge_ip(config_file, BRIDGE_ID.lower()) \
+            == fake.address
+    assert kphue.cached_bridge_ip(config_file, exclude=fake.address) is None
+
+
+def test_stale_cached_ip_is_skipped(config_file):
+    other = FakeBridge(bridge_id='001788FFFE0000FF')
+    try:
+        kphue.write_config(config_file, {kphue.DISCOVERY_KEY: {
+                BRIDGE_ID: {'ip': other.address, 'time': 1}}})
+        assert kphue.cached_bridge_ip(config_file) is None
+    finally:
+        other.stop()
+
+
+def test_rediscover_tries_cache_before_network(fake, config_file,
+                                               monkeypatch):
+    bridge = kphue.Bridge(ip=fake.address, user=USER,
+                          config_file=config_file)
+    moved = FakeBridge()
+    try:
+        config = kphue.read_config(config_file)
+        config[kphue.DISCOVERY_KEY] = {
+                BRIDGE_ID: {'ip': moved.address, 'time': 1}}
+        kphue.write_config(config_file, config)
+
+        def no_network(*args, **kwargs):
+            raise AssertionError('network discovery used')
+
+        monkeypatch.setattr(kphue, 'discover_bridges', no_network)
+        # The stand-ins are on this computer, like a proxy would be.
+        monkeypatch.setattr(kphue, '_is_loopback', lambda ip: False)
+        assert bridge.rediscover()
+        assert bridge.ip == moved.address
+        assert moved.address in kphue.read_config(config_file)
+    finally:
+        moved.stop()
@@ -0,0 +1,79 @@
+"""Dispatch queue: slots, priorities, merging and deadlines.
+"""
+import threading
+import time
+
+import pytest
+
+import kphue
+
+
+def hold_slot(queue):
+    """Occupy the slot of a one-slot queue until the event is set.
+    """
+    release = threading.Event()
+    thread = threading.Thread(target=queue.call, args=(release.wait,))
+    thread.daemon = True
+    thread.start()
+    wait_until(lambda: queue._active == 1)
+    return release, thread
+
+
+def wait_until(condition, timeout=2):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+
+
+def test_most_urgent_first():
+    queue = kphue.DispatchQueue(1, adaptive=False)
+    release, holder = hold_slot(queue)
+    order = []
+    threads = [threading.Thread(target=queue.call,
+                                args=(lambda level=level: order.append(level),
+                                      level))
+               for level in ('background', 'normal', 'interactive')]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: len(queue._waiting) == 3)
+    release.set()
+    for thread in threads + [holder]:
+        thread.join()
+    assert order == ['interactive', 'normal', 'background']
+
+
+def test_queued_gets_merged():
+    queue = kphue.DispatchQueue(1, adaptive=False)
+    release, holder = hold_slot(queue)
+    calls = []
+    results = []
+
+    def read():
+        calls.append(1)
+        return {'on': True}
+
+    threads = [threading.Thread(target=lambda: results.append(
+            queue.call(read, key='/lights/1'))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: queue.stats['normal'][0] == 4)
+    release.set()
+    for thread in threads + [holder]:
+        thread.join()
+    assert calls == [1]
+    assert results == [{'on': True}] * 3
+
+
+def test_queue_wait_counts_against_deadline():
+    queue = kphue.DispatchQueue(1, adaptive=False)
+    release, holder = hold_slot(queue)
+    start = time.time()
+    try:
+        with pytest.raises(kphue.KphueTimeout):
+            queue.call(lambda: None, deadline=0.1)
+        assert time.time() - start < 1
+        assert queue._waiting == []
+    finally:
+        release.set()
+        holder.join()
+    assert queue.call(lambda: 'sent') == 'sent'
@@ -0,0 +1,51 @@
+"""CLIP v2 event handling.
+"""
+import json
+
+import pytest
+
+import kphue
+
+
+def test_bad_event_does_not_stop_others(fake, bridge):
+    fake.v2_resources = [
+            {'id': 'light-1', 'id_v1': '/lights/1', 'type': 'light'},
+            {'id': 'light-2', 'id_v1': '/lights/2', 'type': 'light'},
+            ]
+    clip = kphue.ClipV2(bridge, https=False)
+    clip.map_resources()
+    seen = []
+
+    def callback(resource, change):
+        if resource.index == 1:
+            raise RuntimeError('callback failed')
+        seen.append(resource.index)
+
+    clip.on_event(callback)
+    clip.handle('not json')
+    clip.handle(json.dumps([{'type': 'update', 'data': [
+            {'id': 'light-1', 'type': 'light', 'on': {'on': True}},
+            {'id': 'light-2', 'type': 'light', 'dimming': {}},
+            {'id': 'light-2', 'type': 'light', 'on': {'on': True}},
+            ]}]))
+    assert seen == [2]
+    assert bridge.lights[0]._state['state']['on'] is True
+    assert bridge.lights[1]._state['state']['on'] is True
+
+
+def test_v2_requests_share_bridge_machinery(fake, bridge):
+    clip = kphue.ClipV2(bridge, https=False)
+    with kphue.RequestTracer() as tracer:
+        clip.map_resources()
+    assert tracer.stats['ClipV2.map_resources'][0] == 1
+    assert bridge.dispatcher.stats['normal'][0] >= 1
+    bridge.breaker.trip()
+    with pytest.raises(kphue.KphueUnavailable):
+        clip.request('GET', 'resource')
+
+
+def test_resource_at_rejects_bad_ids(bridge):
+    assert bridge.resource_at('/lights/1') is bridge.lights[0]
+    assert bridge.resource_at('/lights/abc') is None
+    assert bridge.resource_at('/groups/x') is None
+    assert bridge.resource_at('/scenes/abc-on-0').index == 'abc-on-0'
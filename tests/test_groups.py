@@ -0,0 +1,92 @@
+"""Group membership, resolved from the loaded Lights.
+"""
+import kphue
+
+from fakehue import USER
+
+
+def test_refresh_resolves_members_without_requests(fake, bridge):
+    fake.store['groups']['2'] = {
+            'name': 'Hall', 'lights': ['2', '3', '4'], 'type': 'Zone',
+            'action': {'on': False, 'bri': 1},
+            'state': {'any_on': False, 'all_on': False}}
+    del fake.log[:]
+    bridge.refresh_groups()
+    assert [path for mode, path, body in fake.log] == [
+            '/api/%s/groups/' % USER]
+    room, hall = bridge.groups
+    assert room.lights == bridge.lights[:2]
+    assert hall.lights == bridge.lights[1:4]
+    assert bridge.all_lights.lights == bridge.lights
+
+
+def test_refetch_reloads_lights_once(fake, bridge):
+    del fake.log[:]
+    bridge.groups[0].refresh(refetch=True)
+    assert [path for mode, path, body in fake.log] == [
+            '/api/%s/groups/1' % USER, '/api/%s/lights/' % USER]
+
+
+def test_resolve_lights(bridge):
+    lights = bridge.lights
+    with kphue.expect_requests(max=0):
+        assert bridge.resolve_lights(['3', 1]) == [lights[2], lights[0]]
+        # Lights not loaded are skipped.
+        assert bridge.resolve_lights([2, 9]) == [lights[1]]
+
+
+def test_membership_index(fake, bridge):
+    room = bridge.groups[0]
+    with kphue.expect_requests(max=0):
+        assert bridge.get_groups_for_light('Light1') == [room]
+        assert bridge.get_groups_for_light(bridge.lights[4]) == []
+    fake.store['groups']['1']['lights'] = ['2', '5']
+    bridge.refresh_groups()
+    assert bridge.get_groups_for_light(1) == []
+    assert bridge.get_groups_for_light(5) == [room]
+    del fake.store['groups']['1']
+    bridge.refresh_groups()
+    assert bridge.get_groups_for_light(5) == []
+
+
+def test_cover_lights_uses_groups(bridge):
+    lights = bridge.lights
+    room = bridge.groups[0]
+    assert bridge._cover_lights([1, 2, 3]) == [room, lights[2]]
+    assert bridge._cover_lights([1, 3]) == [lights[0], lights[2]]
+    assert bridge._cover_lights(range(1, 6)) == [bridge.all_lights]
+
+
+def test_aggregates_follow_sends(fake, bridge):
+    room = bridge.groups[0]
+    assert (room.any_on, room.all_on, room.bri_average) == (
+            False, False, None)
+    assert bridge.lights[0].send({'on': True, 'bri': 200})
+    assert (room.any_on, room.all_on, room.bri_average) == (
+            True, False, 200)
+    assert room.send({'on': True, 'bri': 100})
+    assert (room.any_on, room.all_on, room.bri_average) == (
+            True, True, 100)
+    # Derived locally: the Group itself is never read.
+    assert not [path for mode, path, body in fake.requests('GET')
+                if '/groups/1' in path]
+
+
+def test_aggregates_follow_refresh(fake, bridge):
+    room = bridge.groups[0]
+    lights = fake.store['lights']
+    lights['1']['state'].update(on=True, bri=200)
+    lights['2']['state'].update(on=True, bri=100)
+    lights['3']['state']['on'] = True
+    bridge.refresh_lights()
+    assert (room.any_on, room.all_on, room.bri_average) == (
+            True, True, 150)
+    assert bridge.all_lights.any_on and not bridge.all_lights.all_on
+    lights['1']['state']['on'] = False
+    bridge.refresh_lights()
+    assert (room.any_on, room.all_on, room.bri_average) == (
+            True, False, 100)
+    lights['2']['state']['on'] = False
+    bridge.refresh()
+    assert (room.any_on, room.all_on, room.bri_average) == (
+            False, False, None)
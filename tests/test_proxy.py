@@ -0,0 +1,85 @@
+"""Local caching proxy.
+"""
+import threading
+
+import pytest
+
+import kphue
+
+from fakehue import USER
+
+
+@pytest.fixture
+def proxy(bridge):
+    """A HueProxy of the fake bridge, with a slow rate limit.
+    """
+    bridge.rate_limits['light'] = kphue.RateLimiter(5, 1)
+    proxy = kphue.HueProxy(bridge, port=0, interval=60)
+    proxy.start()
+    yield proxy
+    proxy.stop()
+
+
+@pytest.fixture
+def client(proxy, tmp_path):
+    """A Bridge using the proxy.
+    """
+    return kphue.Bridge(ip='127.0.0.1:%d' % proxy.port, user=USER,
+                        config_file=str(tmp_path / 'client.json'))
+
+
+def concurrently(function, count):
+    threads = [threading.Thread(target=function, args=(index,))
+               for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_reads_served_from_poll(fake, proxy, client):
+    del fake.log[:]
+    client.refresh_lights()
+    client.api_request('GET', 'lights/1')
+    assert fake.log == []
+
+
+def test_writes_coalesced(fake, proxy, client):
+    del fake.log[:]
+    concurrently(lambda index: client.api_request('PUT', 'lights/2/state',
+            kphue.json_dumps({'bri': 10 + index})), 10)
+    assert len(fake.requests('PUT')) < 10
+    assert proxy.merged
+
+
+def test_relative_writes_not_coalesced(fake, proxy, client):
+    before = fake.store['lights']['2']['state']['bri']
+    del fake.log[:]
+    concurrently(lambda index: client.api_request('PUT', 'lights/2/state',
+            kphue.json_dumps({'bri_inc': 2})), 5)
+    assert len(fake.requests('PUT')) == 5
+    assert fake.store['lights']['2']['state']['bri'] == before + 10
+
+
+def test_writes_read_at_once(proxy, client):
+    response = client.api_request('POST', 'groups', kphue.json_dumps(
+            {'name': 'New', 'lights': ['1']}))
+    group_id = response[0]['success']['id']
+    assert client.api_request('GET', 'groups/%s' % group_id)['name'] == 'New'
+    client.api_request('DELETE', 'groups/1')
+    assert '1' not in client.api_request('GET', 'groups')
+
+
+def test_invalid_body(proxy, client):
+    response = client.api_request('PUT', 'lights/1/state', b'{not json')
+    assert response[0]['error']['type'] == 2
+
+
+def test_proxy_not_rediscovered(proxy, client, monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError('network discovery used')
+
+    monkeypatch.setattr(kphue, 'discover_bridges', no_network)
+    client._discovered_at = 0
+    assert not client.rediscover()
+    assert client.ip == '127.0.0.1:%d' % proxy.port
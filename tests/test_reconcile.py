@@ -0,0 +1,59 @@
+"""Reconciler: declared state kept with as few commands as possible.
+"""
+import kphue
+
+
+def clamp(fake, light_id, key, value):
+    """Make the fake bridge report value for key after each state PUT.
+    """
+    handle = fake.handle
+
+    def clamped(mode, path, body):
+        result = handle(mode, path, body)
+        if path.endswith('/lights/%s/state' % light_id):
+            fake.store['lights'][light_id]['state'][key] = value
+        return result
+
+    fake.handle = clamped
+
+
+def puts(fake):
+    return [path for mode, path, body in fake.requests('PUT')]
+
+
+def test_no_writes_once_matching(fake, bridge):
+    reconciler = kphue.Reconciler(bridge)
+    reconciler.desire(bridge.lights, on=True, bri=200)
+    assert reconciler.reconcile() == 1
+    del fake.log[:]
+    assert reconciler.reconcile() == 0
+    assert puts(fake) == []
+
+
+def test_gamut_fitted_color_accepted(fake, bridge):
+    clamp(fake, '2', 'xy', [0.6915, 0.3083])
+    reconciler = kphue.Reconciler(bridge)
+    reconciler.desire(bridge.get_light('Light2'), on=True, xy=[0.7, 0.29])
+    assert [reconciler.reconcile() for _ in range(3)] == [1, 0, 0]
+    assert bridge.lights[1]._state['state']['xy'] == [0.6915, 0.3083]
+
+
+def test_brightness_always_corrected(fake, bridge):
+    clamp(fake, '2', 'bri', 100)
+    reconciler = kphue.Reconciler(bridge)
+    reconciler.desire(bridge.get_light('Light2'), on=True, bri=200)
+    assert [reconciler.reconcile() for _ in range(3)] == [1, 1, 1]
+
+
+def test_failed_send_not_pending(fake, bridge):
+    clamp(fake, '2', 'xy', [0.6915, 0.3083])
+    reconciler = kphue.Reconciler(bridge)
+    reconciler.desire(bridge.get_light('Light2'), on=True, xy=[0.7, 0.29])
+    send = kphue.Light.send
+    kphue.Light.send = lambda *args: False
+    try:
+        reconciler.reconcile()
+    finally:
+        kphue.Light.send = send
+    assert reconciler._pending == {}
+    assert reconciler.reconcile() == 1
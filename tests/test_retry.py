@@ -0,0 +1,129 @@
+"""Circuit breakers and request retries.
+"""
+import threading
+import time
+
+import pytest
+
+import kphue
+
+
+def test_half_open_allows_one_trial():
+    breaker = kphue.CircuitBreaker('test', threshold=1, recovery=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.available()
+    start = threading.Barrier(2)
+    allowed = []
+
+    def attempt():
+        start.wait()
+        allowed.append(breaker.allow())
+
+    threads = [threading.Thread(target=attempt) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(allowed) == [False, True]
+    assert breaker.state == breaker.HALF_OPEN
+    assert not breaker.available()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_light_without_reachable_stays_available(fake, bridge):
+    del fake.store['lights']['1']['state']['reachable']
+    light = bridge.get_light(1)
+    light.refresh()
+    assert light.is_reachable is None
+    assert light.is_available
+    fake.store['lights']['2']['state']['reachable'] = False
+    light = bridge.get_light(2)
+    light.refresh()
+    assert not light.is_available
+
+
+def test_backoff_grows_to_max_with_jitter(monkeypatch):
+    policy = kphue.RetryPolicy(attempts=3, base_delay=0.25, max_delay=1)
+    monkeypatch.setattr(kphue.random, 'uniform', lambda low, high: high)
+    assert [policy.delay(retry) for retry in range(5)] == [
+            0.25, 0.5, 1, 1, 1]
+    monkeypatch.undo()
+    delays = [policy.delay(2) for _ in range(50)]
+    assert all(0 <= delay <= 1 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_idempotent_methods():
+    policy = kphue.RetryPolicy()
+    assert policy.is_idempotent('GET')
+    assert policy.is_idempotent('DELETE')
+    assert policy.is_idempotent('PUT', b'{"bri": 100}')
+    assert not policy.is_idempotent('PUT', b'{"bri_inc": 10}')
+    assert not policy.is_idempotent('POST', b'{"name": "New"}')
+
+
+def fast_retries(bridge):
+    bridge.retry_policy = kphue.RetryPolicy(base_delay=0.01, max_delay=0.01)
+    bridge.transport.close()
+
+
+def test_get_retried_until_answered(fake, bridge):
+    fast_retries(bridge)
+    del fake.log[:]
+    fake.drop = 2
+    assert bridge.api_request('GET', 'lights/1')['name'] == 'Light1'
+    assert len(fake.requests('GET')) == 3
+    assert bridge.breaker.failures == 0
+
+
+def test_post_not_resent(fake, bridge):
+    fast_retries(bridge)
+    del fake.log[:]
+    fake.drop = 1
+    with pytest.raises(kphue.KphueException):
+        bridge.api_request('POST', 'groups', b'{"name": "New"}')
+    assert len(fake.requests('POST')) == 1
+
+
+def test_exhausted_request_counts_one_failure(fake, bridge):
+    fast_retries(bridge)
+    del fake.log[:]
+    fake.drop = 3
+    with pytest.raises(kphue.KphueException):
+        bridge.api_request('GET', 'lights/1')
+    assert len(fake.requests('GET')) == 3
+    assert bridge.breaker.failures == 1
+    assert bridge.breaker.state == bridge.breaker.CLOSED
+
+
+def test_deadline_bounds_retries(fake, bridge):
+    bridge.retry_policy = kphue.RetryPolicy(attempts=5, base_delay=1,
+                                            max_delay=1)
+    bridge.transport.close()
+    fake.drop = 5
+    start = time.time()
+    with pytest.raises((kphue.KphueException, kphue.KphueTimeout)):
+        bridge.api_request('GET', 'lights/1', deadline=0.2)
+    assert time.time() - start < 0.8
+
+
+def test_breaker_opens_and_recovers(fake, bridge):
+    fast_retries(bridge)
+    bridge.breaker = kphue.CircuitBreaker('Bridge', threshold=2,
+                                          recovery=0.2)
+    fake.drop = 6
+    for _ in range(2):
+        with pytest.raises(kphue.KphueException):
+            bridge.api_request('GET', 'lights/1')
+    assert bridge.breaker.state == bridge.breaker.OPEN
+    del fake.log[:]
+    with pytest.raises(kphue.KphueUnavailable):
+        bridge.api_request('GET', 'lights/1')
+    assert fake.log == []
+    time.sleep(0.2)
+    assert bridge.breaker.available()
+    assert bridge.api_request('GET', 'lights/1')['name'] == 'Light1'
+    assert bridge.breaker.state == bridge.breaker.CLOSED
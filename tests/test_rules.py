@@ -0,0 +1,86 @@
+"""Rule indexes and rule sync.
+"""
+import kphue
+
+from fakehue import USER
+
+
+def make_rule(name, conditions, owner=USER):
+    """Returns the state of a Rule turning on Light 1.
+    """
+    return {'name': name, 'owner': owner, 'status': 'enabled',
+            'conditions': conditions,
+            'actions': [{'address': '/lights/1/state', 'method': 'PUT',
+                         'body': {'on': True}}]}
+
+
+def button(sensor_id, value):
+    """Returns the conditions of a button press.
+    """
+    return [{'address': '/sensors/%s/state/buttonevent' % sensor_id,
+             'operator': 'eq', 'value': str(value)},
+            {'address': '/sensors/%s/state/lastupdated' % sensor_id,
+             'operator': 'dx'}]
+
+
+def writes(fake):
+    """Returns the requests that changed the FakeBridge.
+    """
+    return [(mode, path) for mode, path, body in fake.log if mode != 'GET']
+
+
+def test_rules_indexed_by_sensor_and_condition(fake, bridge):
+    fake.store['rules'].update({
+            '1': make_rule('Tap 34', button(2, 34)),
+            '2': make_rule('Dusk', [{'address': '/sensors/1/state/daylight',
+                                     'operator': 'eq', 'value': 'false'}]),
+            })
+    bridge.refresh_rules()
+    tap, dusk = bridge.get_rules(1, 2)
+    with kphue.expect_requests(max=0):
+        assert bridge.get_rules_for_sensor('Tap') == [tap]
+        assert bridge.get_rules_for_sensor(1) == [dusk]
+        assert bridge.get_rules_for_button(2, 34) == [tap]
+        assert bridge.get_rules_for_button(bridge.sensors[1], 16) == []
+        assert bridge.get_rules_for_condition(
+                '/sensors/2/state/lastupdated') == [tap]
+        assert bridge.get_rules_for_condition(
+                '/sensors/1/state/daylight', 'false') == [dusk]
+
+
+def test_index_follows_changes(fake, bridge):
+    fake.store['rules']['1'] = make_rule('Tap 34', button(2, 34))
+    bridge.refresh_rules()
+    fake.store['rules']['1']['conditions'] = button(2, 16)
+    bridge.refresh_rules()
+    assert bridge.get_rules_for_button(2, 34) == []
+    assert bridge.get_rules_for_button(2, 16) == bridge.rules
+    assert bridge.delete_rule(1)
+    assert bridge.get_rules_for_sensor(2) == []
+    assert bridge.get_rules_for_condition(
+            '/sensors/2/state/lastupdated') == []
+
+
+def test_sync_again_writes_nothing(fake, bridge):
+    fake.store['rules']['7'] = make_rule('Theirs', button(2, 34), 'other')
+    definitions = [
+            {'name': 'kphue 1', 'conditions': button(2, 16),
+             'actions': [{'address': '/groups/1/action', 'method': 'PUT',
+                          'body': {'on': False}}]},
+            {'name': 'kphue 2', 'conditions': button(2, 17),
+             'actions': [{'address': '/groups/1/action', 'method': 'PUT',
+                          'body': {'bri_inc': 50}}]},
+            ]
+    assert bridge.sync_rules(definitions, 'kphue')
+    assert [mode for mode, path in writes(fake)] == ['POST', 'POST']
+    assert len(bridge.get_rules_for_sensor(2)) == 3
+
+    del fake.log[:]
+    assert bridge.sync_rules(definitions, 'kphue')
+    assert writes(fake) == []
+
+    del fake.log[:]
+    assert bridge.sync_rules(definitions[:1], 'kphue')
+    assert [mode for mode, path in writes(fake)] == ['DELETE']
+    assert sorted(rule['name'] for rule in fake.store['rules'].values()) == [
+            'Theirs', 'kphue 1']
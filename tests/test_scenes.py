@@ -0,0 +1,53 @@
+"""Creating and recalling Scenes.
+"""
+import kphue
+
+from fakehue import USER
+
+
+def test_create_scene_in_one_request(fake, bridge):
+    fake.store['lights']['1']['state'].update(on=True, bri=200)
+    fake.store['lights']['3']['state'].update(colormode='ct', ct=400)
+    bridge.refresh_lights()
+    del fake.log[:]
+    with kphue.expect_requests(min=1, max=1):
+        scene_id = bridge.create_scene('Reading', 'Light1', 3)
+    (mode, path, body), = fake.log
+    assert (mode, path) == ('POST', '/api/%s/scenes' % USER)
+    assert kphue.json_loads(body) == {
+            'name': 'Reading', 'lights': ['1', '3'], 'recycle': False,
+            'lightstates': {
+                '1': {'on': True, 'bri': 200, 'xy': [0.3, 0.3]},
+                '3': {'on': False, 'bri': 100, 'ct': 400},
+                },
+            }
+    scene = bridge.get_scene(scene_id)
+    assert scene.name == 'Reading'
+    assert [light.index for light in scene.lights] == [1, 3]
+
+
+def test_recall_in_one_request(fake, bridge):
+    light_state = fake.store['lights']['2']['state']
+    light_state.update(on=True, bri=254)
+    bridge.refresh_lights()
+    scene_id = bridge.create_scene('Bright', 1, 2)
+    scene = bridge.get_scene(scene_id)
+    light_state.update(on=False, bri=1)
+    bridge.refresh_lights()
+    del fake.log[:]
+    with kphue.expect_requests(min=1, max=1):
+        assert scene.recall()
+    (mode, path, body), = fake.log
+    assert (mode, path) == ('PUT', '/api/%s/groups/0/action' % USER)
+    assert kphue.json_loads(body) == {'scene': scene_id}
+    # Light states come from the Scene, not from reading the Lights.
+    assert bridge.lights[1].on is True
+    assert bridge.lights[1].bri == 254
+
+
+def test_recall_on_group(fake, bridge):
+    scene = bridge.get_scene('Relax')
+    del fake.log[:]
+    assert scene.recall(bridge.groups[0])
+    assert [(mode, path) for mode, path, body in fake.log] == [
+            ('PUT', '/api/%s/groups/1/action' % USER)]
@@ -0,0 +1,78 @@
+"""Timetables compiled into Bridge Schedules.
+"""
+import pytest
+
+import kphue
+
+from fakehue import USER
+
+TIMETABLE = [
+        {'localtime': 'W124/T07:00:00', 'lights': ['Light1'],
+         'state': {'on': True, 'bri': 200}},
+        {'localtime': 'W124/T07:00:00', 'lights': [2, 3],
+         'state': {'bri': 200, 'on': True}},
+        {'localtime': 'W127/T22:00:00', 'group': 0,
+         'state': {'on': False}},
+        ]
+
+
+def writes(fake):
+    """Returns the requests that changed the FakeBridge.
+    """
+    return [(mode, path) for mode, path, body in fake.log if mode != 'GET']
+
+
+def test_entries_merged_and_covered_by_groups(bridge):
+    definitions = bridge.compile_timetable(TIMETABLE)
+    assert [(definition['localtime'], definition['command']['address'],
+             definition['command']['body'])
+            for definition in definitions] == [
+            ('W124/T07:00:00', '/api/%s/groups/1/action' % USER,
+             {'bri': 200, 'on': True}),
+            ('W124/T07:00:00', '/api/%s/lights/3/state' % USER,
+             {'bri': 200, 'on': True}),
+            ('W127/T22:00:00', '/api/%s/groups/0/action' % USER,
+             {'on': False}),
+            ]
+    assert all(definition['description'] == kphue.SCHEDULE_PREFIX
+               for definition in definitions)
+
+
+def test_rgb_entries(bridge):
+    definitions = bridge.compile_timetable([
+            {'localtime': 'T08:00:00', 'lights': [4],
+             'state': {'rgb': [255, 0, 0]}}])
+    assert definitions[0]['command']['body'] == {'xy': [
+            round(coord, 4) for coord in kphue.rgb_to_xy([255, 0, 0])]}
+
+
+def test_sync_sends_only_differences(fake, bridge):
+    fake.store['schedules']['9'] = {
+            'name': 'Mine', 'description': 'other',
+            'localtime': 'T09:00:00', 'status': 'enabled',
+            'command': {'address': '/api/%s/lights/5/state' % USER,
+                        'method': 'PUT', 'body': {'on': True}}}
+    assert bridge.sync_schedules(TIMETABLE)
+    assert [mode for mode, path in writes(fake)] == ['POST'] * 3
+    assert len(fake.store['schedules']) == 4
+
+    del fake.log[:]
+    assert bridge.sync_schedules(TIMETABLE)
+    assert writes(fake) == []
+
+    timetable = [dict(entry) for entry in TIMETABLE[:2]]
+    timetable[1]['lights'] = [3]
+    del fake.log[:]
+    assert bridge.sync_schedules(timetable)
+    # Group 1 and Group 0 go, Light 1 comes; Light 3 is left as it is.
+    modes = sorted(mode for mode, path in writes(fake))
+    assert modes == ['DELETE', 'DELETE', 'POST']
+    assert '9' in fake.store['schedules']
+    assert len(fake.store['schedules']) == 3
+
+
+def test_sync_refuses_too_many_schedules(fake, bridge, monkeypatch):
+    monkeypatch.setattr(kphue, 'SCHEDULE_LIMIT', 2)
+    with pytest.raises(kphue.KphueException):
+        bridge.sync_schedules(TIMETABLE)
+    assert writes(fake) == []
@@ -0,0 +1,73 @@
+"""Resource Fields and their compiled schemas.
+"""
+import pytest
+
+import kphue
+
+
+class Thing(object):
+    """Resource class with one Field of each kind.
+    """
+    _schema = (
+            kphue.Field('name'),
+            kphue.Field('count', kind='int', settable=True),
+            kphue.Field('effect', ('state', 'effect'), 'none', True),
+            kphue.Field('xy', ('state', 'xy'), 'xy', True),
+            kphue.Field('data', kind='copy'),
+            )
+
+
+def test_field_paths():
+    assert kphue.Field('bri').path == ('bri',)
+    assert kphue.Field('on', ('state', 'on')).path == ('state', 'on')
+    assert kphue.Field('on', ['state', 'on']).path == ('state', 'on')
+
+
+def test_decoder_converts_values():
+    decoder, encoders = kphue.compile_schema(Thing)
+    data = {'deep': [1]}
+    values = decoder({'name': 'A', 'count': '7', 'data': data,
+                      'state': {'effect': 'none', 'xy': ['0.25', 1.5]}})
+    assert values == {'name': 'A', 'count': 7, 'effect': None,
+                      'xy': [0.25, 1.0], 'data': data}
+    assert values['data'] is not data
+    assert values['data']['deep'] is not data['deep']
+    assert [(attr, path) for attr, path, encode in encoders] == [
+            ('count', ('count',)), ('effect', ('state', 'effect')),
+            ('xy', ('state', 'xy'))]
+
+
+def test_missing_values_decode_to_none():
+    decoder = kphue.compile_schema(Thing)[0]
+    assert decoder({'count': None}) == {
+            'name': None, 'count': None, 'effect': None, 'xy': None,
+            'data': None}
+    assert decoder({'state': {}})['xy'] is None
+
+
+def test_kinds_reject_bad_values():
+    decoder = kphue.compile_schema(Thing)[0]
+    with pytest.raises(ValueError):
+        decoder({'count': 'many'})
+    with pytest.raises(ValueError):
+        decoder({'state': {'xy': [0.1, 'y']}})
+    effect = kphue.FIELD_TYPES['none'][0]
+    assert effect('colorloop') == 'colorloop'
+
+
+def test_encoders_give_api_values():
+    for decode, encode in kphue.FIELD_TYPES.values():
+        assert encode(None) == 'none'
+        assert encode(5) == 5
+
+
+def test_schema_compiled_once():
+    assert kphue.compile_schema(Thing) is kphue.compile_schema(Thing)
+
+
+def test_unknown_kind_rejected():
+    class Broken(object):
+        _schema = (kphue.Field('size', kind='size'),)
+
+    with pytest.raises(KeyError):
+        kphue.compile_schema(Broken)
@@ -0,0 +1,48 @@
+"""Capturing and restoring the state of Lights.
+"""
+import kphue
+
+from fakehue import USER
+
+
+def test_restore_sends_only_differences(fake, bridge):
+    lights = fake.store['lights']
+    lights['1']['state'].update(on=True, bri=200)
+    lights['3']['state']['on'] = True
+    lights['4']['state']['on'] = True
+    bridge.refresh_lights()
+    snapshot = bridge.capture(1, 2, 3, 4)
+    lights['1']['state']['bri'] = 50
+    lights['2']['state'].update(on=True, bri=254)
+    lights['3']['state']['xy'] = [0.5, 0.4]
+    lights['5']['state']['on'] = True
+    del fake.log[:]
+    assert snapshot.restore()
+    assert [path for mode, path, body in fake.requests('GET')] == [
+            '/api/%s/lights/' % USER]
+    puts = sorted((path, kphue.json_loads(body))
+                  for mode, path, body in fake.requests('PUT'))
+    assert puts == [
+            ('/api/%s/lights/1/state' % USER, {'bri': 200}),
+            ('/api/%s/lights/2/state' % USER, {'on': False}),
+            ('/api/%s/lights/3/state' % USER, {'xy': [0.3, 0.3]}),
+            ]
+    assert lights['5']['state']['on'] is True
+
+
+def test_restore_unchanged_sends_nothing(fake, bridge):
+    snapshot = bridge.capture(bridge.lights)
+    del fake.log[:]
+    assert snapshot.restore()
+    assert fake.requests('PUT') == []
+
+
+def test_unavailable_lights_skipped(fake, bridge):
+    snapshot = bridge.capture(1, 2)
+    lights = fake.store['lights']
+    lights['1']['state'].update(on=True, reachable=False)
+    lights['2']['state']['on'] = True
+    del fake.log[:]
+    assert snapshot.restore()
+    assert [path for mode, path, body in fake.requests('PUT')] == [
+            '/api/%s/lights/2/state' % USER]
@@ -0,0 +1,88 @@
+"""Entertainment streaming.
+"""
+import socket
+import struct
+import threading
+import time
+
+import kphue
+
+
+def test_register_stores_client_key(fake, bridge, config_file):
+    bridge.register()
+    body = fake.requests('POST')[-1][2]
+    assert kphue.json_loads(body)['generateclientkey'] is True
+    entry = kphue.read_config(config_file)[fake.address]
+    assert entry['clientkey'] == '0123456789ABCDEF0123456789ABCDEF'
+    stream = kphue.EntertainmentStream(bridge, bridge.all_lights,
+                                       dtls=False)
+    assert stream.clientkey == entry['clientkey']
+
+
+def test_frames(fake, bridge):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(0.5)
+    frames = []
+
+    def receive():
+        while True:
+            try:
+                frames.append(receiver.recv(2048))
+            except socket.timeout:
+                return
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    stream = kphue.EntertainmentStream(bridge, bridge.all_lights,
+                                       rate=50, dtls=False,
+                                       address=receiver.getsockname())
+    stream.start()
+    stream.set_xy(1, [0.5, 0.25], 1.0)
+    time.sleep(1)
+    stream.stop()
+    thread.join()
+    receiver.close()
+
+    assert 35 <= len(frames) <= 55
+    frame = frames[-1]
+    assert frame[:16] == (b'HueStream\x01\x00' + struct.pack('>BHBB',
+            stream._sequence, 0, 1, 0))
+    assert len(frame) == 16 + 9 * len(bridge.lights)
+    assert frame[16:25] == struct.pack('>BHHHH', 0, 1, 0x8000, 0x4000,
+                                       0xffff)
+    puts = [body for mode, path, body in fake.requests('PUT')
+            if path.endswith('/groups/0')]
+    assert [kphue.json_loads(body) for body in puts] == [
+            {'stream': {'active': True}}, {'stream': {'active': False}}]
+
+
+class SessionError(Exception):
+    """Stands in for a DTLS error of python-mbedtls.
+    """
+
+
+class ClosedSession(object):
+    """Socket whose DTLS session was ended by the Bridge.
+    """
+    def send(self, frame):
+        raise SessionError('peer closed')
+
+    def close(self):
+        pass
+
+
+def test_dtls_error_stops_stream(fake, bridge, monkeypatch):
+    monkeypatch.setattr(kphue, '_STREAM_TLS_ERRORS', (SessionError,))
+    stream = kphue.EntertainmentStream(bridge, bridge.all_lights,
+                                       rate=50, dtls=False)
+    monkeypatch.setattr(stream, '_open_socket', ClosedSession)
+    stream.start()
+    stream._thread.join(1)
+    assert not stream._thread.is_alive()
+    assert isinstance(stream.error, SessionError)
+    assert stream.frames == 0
+    stream.stop()
+    puts = [body for mode, path, body in fake.requests('PUT')
+            if path.endswith('/groups/0')]
+    assert kphue.json_loads(puts[-1]) == {'stream': {'active': False}}
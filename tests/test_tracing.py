@@ -0,0 +1,46 @@
+"""Request tracing.
+"""
+import threading
+
+import pytest
+
+import kphue
+
+
+def test_requests_attributed_to_methods(bridge):
+    with kphue.RequestTracer() as tracer:
+        bridge.get_light('Light1').set('bri', 50)
+        bridge.refresh_lights()
+    assert 'Light.set' in tracer.stats
+    assert tracer.stats['Bridge.refresh_lights'][0] == 1
+
+
+def test_parallel_workers_traced(bridge):
+    with kphue.expect_requests(min=3, max=3) as tracer:
+        kphue.parallel_map(lambda light: light.refresh(),
+                           bridge.lights[:3])
+    assert tracer.requests == 3
+
+
+def test_other_threads_not_traced(bridge):
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            bridge.api_request('GET', 'config')
+
+    thread = threading.Thread(target=poll)
+    thread.start()
+    try:
+        with kphue.expect_requests(max=1):
+            bridge.api_request('GET', 'lights/1')
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_expect_requests_raises(bridge):
+    with pytest.raises(AssertionError):
+        with kphue.expect_requests(max=1):
+            bridge.refresh_lights()
+            bridge.refresh_groups()
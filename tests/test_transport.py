@@ -0,0 +1,60 @@
+"""Kept-alive connections and certificate pinning.
+"""
+import os
+
+import pytest
+
+import kphue
+
+from fakehue import FakeBridge, USER
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+CERT_A = (os.path.join(DATA, 'cert_a.pem'), os.path.join(DATA, 'key_a.pem'))
+CERT_B = (os.path.join(DATA, 'cert_b.pem'), os.path.join(DATA, 'key_b.pem'))
+
+
+def test_connection_reused(bridge):
+    connections = bridge.transport.connections
+    for _ in range(20):
+        bridge.api_request('GET', 'lights/1')
+    assert bridge.transport.connections == connections
+
+
+def test_idle_connection_failure_resends_get(fake, bridge):
+    bridge.api_request('GET', 'lights/1')
+    del fake.log[:]
+    fake.drop = 1
+    assert bridge.transport.request('GET', '/api/%s/lights/1' % USER)
+    assert len(fake.requests('GET')) == 2
+
+
+def test_idle_connection_failure_does_not_resend_post(fake, bridge):
+    bridge.api_request('GET', 'lights/1')
+    del fake.log[:]
+    fake.drop = 1
+    with pytest.raises(Exception):
+        bridge.transport.request('POST', '/api/%s/groups' % USER,
+                                 b'{"name": "Test", "lights": ["1"]}')
+    assert len(fake.requests('POST')) == 1
+
+
+def test_pinned_certificate(config_file):
+    fake = FakeBridge(tls=CERT_A)
+    try:
+        bridge = kphue.Bridge(ip=fake.address, user=USER,
+                              config_file=config_file, https=True)
+        port = fake.port
+    finally:
+        fake.stop()
+    pins = kphue.read_config(config_file)[kphue.PINS_KEY]
+    assert len(pins) == 1
+
+    changed = FakeBridge(port=port, tls=CERT_B)
+    try:
+        bridge.transport.close()
+        with pytest.raises(kphue.KphueCertificateError):
+            bridge.api_request('GET', 'lights/1')
+        # Says nothing about the load the Bridge can take.
+        assert bridge.dispatcher.limit.errors == 0
+    finally:
+        changed.stop()